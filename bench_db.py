@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the SQLite work done by one chat turn.
+
+Runs the database calls a chat request makes (look up the user and their
+API key, load the conversation, save both messages, read the conversation
+back, record usage) against a fresh database, twice:
+
+- before: a new connection per call with SQLite's default rollback journal
+  (SQLITE_PERSISTENT_CONNECTIONS=false)
+- after: one persistent connection per thread in WAL mode (see
+  chatbot/services/sqlite_pool.py)
+
+and reports the DB time per chat turn for each. Use --threads to run turns
+from several threads at once, as a threaded server would.
+
+Usage:
+    python bench_db.py [--turns N] [--threads N]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+CHATBOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'chatbot')
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100.0))]
+
+
+def run_worker(db_path, turns, threads):
+    """Time chat turns in this process; prints the per-turn times in ms as JSON"""
+    sys.path.insert(0, CHATBOT_DIR)
+    from services import config
+    config.SQLITE_DB_PATH = db_path
+    from services import api_manager, db
+
+    user_id = db.create_user('bench@example.com', 'x', 'bench')['inserted_id']
+    api_manager.save_api_key(user_id, 'groq', 'gsk_bench', True)
+    conversations = [db.save_conversation(user_id, 'bench', '', 'hi', 'hello')['inserted_id'] for _ in range(threads)]
+    usage = {'input_tokens': 900, 'output_tokens': 120, 'cached_tokens': 0}
+    times = []
+    lock = threading.Lock()
+
+    def turns_for(conversation_id, count):
+        samples = []
+        for _ in range(count):
+            start = time.perf_counter()
+            db.get_user_by_id(user_id)
+            key = api_manager.get_default_api_key(user_id, 'groq')
+            db.get_conversation(conversation_id, user_id)
+            db.add_message_to_conversation(conversation_id, user_id, 'user', 'What does the document say about pumps?')
+            db.add_message_to_conversation(conversation_id, user_id, 'assistant', 'It says to warm them up slowly. ' * 20)
+            db.get_conversation(conversation_id, user_id)
+            api_manager.record_api_usage(user_id, 'groq', key['id'], 'chat', usage, 'llama-3.3-70b-versatile')
+            samples.append((time.perf_counter() - start) * 1000)
+        with lock:
+            times.extend(samples)
+
+    workers = [threading.Thread(target=turns_for, args=(conversation_id, turns // threads)) for conversation_id in conversations]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    wall = time.perf_counter() - started
+    print(json.dumps({'times': times, 'wall_s': wall}))
+
+
+def bench(name, persistent, turns, threads):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, SQLITE_PERSISTENT_CONNECTIONS='true' if persistent else 'false')
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--worker', os.path.join(tmp, 'bench.db'),
+             '--turns', str(turns), '--threads', str(threads)],
+            env=env, cwd=CHATBOT_DIR, check=True, capture_output=True, text=True
+        ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    times = result['times']
+    print(f"{name:<8} mean={statistics.mean(times):7.2f} ms  p50={percentile(times, 50):7.2f} ms  "
+          f"p95={percentile(times, 95):7.2f} ms  p99={percentile(times, 99):7.2f} ms  "
+          f"throughput={len(times) / result['wall_s']:8.1f} turns/s")
+    return statistics.mean(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='DB time per chat turn, before and after persistent WAL connections')
+    parser.add_argument('--turns', type=int, default=500, help='Chat turns to run')
+    parser.add_argument('--threads', type=int, default=1, help='Threads running turns at once')
+    parser.add_argument('--worker', metavar='DB_PATH', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.turns, args.threads)
+        return
+
+    print(f"{args.turns} chat turns, {args.threads} thread(s), DB time per turn:")
+    before = bench('before', False, args.turns, args.threads)
+    after = bench('after', True, args.turns, args.threads)
+    print(f"speedup  {before / after:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Benchmark the UCR HTML parsers on the saved snapshot corpus.
+
+Checks that the targeted parser returns exactly what the BeautifulSoup
+reference parser returns for every page, then reports per-page parse time
+for both. With --browser, also loads every page in Chromium (needs
+Playwright and its browser) and checks that the in-page extraction used by
+the scraper returns what the targeted parser does, or nothing, so that the
+scraper falls back to the page HTML.
+
+Usage:
+    python bench_ucr_parse.py [snapshot_dir] [--repeat N] [--browser]
+"""
+
+import argparse
+import glob
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.append('chatbot')
+
+from chatbot.services.playwright_ucr import (
+    _EXTRACT_UCR_JS,
+    _parsed_from_extract,
+    parse_ucr_html,
+    parse_ucr_html_fast,
+    parse_ucr_html_soup,
+)
+
+
+def time_parser(parser, pages, repeat):
+    """Return per-page timings in milliseconds (best of `repeat` runs for each page)."""
+    timings = []
+    for html in pages:
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            parser(html)
+            best = min(best, time.perf_counter() - start)
+        timings.append(best * 1000)
+    return timings
+
+
+def check_in_page_extraction(paths, pages):
+    """Compare the in-page extraction with parse_ucr_html_fast; returns the number of mismatches."""
+    from playwright.sync_api import sync_playwright
+
+    mismatches = 0
+    extracted = 0
+    with sync_playwright() as p:
+        browser = p.chromium.launch()
+        # The page's own scripts and assets aren't needed to read the saved results
+        page = browser.new_page(java_script_enabled=False)
+        page.route('**/*', lambda route: route.abort())
+        for path, html in zip(paths, pages):
+            page.set_content(html)
+            result = _parsed_from_extract(page.evaluate(_EXTRACT_UCR_JS))
+            if result is None:
+                continue  # the scraper reads the page HTML instead
+            extracted += 1
+            if json.dumps(result) != json.dumps(parse_ucr_html_fast(html)):
+                mismatches += 1
+                sys.stderr.write(f"IN-PAGE MISMATCH {path}\n")
+        browser.close()
+    print(f"In-page extraction: {extracted - mismatches}/{extracted} identical to the targeted parser "
+          f"(HTML fallback on {len(pages) - extracted})")
+    return mismatches
+
+
+def summarize(name, timings):
+    ordered = sorted(timings)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print(f"{name:<8} mean={statistics.mean(timings):8.3f} ms  "
+          f"median={statistics.median(timings):8.3f} ms  p95={p95:8.3f} ms  "
+          f"total={sum(timings):9.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark UCR HTML parsers')
+    parser.add_argument('snapshot_dir', nargs='?', default='exel', help='Directory of saved UCR pages')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per page (best time is kept)')
+    parser.add_argument('--browser', action='store_true', help='Also check the in-page extraction in Chromium')
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.snapshot_dir, '*.html')))
+    if not paths:
+        print(f"No .html snapshots found in {args.snapshot_dir}")
+        sys.exit(1)
+    pages = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            pages.append(f.read())
+
+    mismatches = 0
+    fast_hits = 0
+    for path, html in zip(paths, pages):
+        expected = json.dumps(parse_ucr_html_soup(html))
+        if parse_ucr_html_fast(html) is not None:
+            fast_hits += 1
+        if json.dumps(parse_ucr_html(html)) != expected:
+            mismatches += 1
+            sys.stderr.write(f"MISMATCH {path}\n")
+
+    print(f"Pages: {len(pages)}  avg size: {sum(map(len, pages)) / len(pages) / 1024:.1f} KB")
+    print(f"Identical output: {len(pages) - mismatches}/{len(pages)}  "
+          f"(targeted path used on {fast_hits}, soup fallback on {len(pages) - fast_hits})")
+
+    if args.browser:
+        mismatches += check_in_page_extraction(paths, pages)
+
+    soup_times = time_parser(parse_ucr_html_soup, pages, args.repeat)
+    fast_times = time_parser(parse_ucr_html, pages, args.repeat)
+    summarize('soup', soup_times)
+    summarize('fast', fast_times)
+    print(f"Speedup: {sum(soup_times) / sum(fast_times):.1f}x")
+
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
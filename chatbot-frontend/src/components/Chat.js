@@ -159,19 +159,34 @@ const Chat = () => {
         api_key: selectedApiKey ? selectedApiKey.api_key : null
       };
       
-      const response = await chatService.sendMessage(payload);
-      const aiMessage = { 
-        role: 'assistant', 
-        content: response.data.response,
-        provider: response.data.provider,
-        model: response.data.model
-      };
-      setMessages(prev => [...prev, aiMessage]);
+      // Show the answer as it is generated: the first token adds the assistant message, later ones extend it
+      let started = false;
+      const updateLast = (changes) => setMessages(prev => [
+        ...prev.slice(0, -1),
+        { ...prev[prev.length - 1], ...changes }
+      ]);
+      await chatService.streamMessage(payload, (event) => {
+        if (event.type === 'token') {
+          if (!started) {
+            started = true;
+            setMessages(prev => [...prev, { role: 'assistant', content: event.text, provider: selectedProvider, model: selectedModel }]);
+          } else {
+            setMessages(prev => {
+              const last = prev[prev.length - 1];
+              return [...prev.slice(0, -1), { ...last, content: last.content + event.text }];
+            });
+          }
+        } else if (event.type === 'done') {
+          if (started) updateLast({ provider: event.provider, model: event.model });
+        } else if (event.type === 'error') {
+          setMessages(prev => [...prev, { role: 'system', content: `Error: ${event.message}` }]);
+        }
+      });
     } catch (error) {
       console.error('Error sending message:', error);
       const errorMessage = { 
         role: 'system', 
-        content: `Error: ${error.response?.data?.message || 'There was an error processing your request.'}`
+        content: `Error: ${error.response?.data?.message || error.message || 'There was an error processing your request.'}`
       };
       setMessages(prev => [...prev, errorMessage]);
     } finally {
@@ -77,6 +77,35 @@ export const documentService = {
 // Chat services
 export const chatService = {
   sendMessage: (payload) => api.post('/api/chat', payload),
+  // Streams newline-delimited JSON events from /api/chat/stream, calling onEvent for each one.
+  // Uses fetch because axios can't read a response body incrementally in the browser.
+  streamMessage: async (payload, onEvent) => {
+    const token = localStorage.getItem('token');
+    const response = await fetch(`${API_URL}/api/chat/stream`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        ...(token ? { Authorization: `Bearer ${token}` } : {}),
+      },
+      body: JSON.stringify(payload),
+    });
+    if (!response.ok) {
+      const data = await response.json().catch(() => ({}));
+      throw new Error(data.message || `Request failed with status ${response.status}`);
+    }
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    for (;;) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      const lines = buffer.split('\n');
+      buffer = lines.pop();
+      lines.filter((line) => line.trim()).forEach((line) => onEvent(JSON.parse(line)));
+    }
+    if (buffer.trim()) onEvent(JSON.parse(buffer));
+  },
 };
 
 // Web scraping services
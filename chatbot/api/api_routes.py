@@ -1,6 +1,6 @@
 from flask import Blueprint, request, jsonify
 from utils import auth_utils
-from services import api_manager
+from services import api_manager, key_scheduler, model_router, provider_clients, provider_router, quota
 
 # Create blueprint
 blueprint = Blueprint('api_keys', __name__)
@@ -13,6 +13,7 @@ def get_api_keys(current_user):
     
     # Mask API keys for security
     for key in keys:
+        key['rate_limit'] = key_scheduler.key_status(key['api_key'])
         if key['api_key']:
             prefix_length = min(4, len(key['api_key']))
             suffix_length = min(4, len(key['api_key']))
@@ -61,12 +62,9 @@ def add_api_key(current_user):
 @auth_utils.token_required
 def delete_api_key(current_user, key_id):
     """Delete an API key"""
-    # Connect to database
-    import sqlite3
-    from services import config
+    from services import sqlite_pool
     
-    conn = sqlite3.connect(config.SQLITE_DB_PATH)
-    cursor = conn.cursor()
+    cursor = sqlite_pool.connection().cursor()
     
     # Check if key belongs to user
     cursor.execute(
@@ -76,13 +74,10 @@ def delete_api_key(current_user, key_id):
     
     key = cursor.fetchone()
     if not key:
-        conn.close()
         return jsonify({'message': 'API key not found'}), 404
     
     # Delete key
     cursor.execute("DELETE FROM api_keys WHERE id = ?", (key_id,))
-    conn.commit()
-    conn.close()
     
     return jsonify({'message': 'API key deleted successfully'}), 200
 
@@ -90,37 +85,32 @@ def delete_api_key(current_user, key_id):
 @auth_utils.token_required
 def set_default_api_key(current_user, key_id):
     """Set an API key as default"""
-    # Connect to database
-    import sqlite3
-    from services import config
-    
-    conn = sqlite3.connect(config.SQLITE_DB_PATH)
-    cursor = conn.cursor()
-    
-    # Check if key belongs to user
-    cursor.execute(
-        "SELECT * FROM api_keys WHERE id = ? AND user_id = ?",
-        (key_id, str(current_user['_id']))
-    )
-    
-    key = cursor.fetchone()
-    if not key:
-        conn.close()
-        return jsonify({'message': 'API key not found'}), 404
-    
-    # Get provider
-    provider = key[2]  # provider is the 3rd column
-    
-    # Reset all defaults for this provider
-    cursor.execute(
-        "UPDATE api_keys SET is_default = 0 WHERE user_id = ? AND provider = ?",
-        (str(current_user['_id']), provider)
-    )
-    
-    # Set this key as default
-    cursor.execute("UPDATE api_keys SET is_default = 1 WHERE id = ?", (key_id,))
-    conn.commit()
-    conn.close()
+    from services import sqlite_pool
+    
+    with sqlite_pool.transaction() as conn:
+        cursor = conn.cursor()
+        
+        # Check if key belongs to user
+        cursor.execute(
+            "SELECT * FROM api_keys WHERE id = ? AND user_id = ?",
+            (key_id, str(current_user['_id']))
+        )
+        
+        key = cursor.fetchone()
+        if not key:
+            return jsonify({'message': 'API key not found'}), 404
+        
+        # Get provider
+        provider = key[2]  # provider is the 3rd column
+        
+        # Reset all defaults for this provider
+        cursor.execute(
+            "UPDATE api_keys SET is_default = 0 WHERE user_id = ? AND provider = ?",
+            (str(current_user['_id']), provider)
+        )
+        
+        # Set this key as default
+        cursor.execute("UPDATE api_keys SET is_default = 1 WHERE id = ?", (key_id,))
     
     return jsonify({'message': 'API key set as default successfully'}), 200
 
@@ -143,4 +133,36 @@ def get_providers(current_user):
     
     return jsonify({
         'providers': formatted_providers
-    }), 200 
\ No newline at end of file
+    }), 200
+
+@blueprint.route('/providers/stats', methods=['GET'])
+@auth_utils.token_required
+def get_provider_stats(current_user):
+    """Get connection-reuse stats, latency percentiles and circuit state per provider, and latency per model"""
+    return jsonify({
+        'providers': provider_clients.get_stats(),
+        'routing': provider_router.get_status(),
+        'models': model_router.get_status(),
+        'http2_available': provider_clients.HTTP2_AVAILABLE
+    }), 200
+
+@blueprint.route('/usage', methods=['GET'])
+@auth_utils.token_required
+def get_usage(current_user):
+    """Requests and tokens per day, provider and key from the daily rollups, plus remaining quotas"""
+    user_id = str(current_user['_id'])
+    try:
+        days = int(request.args.get('days', 30))
+    except ValueError:
+        return jsonify({'message': 'days must be a number'}), 400
+    days = max(1, min(days, 366))
+    
+    usage = api_manager.get_usage_summary(user_id, days)
+    usage['free_tier'] = {}
+    for provider in api_manager.AI_PROVIDERS:
+        free_tier = api_manager.get_free_tier_usage(user_id, provider)
+        if free_tier is not None:
+            usage['free_tier'][provider] = free_tier
+    usage['quota'] = quota.status(user_id)
+    
+    return jsonify(usage), 200
@@ -1,10 +1,40 @@
-from flask import Blueprint, request, jsonify
+import json
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from utils import auth_utils
-from services import ai_service, api_manager
+from services import ai_service, api_manager, config, idempotency, quota, response_cache, single_flight
 
 # Create blueprint
 blueprint = Blueprint('chat', __name__)
 
+def _quota_error(user_id, provider, requests=1):
+    """(body, headers) for a 429 if the user is over their quota for the provider, else None"""
+    if provider not in api_manager.AI_PROVIDERS:
+        return None
+    retry_after = quota.acquire(user_id, provider, requests)
+    if not retry_after:
+        return None
+    name = api_manager.AI_PROVIDERS[provider]['name']
+    return {
+        'message': f"You have reached your {name} quota. Please try again in {retry_after} seconds.",
+        'retry_after': retry_after
+    }, {'Retry-After': str(retry_after)}
+
+def _latency_target(data):
+    """(latency_target_ms, error) from a chat request body; the target is optional"""
+    value = data.get('latency_target_ms')
+    if value is None:
+        return None, None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+        return None, 'latency_target_ms must be a positive number'
+    return int(value), None
+
+def _context_mode(data):
+    """(context_mode, error) from a chat request body; defaults to 'auto'"""
+    value = data.get('context_mode', 'auto')
+    if value not in ai_service.CONTEXT_MODES:
+        return None, f"context_mode must be one of: {', '.join(ai_service.CONTEXT_MODES)}"
+    return value, None
+
 @blueprint.route('/chat', methods=['POST'])
 @auth_utils.token_required
 def chat(current_user):
@@ -15,27 +45,194 @@ def chat(current_user):
     model = data.get('model')
     api_key = data.get('api_key')
     conversation_id = data.get('conversation_id')
-    document_id = data.get('document_id')
+    # One document_id, or document_ids to search several documents at once
+    document_id = data.get('document_ids') or data.get('document_id')
+    
+    if not user_input:
+        return jsonify({'message': 'Message is required'}), 400
+    
+    user_id = str(current_user['_id'])
+    failover = data.get('failover', True)
+    latency_target_ms, error = _latency_target(data)
+    if error:
+        return jsonify({'message': error}), 400
+    context_mode, error = _context_mode(data)
+    if error:
+        return jsonify({'message': error}), 400
+    idempotency_key = request.headers.get('Idempotency-Key')
+    if idempotency_key is not None and not 0 < len(idempotency_key) <= idempotency.MAX_KEY_LENGTH:
+        return jsonify({'message': f'Idempotency-Key must be 1 to {idempotency.MAX_KEY_LENGTH} characters'}), 400
+    
+    # Identical requests in flight at the same time (double clicks, retries) share one provider call
+    request_hash = single_flight.request_key(user_id, conversation_id, user_input, context, provider, model, api_key, document_id, failover, latency_target_ms, context_mode)
+    
+    # A retry with the same Idempotency-Key gets the stored result
+    if idempotency_key:
+        stored = idempotency.get(user_id, idempotency_key)
+        if stored:
+            if stored['request_hash'] != request_hash:
+                return jsonify({'message': 'This Idempotency-Key was already used for a different request'}), 422
+            return jsonify(stored['response']), stored['status_code'], {'Idempotent-Replayed': 'true'}
+    
+    def run():
+        rejected = _quota_error(user_id, provider)
+        if rejected:
+            return rejected[0], 429, rejected[1]
+        
+        # Process chat
+        result, error = ai_service.process_chat(
+            user_id,
+            user_input,
+            context,
+            provider,
+            model,
+            api_key,
+            conversation_id,
+            document_id,
+            failover,
+            latency_target_ms,
+            context_mode
+        )
+        
+        if error:
+            return {'message': error}, 400, {}
+        if idempotency_key:
+            idempotency.save(user_id, idempotency_key, request_hash, 200, result)
+        return result, 200, {}
+    
+    (body, status, headers), _ = single_flight.do(request_hash, run)
+    return jsonify(body), status, headers
+
+@blueprint.route('/chat/stream', methods=['POST'])
+@auth_utils.token_required
+def chat_stream(current_user):
+    """Stream the AI response as newline-delimited JSON events (token / done / error)"""
+    data = request.json
+    user_input = data.get('message', '')
     
     if not user_input:
         return jsonify({'message': 'Message is required'}), 400
+    latency_target_ms, error = _latency_target(data)
+    if error:
+        return jsonify({'message': error}), 400
+    context_mode, error = _context_mode(data)
+    if error:
+        return jsonify({'message': error}), 400
+    
+    rejected = _quota_error(str(current_user['_id']), data.get('provider', 'groq'))
+    if rejected:
+        return jsonify(rejected[0]), 429, rejected[1]
     
-    # Process chat
-    result, error = ai_service.process_chat(
+    events, error = ai_service.process_chat_stream(
         str(current_user['_id']),
         user_input,
-        context,
-        provider,
-        model,
-        api_key,
-        conversation_id,
-        document_id
+        data.get('context', ''),
+        data.get('provider', 'groq'),
+        data.get('model'),
+        data.get('api_key'),
+        data.get('conversation_id'),
+        data.get('document_ids') or data.get('document_id'),
+        data.get('failover', True),
+        latency_target_ms,
+        context_mode
     )
     
     if error:
         return jsonify({'message': error}), 400
     
-    return jsonify(result), 200
+    def generate():
+        for event in events:
+            yield json.dumps(event) + '\n'
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        # Disable proxy buffering so each token reaches the browser right away
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@blueprint.route('/chat/batch', methods=['POST'])
+@auth_utils.token_required
+def chat_batch(current_user):
+    """Answer a list of questions about the same document(s) concurrently.
+
+    Returns all answers in question order, or with "stream": true, streams
+    each answer as newline-delimited JSON as soon as it is ready.
+    """
+    data = request.json or {}
+    questions = data.get('questions')
+    
+    if not isinstance(questions, list) or not questions:
+        return jsonify({'message': 'questions must be a non-empty list'}), 400
+    if not all(isinstance(q, str) and q.strip() for q in questions):
+        return jsonify({'message': 'Each question must be a non-empty string'}), 400
+    if config.QUOTA_ENABLED and 0 < config.QUOTA_REQUESTS_PER_MINUTE < len(questions):
+        return jsonify({'message': f'Too many questions: your quota allows {config.QUOTA_REQUESTS_PER_MINUTE} requests per minute.'}), 400
+    
+    # Each question counts as one request against the quota
+    rejected = _quota_error(str(current_user['_id']), data.get('provider', 'groq'), len(questions))
+    if rejected:
+        return jsonify(rejected[0]), 429, rejected[1]
+    
+    events, error = ai_service.process_chat_batch(
+        str(current_user['_id']),
+        questions,
+        data.get('provider', 'groq'),
+        data.get('model'),
+        data.get('api_key'),
+        data.get('document_ids') or data.get('document_id'),
+        bool(data.get('save_conversation', False)),
+        data.get('failover', True)
+    )
+    
+    if error:
+        return jsonify({'message': error}), 400
+    
+    if data.get('stream'):
+        def generate():
+            for event in events:
+                yield json.dumps(event) + '\n'
+        
+        return Response(
+            stream_with_context(generate()),
+            mimetype='application/x-ndjson',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+    
+    answers = []
+    done = {}
+    for event in events:
+        if event['type'] == 'answer':
+            event.pop('type')
+            answers.append(event)
+        else:
+            done = event
+    answers.sort(key=lambda answer: answer['index'])
+    return jsonify({'answers': answers, 'conversation_id': done.get('conversation_id')}), 200
+
+@blueprint.route('/chat/cache-settings', methods=['GET'])
+@auth_utils.token_required
+def get_cache_settings(current_user):
+    """Whether the current user's chats use the response cache"""
+    opted_out = response_cache.is_opted_out(str(current_user['_id']))
+    return jsonify({'cache_enabled': not opted_out}), 200
+
+@blueprint.route('/chat/cache-settings', methods=['PUT'])
+@auth_utils.token_required
+def update_cache_settings(current_user):
+    """Opt the current user in to or out of the response cache"""
+    data = request.json or {}
+    if 'cache_enabled' not in data:
+        return jsonify({'message': 'cache_enabled is required'}), 400
+    
+    response_cache.set_opt_out(str(current_user['_id']), not bool(data['cache_enabled']))
+    return jsonify({'cache_enabled': bool(data['cache_enabled'])}), 200
+
+@blueprint.route('/chat/cache-stats', methods=['GET'])
+@auth_utils.token_required
+def get_cache_stats(current_user):
+    """Response cache hit/miss metrics, and requests coalesced by single-flight, for this server process"""
+    return jsonify(dict(response_cache.get_metrics(), single_flight=single_flight.get_metrics())), 200
 
 def legacy_chat_handler():
     """Handler for the legacy /chat route"""
@@ -48,8 +245,11 @@ def legacy_chat_handler():
     if not user_input:
         return jsonify({'response': 'Please enter a message'})
     
+    if provider not in api_manager.AI_PROVIDERS:
+        return jsonify({'response': 'Invalid provider specified'})
+    
     # Create prompt
-    prompt = ai_service.create_prompt(user_input, context)
+    prompt = ai_service.create_prompt(user_input, context, provider)
     
     # Get AI response based on provider
     if provider == 'groq':
@@ -45,19 +45,20 @@ def db_status():
             }
             
         else:  # sqlite
-            import sqlite3
             from services.db import get_db_connection
             
             conn = get_db_connection()
             cursor = conn.cursor()
             cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
             tables = cursor.fetchall()
-            conn.close()
+            cursor.execute("PRAGMA journal_mode")
+            journal_mode = cursor.fetchone()[0]
             
             response["status"] = "connected"
             response["details"] = {
                 "database": config.SQLITE_DB_PATH,
-                "tables": len(tables)
+                "tables": len(tables),
+                "journal_mode": journal_mode
             }
             
         return jsonify(response), 200
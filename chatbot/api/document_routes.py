@@ -37,7 +37,8 @@ def get_documents(current_user):
             'preview': doc.get('content', ''),
             'filetype': doc['filename'].split('.')[-1] if '.' in doc['filename'] else 'unknown',
             'size': len(doc.get('full_content', doc.get('content', ''))),
-            'uploadDate': doc['created_at']
+            'uploadDate': doc['created_at'],
+            'summary_status': doc.get('summary_status')
         } for doc in user_documents]
     }), 200
 
@@ -58,5 +59,8 @@ def get_document(current_user, document_id):
         'id': str(doc['_id']),
         'filename': doc['filename'],
         'content': doc.get('full_content', doc.get('content', '')),
-        'created_at': created_at
+        'created_at': created_at,
+        'summary': doc.get('summary'),
+        'section_summaries': doc.get('section_summaries'),
+        'summary_status': doc.get('summary_status')
     }), 200 
\ No newline at end of file
@@ -2,6 +2,7 @@ from flask import Blueprint, request, jsonify
 from utils import auth_utils
 from services import scraper_service
 from services.playwright_ucr import fetch_ucr_fee, parse_ucr_html
+from services import ucr_cache
 
 # Create blueprint
 blueprint = Blueprint('scraper', __name__)
@@ -65,6 +66,15 @@ def scrape_ucr(current_user):
     if not all([acct_key, service_date, zip_code]) or (not procedure_code):
         return jsonify({'message': 'acctkey, serviceDate, zipCode and procedureCode are required'}), 400
 
+    debug = bool(data.get('debug'))
+
+    # Serve prefetched/batch results straight from the cache (debug needs the raw HTML)
+    key = ucr_cache.normalize_key(procedure_code, zip_code, service_date)
+    if key and not debug:
+        cached = ucr_cache.get_cached_result(acct_key, *key, percentile=str(percentile))
+        if cached is not None:
+            return jsonify({'data': cached, 'cached': True}), 200
+
     html, error = fetch_ucr_fee(
         acct_key=acct_key,
         service_date=service_date,
@@ -77,8 +87,9 @@ def scrape_ucr(current_user):
         return jsonify({'message': error}), 500
 
     parsed = parse_ucr_html(html or "")
+    if key:
+        ucr_cache.store_result(acct_key, *key, parsed, percentile=str(percentile))
 
-    debug = bool(data.get('debug'))
     response = {'data': parsed}
     if debug:
         response['raw_html'] = html
@@ -18,6 +18,7 @@ try:
     # Import modules
     from api import auth_routes, document_routes, conversation_routes, chat_routes, scraper_routes, api_routes, db_status_routes
     from services import config
+    from services import migrations  # applies pending SQLite schema migrations
 except Exception as e:
     logger.error(f"Error importing modules: {str(e)}")
     raise
@@ -1,7 +1,11 @@
-import requests
+import asyncio
+import httpx
 import json
+import queue
+import time
 from services import config, db
-from services import api_manager
+from services import api_manager, conversation_memory, document_summary, key_scheduler, model_router, provider_clients, provider_router, quota
+from services import response_cache, retrieval, token_budget, vector_index
 
 # Check if Ollama is available
 try:
@@ -10,7 +14,27 @@ try:
 except ImportError:
     OLLAMA_AVAILABLE = False
 
-def get_groq_response(prompt, api_key=None, model=None):
+def _messages(prompt):
+    """Chat messages for a prompt. A Prompt's stable prefix goes in the system
+    message so providers that cache prompt prefixes can reuse it."""
+    if isinstance(prompt, Prompt) and prompt.prefix:
+        return [
+            {"role": "system", "content": prompt.prefix},
+            {"role": "user", "content": prompt.suffix},
+        ]
+    return [{"role": "user", "content": prompt}]
+
+def _anthropic_payload(prompt, model):
+    """Anthropic request body, with a Prompt's prefix as a cacheable system block"""
+    data = {"model": model, "max_tokens": 1024}
+    if isinstance(prompt, Prompt) and prompt.prefix:
+        data["system"] = [{"type": "text", "text": prompt.prefix, "cache_control": {"type": "ephemeral"}}]
+        data["messages"] = [{"role": "user", "content": prompt.suffix}]
+    else:
+        data["messages"] = [{"role": "user", "content": prompt}]
+    return data
+
+async def get_groq_response_async(prompt, api_key=None, model=None):
     """Get response from Groq API using the default API key if none provided"""
     # Use provided API key, or fall back to default
     api_key = api_key or config.GROQ_API_KEY
@@ -26,9 +50,7 @@ def get_groq_response(prompt, api_key=None, model=None):
     }
     data = {
         "model": model,
-        "messages": [
-            {"role": "user", "content": prompt}
-        ],
+        "messages": _messages(prompt),
         "temperature": 0.7,  # Add temperature parameter for more stable responses
         "max_tokens": 1024   # Limit response length
     }
@@ -39,30 +61,31 @@ def get_groq_response(prompt, api_key=None, model=None):
     
     while retry_count < max_retries:
         try:
-            response = requests.post(
-                api_manager.AI_PROVIDERS['groq']['url'], 
-                headers=headers, 
-                json=data,
-                timeout=30  # Add timeout to prevent hanging requests
+            response = await provider_clients.apost_json(
+                'groq',
+                api_manager.AI_PROVIDERS['groq']['url'],
+                headers,
+                data
             )
             
             if response.status_code == 401:
-                return None, f"Authentication error: Invalid or expired API key for Groq. Please update your API key in settings."
+                return None, "Authentication error: Invalid or expired API key for Groq. Please update your API key in settings."
             
             response.raise_for_status()
             resp_json = response.json()
+            provider_clients.record_usage('groq', resp_json.get('usage'))
             return resp_json['choices'][0]['message']['content'], None
             
-        except requests.exceptions.HTTPError as e:
+        except httpx.HTTPStatusError as e:
             return None, f"HTTP error from Groq API: {str(e)}"
         
-        except requests.exceptions.ConnectionError:
+        except httpx.ConnectError:
             retry_count += 1
             if retry_count >= max_retries:
                 return None, "Connection error: Could not connect to Groq API after multiple attempts. Please check your internet connection."
             # Continue to next retry attempt
             
-        except requests.exceptions.ReadTimeout:
+        except httpx.TimeoutException:
             retry_count += 1
             if retry_count >= max_retries:
                 return None, "Timeout error: The request to Groq API timed out after multiple attempts."
@@ -74,7 +97,7 @@ def get_groq_response(prompt, api_key=None, model=None):
     # This should not be reached, but just in case
     return None, "Failed to get response from Groq API after multiple attempts."
 
-def get_openai_response(prompt, api_key, model=None):
+async def get_openai_response_async(prompt, api_key, model=None):
     """Get response from OpenAI API"""
     if not api_key:
         return None, "No OpenAI API key provided. Please add an API key in settings."
@@ -87,30 +110,28 @@ def get_openai_response(prompt, api_key, model=None):
     }
     data = {
         "model": model,
-        "messages": [
-            {
-                "role": "user",
-                "content": prompt
-            }
-        ]
+        "messages": _messages(prompt)
     }
     try:
-        response = requests.post(api_manager.AI_PROVIDERS['openai']['url'], headers=headers, json=data)
+        response = await provider_clients.apost_json('openai', api_manager.AI_PROVIDERS['openai']['url'], headers, data)
         
         if response.status_code == 401:
-            return None, f"Authentication error: Invalid or expired API key for OpenAI. Please update your API key in settings."
+            return None, "Authentication error: Invalid or expired API key for OpenAI. Please update your API key in settings."
         
         response.raise_for_status()
         resp_json = response.json()
+        provider_clients.record_usage('openai', resp_json.get('usage'))
         return resp_json['choices'][0]['message']['content'], None
-    except requests.exceptions.HTTPError as e:
+    except httpx.HTTPStatusError as e:
         return None, f"HTTP error from OpenAI API: {str(e)}"
-    except requests.exceptions.ConnectionError:
+    except httpx.ConnectError:
         return None, "Connection error: Could not connect to OpenAI API. Please check your internet connection."
+    except httpx.TimeoutException:
+        return None, "Timeout error: The request to OpenAI API timed out."
     except Exception as e:
         return None, f"Error getting response from OpenAI: {str(e)}"
 
-def get_anthropic_response(prompt, api_key, model=None):
+async def get_anthropic_response_async(prompt, api_key, model=None):
     """Get response from Anthropic API"""
     model = model or api_manager.AI_PROVIDERS['anthropic']['default_model']
     
@@ -119,92 +140,364 @@ def get_anthropic_response(prompt, api_key, model=None):
         "Content-Type": "application/json",
         "anthropic-version": "2023-06-01"
     }
-    data = {
-        "model": model,
-        "messages": [
-            {"role": "user", "content": prompt}
-        ],
-        "max_tokens": 1024
-    }
+    data = _anthropic_payload(prompt, model)
     try:
-        response = requests.post(api_manager.AI_PROVIDERS['anthropic']['url'], headers=headers, json=data)
+        response = await provider_clients.apost_json('anthropic', api_manager.AI_PROVIDERS['anthropic']['url'], headers, data)
         response.raise_for_status()
         resp_json = response.json()
+        provider_clients.record_usage('anthropic', resp_json.get('usage'))
         return resp_json['content'][0]['text'], None
+    except httpx.TimeoutException:
+        return None, "Timeout error: The request to Anthropic API timed out."
     except Exception as e:
         return None, f"Error getting response from Anthropic: {str(e)}"
 
-def get_ollama_response(prompt, model=None):
-    """Get response from local Ollama instance"""
+_ollama_client = None
+
+def _ollama():
+    """Ollama client for config.OLLAMA_HOST"""
+    global _ollama_client
+    if _ollama_client is None:
+        _ollama_client = ollama.Client(host=config.OLLAMA_HOST)
+    return _ollama_client
+
+def _ollama_usage(response):
+    """Token counts from an Ollama reply, in the OpenAI usage shape"""
+    return {'prompt_tokens': response.get('prompt_eval_count') or 0, 'completion_tokens': response.get('eval_count') or 0}
+
+async def get_ollama_response_async(prompt, model=None):
+    """Get response from local Ollama instance without blocking the event loop"""
     if not OLLAMA_AVAILABLE:
         return None, "Ollama is not available in this environment. Please use another provider instead."
     
     model = model or api_manager.AI_PROVIDERS['ollama']['default_model']
     
+    start = time.perf_counter()
     try:
-        response = ollama.chat(model=model, messages=[
-            {'role': 'user', 'content': prompt}
-        ])
-        return response['message']['content'], None
+        response = await asyncio.to_thread(_ollama().chat, model=model, messages=_messages(prompt))
     except Exception as e:
         return None, f"Error getting response from Ollama: {str(e)}"
+    provider_clients.record_local_call('ollama', (time.perf_counter() - start) * 1000, _ollama_usage(response))
+    return response['message']['content'], None
 
-def create_prompt(user_input, context):
-    """Create a prompt for the AI model"""
-    return f"""Question: {user_input}
-Based on the following context:
+async def get_provider_response_async(provider, prompt, api_key=None, model=None):
+    """Get a response from any provider; returns (text, error)"""
+    if provider == 'groq':
+        return await get_groq_response_async(prompt, api_key, model)
+    if provider == 'openai':
+        return await get_openai_response_async(prompt, api_key, model)
+    if provider == 'anthropic':
+        return await get_anthropic_response_async(prompt, api_key, model)
+    if provider == 'ollama':
+        return await get_ollama_response_async(prompt, model)
+    return None, "Invalid provider specified"
+
+async def gather_responses_async(calls):
+    """Run several provider calls concurrently.
+    
+    Each call is a dict with 'prompt' and optional 'provider' (default groq),
+    'api_key' and 'model'. Returns a list of (text, error) in the same order.
+    """
+    return await asyncio.gather(*(
+        get_provider_response_async(call.get('provider', 'groq'), call['prompt'], call.get('api_key'), call.get('model'))
+        for call in calls
+    ))
+
+# Sync facades for existing callers. The request runs on the shared provider
+# event loop, so waiting threads don't hold connections or block each other.
+
+def get_groq_response(prompt, api_key=None, model=None):
+    """Get response from Groq API using the default API key if none provided"""
+    return provider_clients.run_sync(get_groq_response_async(prompt, api_key, model))
 
-{context[:4000]}  # Limiting content length to avoid token limits
+def get_openai_response(prompt, api_key, model=None):
+    """Get response from OpenAI API"""
+    return provider_clients.run_sync(get_openai_response_async(prompt, api_key, model))
+
+def get_anthropic_response(prompt, api_key, model=None):
+    """Get response from Anthropic API"""
+    return provider_clients.run_sync(get_anthropic_response_async(prompt, api_key, model))
+
+def get_ollama_response(prompt, model=None):
+    """Get response from local Ollama instance"""
+    return provider_clients.run_sync(get_ollama_response_async(prompt, model))
+
+def fan_out(calls, timeout=None):
+    """Send several prompts, or one prompt to several providers, and wait for all of them.
+    
+    e.g. fan_out([{'provider': 'groq', 'prompt': p}, {'provider': 'openai', 'prompt': p, 'api_key': k}])
+    Returns a list of (text, error) in call order.
+    """
+    return provider_clients.run_sync(gather_responses_async(calls), timeout)
+
+class StreamError(Exception):
+    """Provider error raised while streaming; the message is shown to the user"""
+
+def _sse_events(response):
+    """Yield the JSON payloads of a server-sent event stream"""
+    for line in response.iter_lines():
+        if not line.startswith('data:'):
+            continue
+        data = line[5:].strip()
+        if data == '[DONE]':
+            break
+        if data:
+            yield json.loads(data)
+
+def _check_stream_status(response, provider_name):
+    if response.status_code == 401:
+        raise StreamError(f"Authentication error: Invalid or expired API key for {provider_name}. Please update your API key in settings.")
+    if response.status_code >= 400:
+        response.read()
+        raise StreamError(f"HTTP error from {provider_name} API: {response.status_code} {response.text[:200]}")
+
+def _stream_openai_compatible(provider, prompt, api_key, model, extra=None):
+    """Yield text deltas from an OpenAI-style chat completions stream (OpenAI, Groq)"""
+    data = {
+        "model": model,
+        "messages": _messages(prompt),
+        "stream": True
+    }
+    data.update(extra or {})
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+    }
+    with provider_clients.stream_post(provider, api_manager.AI_PROVIDERS[provider]['url'], headers, data) as response:
+        _check_stream_status(response, api_manager.AI_PROVIDERS[provider]['name'])
+        for event in _sse_events(response):
+            choices = event.get('choices') or []
+            if choices:
+                text = (choices[0].get('delta') or {}).get('content')
+                if text:
+                    yield text
+            # Usage comes in the last chunk (Groq puts it under x_groq)
+            usage = event.get('usage') or (event.get('x_groq') or {}).get('usage')
+            if usage:
+                provider_clients.record_usage(provider, usage)
+
+def stream_groq_response(prompt, api_key=None, model=None):
+    """Yield response text from Groq as it is generated"""
+    api_key = api_key or config.GROQ_API_KEY
+    if not api_key:
+        raise StreamError("No Groq API key provided. Please add an API key in settings.")
+    model = model or api_manager.AI_PROVIDERS['groq']['default_model']
+    yield from _stream_openai_compatible('groq', prompt, api_key, model, {"temperature": 0.7, "max_tokens": 1024})
+
+def stream_openai_response(prompt, api_key, model=None):
+    """Yield response text from OpenAI as it is generated"""
+    if not api_key:
+        raise StreamError("No OpenAI API key provided. Please add an API key in settings.")
+    model = model or api_manager.AI_PROVIDERS['openai']['default_model']
+    yield from _stream_openai_compatible('openai', prompt, api_key, model, {"stream_options": {"include_usage": True}})
+
+def stream_anthropic_response(prompt, api_key, model=None):
+    """Yield response text from Anthropic as it is generated"""
+    model = model or api_manager.AI_PROVIDERS['anthropic']['default_model']
+    headers = {
+        "x-api-key": api_key,
+        "Content-Type": "application/json",
+        "anthropic-version": "2023-06-01"
+    }
+    data = _anthropic_payload(prompt, model)
+    data["stream"] = True
+    usage = {}
+    with provider_clients.stream_post('anthropic', api_manager.AI_PROVIDERS['anthropic']['url'], headers, data) as response:
+        _check_stream_status(response, 'Anthropic')
+        for event in _sse_events(response):
+            if event.get('type') == 'content_block_delta':
+                text = (event.get('delta') or {}).get('text')
+                if text:
+                    yield text
+            elif event.get('type') == 'message_start':
+                # Input and cache token counts; output tokens follow in message_delta
+                usage.update((event.get('message') or {}).get('usage') or {})
+            elif event.get('type') == 'message_delta':
+                usage.update(event.get('usage') or {})
+            elif event.get('type') == 'error':
+                raise StreamError(f"Error from Anthropic: {event.get('error', {}).get('message', 'unknown error')}")
+        provider_clients.record_usage('anthropic', usage)
+
+def stream_ollama_response(prompt, model=None):
+    """Yield response text from the local Ollama instance as it is generated"""
+    if not OLLAMA_AVAILABLE:
+        raise StreamError("Ollama is not available in this environment. Please use another provider instead.")
+    model = model or api_manager.AI_PROVIDERS['ollama']['default_model']
+    start = time.perf_counter()
+    for chunk in _ollama().chat(model=model, messages=_messages(prompt), stream=True):
+        text = chunk['message']['content']
+        if text:
+            yield text
+        if chunk.get('done'):
+            # The last chunk carries the token counts
+            provider_clients.record_local_call('ollama', (time.perf_counter() - start) * 1000, _ollama_usage(chunk))
+
+class Prompt(str):
+    """A prompt string made of a stable prefix (instructions and context) and a
+    variable suffix (conversation history and question).
+    
+    It is the full prompt text wherever a string is expected, e.g. for the
+    response cache. Provider calls send the prefix and suffix as separate
+    messages so the prefix can be served from the provider's prompt cache
+    on later turns against the same document.
+    """
+    
+    def __new__(cls, prefix, suffix):
+        prompt = super().__new__(cls, prefix + "\n\n" + suffix)
+        prompt.prefix = prefix
+        prompt.suffix = suffix
+        return prompt
+
+CONTEXT_TEMPLATE = """Answer the question based on the following context:
+
+{context}
 
 Use internet and provide accurate and proper responce using the documents provided
 
 Always show the output as a list of steps to undertake."""
 
-def process_chat(user_id, user_input, context, provider='groq', model=None, api_key=None, conversation_id=None, document_id=None):
-    """Process a chat message and get AI response using the specified provider"""
-    # Ensure user_input is a string
-    user_input = str(user_input) if user_input is not None else ""
+QUESTION_TEMPLATE = """{history}Question: {question}"""
+
+HISTORY_TEMPLATE = """Conversation so far:
+{history}
+
+"""
+
+# How selected documents are put in the prompt: 'summary' uses their stored
+# summaries, 'retrieval' their best-matching chunks, and 'auto' the summaries
+# for broad questions and otherwise small documents whole, chunks of large ones
+CONTEXT_MODES = ('auto', 'summary', 'retrieval')
+
+def build_prompt(user_input, context, provider='groq', model=None, documents=None, query_hits=None, memory=None, context_mode='auto'):
+    """Create a prompt holding as much context as the model's token budget allows.
     
-    # Get document content if document_id is provided
-    if document_id:
-        doc = db.get_document(document_id, user_id)
-        if doc:
-            context = doc.get('full_content', doc.get('content', ''))
+    Returns (prompt, token_info), where prompt is a Prompt. When documents
+    are selected, the context is built from them by retrieval.fit_documents,
+    using query_hits() for the question's best-matching chunks, or from
+    their summaries by document_summary.fit_summaries (see CONTEXT_MODES).
+    memory (from conversation_memory.load) adds the conversation so far
+    ahead of the question.
+    """
+    history = conversation_memory.format_history(memory, provider, model)
+    suffix = QUESTION_TEMPLATE.format(history=HISTORY_TEMPLATE.format(history=history) if history else '', question=user_input)
+    overhead = token_budget.count_tokens(CONTEXT_TEMPLATE.format(context='') + suffix, provider, model)
+    if documents and document_summary.use_summaries(context_mode, documents, user_input):
+        context, info = document_summary.fit_summaries(documents, provider, model, overhead, context_mode == 'summary')
+    elif documents:
+        context, info = retrieval.fit_documents(documents, query_hits, provider, model, overhead, context_mode != 'retrieval')
+    else:
+        context, info = token_budget.fit_context(context or '', provider, model, overhead)
+    info['history_tokens'] = token_budget.count_tokens(history, provider, model)
+    return Prompt(CONTEXT_TEMPLATE.format(context=context), suffix), info
+
+def create_prompt(user_input, context, provider='groq', model=None):
+    """Create a prompt for the AI model"""
+    return build_prompt(user_input, context, provider, model)[0]
+
+def _prompt_builder(user_id, user_input, context, documents, memory=None, context_mode='auto'):
+    """Memoized build_prompt per (provider, model), for requests that may fail over.
     
-    # Create prompt
-    prompt = create_prompt(user_input, context)
+    The document search runs at most once per request, however many providers
+    are tried. Keyword (BM25) and semantic (vector) matches are merged.
+    """
+    built = {}
+    hits = []
     
-    # If no API key provided, try to get default for the provider
-    if not api_key and provider != 'ollama':
-        api_key_data = api_manager.get_default_api_key(user_id, provider)
-        if api_key_data:
-            api_key = api_key_data['api_key']
-            api_key_id = api_key_data.get('id')
-        else:
-            return None, f"No API key available for {provider}. Please add an API key in settings."
+    def query_hits():
+        if not hits:
+            ids = [doc['id'] for doc in documents]
+            keyword = retrieval.search(user_id, user_input, ids)
+            if vector_index.is_enabled():
+                keyword = retrieval.fuse(keyword, vector_index.search(user_id, user_input, ids))
+            hits.append(keyword)
+        return hits[0]
     
-    # Get AI response based on provider
-    if provider == 'groq':
-        response, error = get_groq_response(prompt, api_key, model)
-        if not error and api_key_id:
-            api_manager.record_api_usage(user_id, provider, api_key_id, 'chat')
-    elif provider == 'openai':
-        response, error = get_openai_response(prompt, api_key, model)
-        if not error and api_key_id:
-            api_manager.record_api_usage(user_id, provider, api_key_id, 'chat')
-    elif provider == 'anthropic':
-        response, error = get_anthropic_response(prompt, api_key, model)
-        if not error and api_key_id:
-            api_manager.record_api_usage(user_id, provider, api_key_id, 'chat')
-    elif provider == 'ollama':
-        response, error = get_ollama_response(prompt, model)
-    else:
-        return None, "Invalid provider specified"
-        
-    if error:
-        return None, error
+    def build(provider, model):
+        if (provider, model) not in built:
+            built[(provider, model)] = build_prompt(user_input, context, provider, model, documents, query_hits, memory, context_mode)
+        return built[(provider, model)]
+    return build
+
+def _document_context(document_id, user_id, context):
+    """Load the selected documents; document_id may be one id or a list of ids.
     
-    # Save conversation
+    Returns (context, documents). documents is a list of
+    {'id', 'filename', 'text', 'summary', 'section_summaries'} dicts for the
+    documents that were found (summaries are None until built), and
+    context is their joined text (stored with a new conversation). Documents
+    without a search index yet are indexed and embedded here.
+    """
+    ids = document_id if isinstance(document_id, list) else [document_id] if document_id else []
+    documents = []
+    for doc_id in dict.fromkeys(str(d) for d in ids if d):
+        doc = db.get_document(doc_id, user_id)
+        if doc:
+            text = doc.get('full_content', doc.get('content', '')) or ''
+            retrieval.ensure_indexed(doc_id, user_id, text)
+            vector_index.ensure_embedded(doc_id, user_id)
+            summarized = doc.get('summary_status') == 'done'
+            documents.append({
+                'id': doc_id,
+                'filename': doc.get('filename') or doc_id,
+                'text': text,
+                'summary': doc.get('summary') if summarized else None,
+                'section_summaries': doc.get('section_summaries') if summarized else None,
+            })
+    if documents:
+        context = '\n\n'.join(doc['text'] for doc in documents)
+    return context, documents
+
+def _check_api_key(user_id, provider, api_key):
+    """Return an error message if the user has no key to call this provider with"""
+    if api_key or provider == 'ollama':
+        return None
+    key = api_manager.get_default_api_key(user_id, provider)
+    if key and not key.get('api_key'):
+        # e.g. the system Groq key when GROQ_API_KEY isn't set; key_scheduler skips it too
+        key = None
+    if key and key.get('id') == api_manager.SYSTEM_KEY_ID and api_manager.free_tier_exhausted(user_id, provider):
+        limit = api_manager.AI_PROVIDERS[provider]['free_tier_limit']
+        return f"You have used this month's {limit} free {api_manager.AI_PROVIDERS[provider]['name']} requests. Please add your own API key in settings."
+    if key:
+        return None
+    return f"No API key available for {provider}. Please add an API key in settings."
+
+def _record_usage(user_id, winner, call, request_type='chat'):
+    """Record the winning call's token usage and charge it to the user's quota.
+
+    Keys sent with the request are recorded as 'request'.
+    """
+    provider = winner['provider']
+    api_key_id = winner['api_key_id'] or ('local' if provider == 'ollama' else 'request')
+    model = winner['model'] or api_manager.AI_PROVIDERS[provider]['default_model']
+    usage = (call or {}).get('usage')
+    api_manager.record_api_usage(user_id, provider, api_key_id, request_type, usage, model)
+    if usage:
+        quota.charge_tokens(user_id, provider, usage['input_tokens'] + usage['output_tokens'])
+
+def _choose_model(provider, model, build, has_documents, latency_target_ms):
+    """The model_router decision for a request, from the size of its prompt for the default model"""
+    tokens = build(provider, model or api_manager.AI_PROVIDERS[provider]['default_model'])[1]
+    return model_router.choose(provider, model, tokens['prompt_tokens'], bool(has_documents), latency_target_ms)
+
+def _stream_error_message(e, provider_name):
+    if isinstance(e, StreamError):
+        return str(e)
+    if isinstance(e, httpx.ConnectError):
+        return f"Connection error: Could not connect to {provider_name} API. Please check your internet connection."
+    if isinstance(e, httpx.TimeoutException):
+        return f"Timeout error: The request to {provider_name} API timed out."
+    return f"Error getting response from {provider_name}: {str(e)}"
+
+def _cache_lookup(user_id, provider, model, prompt):
+    """Return (cached_response, use_cache) for this prompt, honouring the user's opt-out"""
+    if not config.RESPONSE_CACHE_ENABLED or response_cache.is_opted_out(user_id):
+        return None, False
+    model = model or api_manager.AI_PROVIDERS[provider]['default_model']
+    return response_cache.get(provider, model, prompt), True
+
+def _save_exchange(user_id, conversation_id, user_input, response, context, document_id):
+    """Store the user message and AI response; returns the conversation id"""
     if conversation_id:
         # Add to existing conversation
         try:
@@ -213,18 +506,367 @@ def process_chat(user_id, user_input, context, provider='groq', model=None, api_
             conv = db.get_conversation(conversation_id, user_id)
             if not conv:
                 conversation_id = None
-        except Exception as e:
+        except Exception:
             conversation_id = None
     
     if not conversation_id:
         # Create new conversation
         title = user_input[:30] + ('...' if len(user_input) > 30 else '')
+        if isinstance(document_id, list):
+            # Conversations link to a single document: keep the first one selected
+            document_id = document_id[0] if document_id else None
         result = db.save_conversation(user_id, title, context, user_input, response, document_id)
         conversation_id = result["inserted_id"] if isinstance(result, dict) else result.inserted_id
     
+    return str(conversation_id)
+
+def process_chat(user_id, user_input, context, provider='groq', model=None, api_key=None, conversation_id=None, document_id=None, failover=True, latency_target_ms=None, context_mode='auto'):
+    """Process a chat message and get AI response using the specified provider.
+    
+    If the provider is slow or failing, the request is hedged or failed over
+    to other providers the user has keys for (see provider_router).
+    document_id may be a single id or a list; large documents are answered
+    from their best-matching chunks (see retrieval), or from their summaries
+    depending on context_mode (see CONTEXT_MODES). Without a model, one is
+    picked from the prompt size and latency_target_ms (see model_router).
+    """
+    # Ensure user_input is a string
+    user_input = str(user_input) if user_input is not None else ""
+    
+    if provider not in api_manager.AI_PROVIDERS:
+        return None, "Invalid provider specified"
+    
+    context, documents = _document_context(document_id, user_id, context)
+    memory = conversation_memory.load(conversation_id, user_id)
+    
+    # Create prompt, sized to each model's token budget
+    build = _prompt_builder(user_id, user_input, context, documents, memory, context_mode)
+    decision = _choose_model(provider, model, build, documents or context, latency_target_ms)
+    model = decision['model']
+    prompt, tokens = build(provider, model)
+    
+    error = _check_api_key(user_id, provider, api_key)
+    if error:
+        return None, error
+    
+    # Identical prompts are answered from the cache but still saved to the conversation
+    cached, use_cache = _cache_lookup(user_id, provider, model, prompt)
+    if cached is not None:
+        conversation_id = _save_exchange(user_id, conversation_id, user_input, cached, context, document_id)
+        return {
+            'response': cached,
+            'conversation_id': conversation_id,
+            'provider': provider,
+            'model': model,
+            'cached': True,
+            'tokens': tokens,
+            'connection': None,
+            'model_routing': decision
+        }, None
+    
+    # Get AI response, hedging / failing over to the user's other providers
+    candidates = provider_router.build_candidates(user_id, provider, model, api_key, failover)
+    started = time.perf_counter()
+    response, error, winner, routing = provider_router.route(
+        candidates, lambda p, m: build(p, m)[0], get_provider_response_async
+    )
+    provider_ms = round((time.perf_counter() - started) * 1000, 1)
+    if error:
+        model_router.record(user_id, decision, provider, model, provider_ms, False)
+        return None, error
+    
+    provider, model = winner['provider'], winner['model']
+    model_router.record(user_id, decision, provider, model, provider_ms, True)
+    prompt, tokens = build(provider, model)
+    _record_usage(user_id, winner, routing.get('connection'))
+    if use_cache:
+        response_cache.put(provider, model or api_manager.AI_PROVIDERS[provider]['default_model'], prompt, response)
+    
+    started = time.perf_counter()
+    conversation_id = _save_exchange(user_id, conversation_id, user_input, response, context, document_id)
+    db_write_ms = round((time.perf_counter() - started) * 1000, 1)
+    conversation_memory.schedule_refresh(conversation_id, user_id, provider, model, winner['api_key'], get_provider_response_async)
+    
     return {
         'response': response,
-        'conversation_id': str(conversation_id),
+        'conversation_id': conversation_id,
         'provider': provider,
-        'model': model
-    }, None 
\ No newline at end of file
+        'model': model,
+        'cached': False,
+        'tokens': tokens,
+        'connection': routing.get('connection'),
+        'routing': routing,
+        'model_routing': decision,
+        'timings': {'provider_ms': provider_ms, 'db_write_ms': db_write_ms}
+    }, None
+
+def process_chat_stream(user_id, user_input, context, provider='groq', model=None, api_key=None, conversation_id=None, document_id=None, failover=True, latency_target_ms=None, context_mode='auto'):
+    """Streaming version of process_chat.
+    
+    Returns (events, error). events is a generator of dicts:
+    {'type': 'token', 'text': ...} for each chunk, then either
+    {'type': 'done', 'conversation_id': ..., ...} once the full response has
+    been saved, or {'type': 'error', 'message': ...}. Nothing is saved if the
+    stream fails or the client goes away before the end.
+    
+    Streams are not hedged, but a provider that fails before sending its first
+    token is failed over to the next one the user has keys for.
+    """
+    user_input = str(user_input) if user_input is not None else ""
+    if provider not in api_manager.AI_PROVIDERS:
+        return None, "Invalid provider specified"
+    context, documents = _document_context(document_id, user_id, context)
+    memory = conversation_memory.load(conversation_id, user_id)
+    build = _prompt_builder(user_id, user_input, context, documents, memory, context_mode)
+    decision = _choose_model(provider, model, build, documents or context, latency_target_ms)
+    model = decision['model']
+    prompt, tokens = build(provider, model)
+    
+    error = _check_api_key(user_id, provider, api_key)
+    if error:
+        return None, error
+    
+    cached, use_cache = _cache_lookup(user_id, provider, model, prompt)
+    if cached is not None:
+        def cached_events():
+            yield {'type': 'token', 'text': cached}
+            saved_id = _save_exchange(user_id, conversation_id, user_input, cached, context, document_id)
+            yield {'type': 'done', 'conversation_id': saved_id, 'provider': provider, 'model': model, 'cached': True, 'tokens': tokens, 'connection': None, 'model_routing': decision}
+        return cached_events(), None
+    
+    candidates = provider_router.build_candidates(user_id, provider, model, api_key, failover)
+    
+    def open_stream(candidate, api_key):
+        name = candidate['provider']
+        prompt = build(name, candidate['model'])[0]
+        if name == 'groq':
+            return stream_groq_response(prompt, api_key, candidate['model'])
+        if name == 'openai':
+            return stream_openai_response(prompt, api_key, candidate['model'])
+        if name == 'anthropic':
+            return stream_anthropic_response(prompt, api_key, candidate['model'])
+        return stream_ollama_response(prompt, candidate['model'])
+    
+    def events():
+        parts = []
+        first_error = None
+        winner = None
+        started = time.perf_counter()
+        for candidate in candidates:
+            name = candidate['provider']
+            provider_name = api_manager.AI_PROVIDERS[name]['name']
+            if not candidate['keys']:
+                first_error = first_error or provider_router.rate_limited_error(name)
+                continue
+            if not provider_router.breaker.allow(name):
+                continue
+            call = None
+            for key in candidate['keys']:
+                before = provider_clients.last_call_stats()
+                key_scheduler.acquire(key['api_key'])
+                failure = None
+                try:
+                    for text in open_stream(candidate, key['api_key']):
+                        parts.append(text)
+                        yield {'type': 'token', 'text': text}
+                except GeneratorExit:
+                    provider_router.breaker.release(name)
+                    raise
+                except Exception as e:
+                    failure = e
+                finally:
+                    key_scheduler.release(key['api_key'])
+                call = provider_clients.last_call_stats()
+                call = call if call != before else None
+                key_scheduler.observe(key['api_key'], call)
+                
+                if failure is None:
+                    if parts:
+                        winner = {'provider': name, 'model': candidate['model'], 'api_key': key['api_key'], 'api_key_id': key['api_key_id']}
+                    else:
+                        first_error = first_error or f"Empty response from {provider_name}."
+                    break
+                message = _stream_error_message(failure, provider_name)
+                if parts:
+                    # Tokens already went out, so switching keys or providers would garble the reply
+                    provider_router.record_outcome(name, False, call)
+                    yield {'type': 'error', 'message': message}
+                    return
+                first_error = first_error or message
+                if not (call and call.get('status') == 429):
+                    break
+                # Rate limited before the first token: retry on the user's next key
+            provider_router.record_outcome(name, winner is not None, call)
+            if winner is not None:
+                break
+        
+        stream_ms = round((time.perf_counter() - started) * 1000, 1)
+        if winner is None:
+            model_router.record(user_id, decision, provider, model, stream_ms, False)
+            yield {'type': 'error', 'message': first_error or f"{api_manager.AI_PROVIDERS[provider]['name']} is temporarily unavailable after repeated errors. Please try again shortly."}
+            return
+        
+        response = ''.join(parts)
+        used_provider, used_model = winner['provider'], winner['model']
+        prompt, tokens = build(used_provider, used_model)
+        model_router.record(user_id, decision, used_provider, used_model, stream_ms, True)
+        _record_usage(user_id, winner, call)
+        if use_cache:
+            response_cache.put(used_provider, used_model or api_manager.AI_PROVIDERS[used_provider]['default_model'], prompt, response)
+        started = time.perf_counter()
+        saved_id = _save_exchange(user_id, conversation_id, user_input, response, context, document_id)
+        db_write_ms = round((time.perf_counter() - started) * 1000, 1)
+        conversation_memory.schedule_refresh(saved_id, user_id, used_provider, used_model, winner['api_key'], get_provider_response_async)
+        yield {
+            'type': 'done',
+            'conversation_id': saved_id,
+            'provider': used_provider,
+            'model': used_model,
+            'cached': False,
+            'failover': used_provider != provider,
+            'tokens': tokens,
+            'connection': provider_clients.last_call_stats() if used_provider != 'ollama' else None,
+            'model_routing': decision,
+            'timings': {'db_write_ms': db_write_ms}
+        }
+    
+    return events(), None
+
+# Process-wide limits on concurrent batch calls per provider. Only used on the provider loop.
+_batch_limits = {}
+
+def _batch_limit(provider):
+    if provider not in _batch_limits:
+        limit = api_manager.AI_PROVIDERS[provider].get('max_concurrency', config.BATCH_CONCURRENCY)
+        _batch_limits[provider] = asyncio.Semaphore(limit)
+    return _batch_limits[provider]
+
+async def _limited_provider_response_async(provider, prompt, api_key=None, model=None):
+    """get_provider_response_async, waiting for a free batch slot for the provider"""
+    async with _batch_limit(provider):
+        return await get_provider_response_async(provider, prompt, api_key, model)
+
+def schedule_document_summary(document_id, user_id, filename, text):
+    """Start the background map-reduce summary of a large uploaded document.
+
+    Sections go to DOCUMENT_SUMMARY_PROVIDER's fast model through the batch
+    limits, failing over like chat requests, and are recorded as 'summary'
+    usage. Returns the job's future, or None if the document is too small or
+    the user has no key to summarize it with.
+    """
+    provider = config.DOCUMENT_SUMMARY_PROVIDER
+    if provider not in api_manager.AI_PROVIDERS:
+        return None
+    info = api_manager.AI_PROVIDERS[provider]
+    model = info.get('fast_model') or info['default_model']
+    if not document_summary.needs_summary(document_id, text, provider, model):
+        return None
+    candidates = provider_router.build_candidates(user_id, provider, model)
+    if not any(candidate['keys'] for candidate in candidates):
+        return None
+
+    async def answer(prompt):
+        response, error, winner, routing = await provider_router.route_async(candidates, prompt, _limited_provider_response_async)
+        if not error:
+            await asyncio.to_thread(_record_usage, user_id, winner, routing.get('connection'), 'summary')
+        return response, error
+
+    return document_summary.schedule(document_id, user_id, filename, text, answer)
+
+def process_chat_batch(user_id, questions, provider='groq', model=None, api_key=None, document_id=None, save=False, failover=True):
+    """Answer several questions against the same documents concurrently.
+    
+    Prompts are built up front against the shared context, then sent through
+    provider_router with at most BATCH_CONCURRENCY calls in flight per
+    provider across the process. Returns (events, error). events yields
+    {'type': 'answer', 'index': ..., ...} for each question as its answer
+    arrives (cached answers first), then {'type': 'done', ...}. With save,
+    the answered questions are stored in question order in one new
+    conversation, whose id is in the done event.
+    """
+    if provider not in api_manager.AI_PROVIDERS:
+        return None, "Invalid provider specified"
+    if len(questions) > config.BATCH_MAX_QUESTIONS:
+        return None, f"Too many questions: at most {config.BATCH_MAX_QUESTIONS} per batch."
+    
+    context, documents = _document_context(document_id, user_id, '')
+    if document_id and not documents:
+        return None, "Document not found"
+    
+    error = _check_api_key(user_id, provider, api_key)
+    if error:
+        return None, error
+    
+    builders = [_prompt_builder(user_id, question, context, documents) for question in questions]
+    candidates = provider_router.build_candidates(user_id, provider, model, api_key, failover)
+    
+    def events():
+        answers = {}
+        pending = []
+        # Prompts and cache lookups run here, before anything is sent
+        for index, build in enumerate(builders):
+            prompt, tokens = build(provider, model)
+            cached, use_cache = _cache_lookup(user_id, provider, model, prompt)
+            if cached is not None:
+                answers[index] = {'type': 'answer', 'index': index, 'question': questions[index], 'response': cached,
+                                  'provider': provider, 'model': model or api_manager.AI_PROVIDERS[provider]['default_model'],
+                                  'cached': True, 'tokens': tokens}
+                yield answers[index]
+            else:
+                pending.append((index, use_cache))
+        
+        results = queue.Queue()
+        
+        async def answer(index):
+            build = builders[index]
+            try:
+                result = await provider_router.route_async(
+                    candidates, lambda p, m: build(p, m)[0], _limited_provider_response_async
+                )
+            except Exception as e:
+                # Always hand back a result, or the events loop below waits forever
+                result = (None, str(e), None, {})
+            results.put((index, result))
+        
+        async def answer_all():
+            await asyncio.gather(*(answer(index) for index, _ in pending))
+        
+        future = provider_clients.submit(answer_all()) if pending else None
+        use_cache_for = dict(pending)
+        try:
+            for _ in pending:
+                index, (response, error, winner, routing) = results.get()
+                if error:
+                    answers[index] = {'type': 'answer', 'index': index, 'question': questions[index], 'error': error}
+                else:
+                    used_provider, used_model = winner['provider'], winner['model']
+                    prompt, tokens = builders[index](used_provider, used_model)
+                    # Candidates without a model (failover, or none requested) ran the provider's default
+                    used_model = used_model or api_manager.AI_PROVIDERS[used_provider]['default_model']
+                    _record_usage(user_id, winner, routing.get('connection'), 'batch')
+                    if use_cache_for[index]:
+                        response_cache.put(used_provider, used_model, prompt, response)
+                    answers[index] = {
+                        'type': 'answer', 'index': index, 'question': questions[index], 'response': response,
+                        'provider': used_provider, 'model': used_model, 'cached': False, 'tokens': tokens,
+                        'usage': (routing.get('connection') or {}).get('usage'),
+                    }
+                yield answers[index]
+        finally:
+            # Client went away: stop the questions still in flight
+            if future is not None and not future.done():
+                future.cancel()
+        
+        conversation_id = None
+        if save:
+            for index in range(len(questions)):
+                if answers[index].get('response') is not None:
+                    conversation_id = _save_exchange(user_id, conversation_id, questions[index], answers[index]['response'], context, document_id)
+        yield {
+            'type': 'done',
+            'conversation_id': conversation_id,
+            'answered': sum(1 for a in answers.values() if a.get('response') is not None),
+            'failed': sum(1 for a in answers.values() if a.get('error')),
+        }
+    
+    return events(), None
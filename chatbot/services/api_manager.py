@@ -3,42 +3,61 @@ import json
 import datetime
 import random
 import sqlite3
-from services import config
+import threading
+import time
+from services import config, sqlite_pool
+
+# Calls on the shared system key are recorded under this key id and count against free_tier_limit
+SYSTEM_KEY_ID = 'system'
+
+# This month's system-key requests per (user_id, provider, month), as [count, read_at]
+_free_tier_used = {}
+_free_tier_lock = threading.Lock()
 
 # Define available AI providers
 AI_PROVIDERS = {
     'groq': {
         'name': 'Groq',
-        'url': 'https://api.groq.com/openai/v1/chat/completions',
-        'models': ['llama-3.3-70b-versatile', 'llama-3.1-8b-versatile'],
+        'url': config.GROQ_API_URL,
+        'models': ['llama-3.3-70b-versatile', 'llama-3.1-8b-instant'],
         'default_model': 'llama-3.3-70b-versatile',
+        'fast_model': 'llama-3.1-8b-instant',  # used for short questions when no model is requested
+        'context_windows': {'llama-3.3-70b-versatile': 131072, 'llama-3.1-8b-instant': 131072},  # tokens
+        'max_output_tokens': 1024,
         'requires_key': True,
         'header_format': 'Bearer {api_key}',
         'free_tier_limit': 100,  # requests per month
     },
     'openai': {
         'name': 'OpenAI',
-        'url': 'https://api.openai.com/v1/chat/completions',
+        'url': config.OPENAI_API_URL,
         'models': ['gpt-3.5-turbo', 'gpt-4o'],
         'default_model': 'gpt-3.5-turbo',
+        'context_windows': {'gpt-3.5-turbo': 16385, 'gpt-4o': 128000},
+        'max_output_tokens': 1024,
         'requires_key': True,
         'header_format': 'Bearer {api_key}',
         'free_tier_limit': 0,  # No free tier
     },
     'ollama': {
         'name': 'Ollama (Local)',
-        'url': 'http://localhost:11434/api/chat',
+        'url': config.OLLAMA_HOST.rstrip('/') + '/api/chat',
         'models': ['llama3', 'mistral'],
         'default_model': 'llama3',
+        'context_windows': {'llama3': 8192, 'mistral': 32768},
+        'max_output_tokens': 1024,
         'requires_key': False,
         'header_format': '',
         'free_tier_limit': float('inf'),  # Unlimited (local)
+        'max_concurrency': 1,  # one local model can only answer so many batch questions at once
     },
     'anthropic': {
         'name': 'Anthropic',
-        'url': 'https://api.anthropic.com/v1/messages',
+        'url': config.ANTHROPIC_API_URL,
         'models': ['claude-3-opus', 'claude-3-sonnet'],
         'default_model': 'claude-3-sonnet',
+        'context_windows': {'claude-3-opus': 200000, 'claude-3-sonnet': 200000},
+        'max_output_tokens': 1024,
         'requires_key': True,
         'header_format': 'x-api-key: {api_key}',
         'free_tier_limit': 0,  # No free tier
@@ -48,7 +67,7 @@ AI_PROVIDERS = {
 # Database initialization
 def init_api_db():
     """Initialize the API keys database"""
-    conn = sqlite3.connect(config.SQLITE_DB_PATH)
+    conn = sqlite_pool.connection()
     cursor = conn.cursor()
     
     # Create API keys table if it doesn't exist
@@ -82,8 +101,28 @@ def init_api_db():
     )
     ''')
     
-    conn.commit()
-    conn.close()
+    # Token breakdown per call, for tables created before it was recorded
+    cursor.execute("PRAGMA table_info(api_usage)")
+    columns = [row[1] for row in cursor.fetchall()]
+    for column, column_type in (('model', 'TEXT'), ('input_tokens', 'INTEGER DEFAULT 0'),
+                                ('output_tokens', 'INTEGER DEFAULT 0'), ('cached_tokens', 'INTEGER DEFAULT 0')):
+        if column not in columns:
+            cursor.execute(f"ALTER TABLE api_usage ADD COLUMN {column} {column_type}")
+    
+    # Daily totals per user, provider and key, kept up to date by record_api_usage
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS api_usage_daily (
+        user_id TEXT NOT NULL,
+        provider TEXT NOT NULL,
+        api_key_id TEXT NOT NULL,
+        day TEXT NOT NULL,
+        requests INTEGER NOT NULL DEFAULT 0,
+        input_tokens INTEGER NOT NULL DEFAULT 0,
+        output_tokens INTEGER NOT NULL DEFAULT 0,
+        cached_tokens INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, provider, api_key_id, day)
+    )
+    ''')
 
 # Initialize the database on import
 init_api_db()
@@ -92,34 +131,30 @@ def save_api_key(user_id, provider, api_key, is_default=False, name=None):
     """Save an API key to the database"""
     import uuid
     
-    conn = sqlite3.connect(config.SQLITE_DB_PATH)
-    cursor = conn.cursor()
-    
     key_id = str(uuid.uuid4())
     created_at = datetime.datetime.utcnow().isoformat()
     
-    # If this is set as default, unset any existing default for this provider
-    if is_default:
+    with sqlite_pool.transaction() as conn:
+        cursor = conn.cursor()
+        
+        # If this is set as default, unset any existing default for this provider
+        if is_default:
+            cursor.execute(
+                "UPDATE api_keys SET is_default = 0 WHERE user_id = ? AND provider = ?",
+                (user_id, provider)
+            )
+        
         cursor.execute(
-            "UPDATE api_keys SET is_default = 0 WHERE user_id = ? AND provider = ?",
-            (user_id, provider)
+            "INSERT INTO api_keys (id, user_id, provider, api_key, name, is_default, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key_id, user_id, provider, api_key, name, is_default, created_at)
         )
     
-    cursor.execute(
-        "INSERT INTO api_keys (id, user_id, provider, api_key, name, is_default, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
-        (key_id, user_id, provider, api_key, name, is_default, created_at)
-    )
-    
-    conn.commit()
-    conn.close()
-    
     return key_id
 
 def get_api_keys(user_id):
     """Get all API keys for a user"""
-    conn = sqlite3.connect(config.SQLITE_DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    cursor = sqlite_pool.connection().cursor()
+    cursor.row_factory = sqlite3.Row
     
     cursor.execute(
         "SELECT * FROM api_keys WHERE user_id = ? ORDER BY provider, is_default DESC",
@@ -127,15 +162,13 @@ def get_api_keys(user_id):
     )
     
     keys = [dict(row) for row in cursor.fetchall()]
-    conn.close()
     
     return keys
 
 def get_default_api_key(user_id, provider):
     """Get the default API key for a provider"""
-    conn = sqlite3.connect(config.SQLITE_DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    cursor = sqlite_pool.connection().cursor()
+    cursor.row_factory = sqlite3.Row
     
     # First try to get the user's default key for this provider
     cursor.execute(
@@ -156,41 +189,116 @@ def get_default_api_key(user_id, provider):
     # If still no key, use system default if available
     if not key and provider == 'groq':
         # Return system default key
-        conn.close()
         return {
+            'id': SYSTEM_KEY_ID,
             'provider': 'groq',
             'api_key': config.GROQ_API_KEY
         }
     
-    conn.close()
-    
     if key:
         return dict(key)
     return None
 
-def record_api_usage(user_id, provider, api_key_id, request_type, tokens_used=0):
-    """Record API usage"""
+def record_api_usage(user_id, provider, api_key_id, request_type, usage=None, model=None):
+    """Record API usage and add it to the daily rollup in the same transaction.
+    
+    usage is a provider_clients.normalize_usage dict, or None when the
+    provider didn't report token counts.
+    """
     import uuid
     
-    conn = sqlite3.connect(config.SQLITE_DB_PATH)
-    cursor = conn.cursor()
+    usage = usage or {}
+    input_tokens = usage.get('input_tokens') or 0
+    output_tokens = usage.get('output_tokens') or 0
+    cached_tokens = usage.get('cached_tokens') or 0
     
     usage_id = str(uuid.uuid4())
     timestamp = datetime.datetime.utcnow().isoformat()
     
-    cursor.execute(
-        "INSERT INTO api_usage (id, user_id, provider, api_key_id, timestamp, request_type, tokens_used) VALUES (?, ?, ?, ?, ?, ?, ?)",
-        (usage_id, user_id, provider, api_key_id, timestamp, request_type, tokens_used)
-    )
+    with sqlite_pool.transaction() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO api_usage (id, user_id, provider, api_key_id, timestamp, request_type, tokens_used, model, input_tokens, output_tokens, cached_tokens) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (usage_id, user_id, provider, api_key_id, timestamp, request_type, input_tokens + output_tokens, model, input_tokens, output_tokens, cached_tokens)
+        )
+        
+        cursor.execute(
+            """INSERT INTO api_usage_daily (user_id, provider, api_key_id, day, requests, input_tokens, output_tokens, cached_tokens)
+            VALUES (?, ?, ?, ?, 1, ?, ?, ?)
+            ON CONFLICT (user_id, provider, api_key_id, day) DO UPDATE SET
+                requests = requests + 1,
+                input_tokens = input_tokens + excluded.input_tokens,
+                output_tokens = output_tokens + excluded.output_tokens,
+                cached_tokens = cached_tokens + excluded.cached_tokens""",
+            (user_id, provider, api_key_id, timestamp[:10], input_tokens, output_tokens, cached_tokens)
+        )
+        
+        # Update usage count for the API key
+        cursor.execute(
+            "UPDATE api_keys SET usage_count = usage_count + 1, last_used = ? WHERE id = ?",
+            (timestamp, api_key_id)
+        )
+    
+    if api_key_id == SYSTEM_KEY_ID:
+        with _free_tier_lock:
+            used = _free_tier_used.get((user_id, provider, timestamp[:8] + '01'))
+            if used is not None:
+                used[0] += 1
+
+def get_usage_summary(user_id, days=30):
+    """Daily usage rollups for the last `days` days, plus totals per provider"""
+    since = (datetime.datetime.utcnow() - datetime.timedelta(days=days - 1)).strftime('%Y-%m-%d')
+    
+    cursor = sqlite_pool.connection().cursor()
+    cursor.row_factory = sqlite3.Row
     
-    # Update usage count for the API key
     cursor.execute(
-        "UPDATE api_keys SET usage_count = usage_count + 1, last_used = ? WHERE id = ?",
-        (timestamp, api_key_id)
+        "SELECT provider, api_key_id, day, requests, input_tokens, output_tokens, cached_tokens FROM api_usage_daily WHERE user_id = ? AND day >= ? ORDER BY day DESC, provider",
+        (user_id, since)
     )
+    daily = [dict(row) for row in cursor.fetchall()]
     
-    conn.commit()
-    conn.close()
+    totals = {}
+    for row in daily:
+        total = totals.setdefault(row['provider'], {'requests': 0, 'input_tokens': 0, 'output_tokens': 0, 'cached_tokens': 0})
+        for name in total:
+            total[name] += row[name]
+    
+    return {'since': since, 'daily': daily, 'totals': totals}
+
+def get_free_tier_usage(user_id, provider):
+    """This month's requests on the system key against the provider's free tier, or None if unlimited.
+
+    The count is kept in memory and re-read from the rollups every
+    QUOTA_PERSIST_SECONDS, so other workers' requests are picked up.
+    """
+    limit = AI_PROVIDERS[provider]['free_tier_limit']
+    if not limit or limit == float('inf'):
+        return None
+    month_start = datetime.datetime.utcnow().strftime('%Y-%m-01')
+    key = (user_id, provider, month_start)
+    
+    with _free_tier_lock:
+        used = _free_tier_used.get(key)
+    if used is None or time.time() - used[1] > config.QUOTA_PERSIST_SECONDS:
+        conn = sqlite_pool.connection()
+        cursor = conn.cursor()
+        
+        # At most one rollup row per day, read by primary key
+        cursor.execute(
+            "SELECT COALESCE(SUM(requests), 0) FROM api_usage_daily WHERE user_id = ? AND provider = ? AND api_key_id = ? AND day >= ?",
+            (user_id, provider, SYSTEM_KEY_ID, month_start)
+        )
+        used = [cursor.fetchone()[0], time.time()]
+        with _free_tier_lock:
+            _free_tier_used[key] = used
+    
+    return {'limit': limit, 'used': used[0], 'remaining': max(0, limit - used[0])}
+
+def free_tier_exhausted(user_id, provider):
+    """True if the user has used up this month's free requests on the system key"""
+    usage = get_free_tier_usage(user_id, provider)
+    return usage is not None and usage['remaining'] <= 0
 
 def detect_api_provider(api_key):
     """Detect which provider an API key belongs to based on its format"""
@@ -214,9 +322,8 @@ def detect_api_provider(api_key):
 
 def get_least_used_api_key(user_id, provider):
     """Get the least used API key for a provider to implement rotation"""
-    conn = sqlite3.connect(config.SQLITE_DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    cursor = sqlite_pool.connection().cursor()
+    cursor.row_factory = sqlite3.Row
     
     cursor.execute(
         "SELECT * FROM api_keys WHERE user_id = ? AND provider = ? ORDER BY usage_count ASC LIMIT 1",
@@ -224,7 +331,6 @@ def get_least_used_api_key(user_id, provider):
     )
     
     key = cursor.fetchone()
-    conn.close()
     
     if key:
         return dict(key)
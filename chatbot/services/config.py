@@ -9,15 +9,94 @@ load_dotenv()
 DB_TYPE = os.environ.get("DB_TYPE", "sqlite")  # Options: "mongodb", "sqlite"
 SQLITE_DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "chatbot.db")
 
+# SQLite connections (see sqlite_pool): one per thread, kept open, in WAL mode
+SQLITE_PERSISTENT_CONNECTIONS = os.environ.get("SQLITE_PERSISTENT_CONNECTIONS", "true").lower() == "true"  # false = a new connection per call
+SQLITE_CACHE_KB = int(os.environ.get("SQLITE_CACHE_KB", "16384"))  # page cache per connection
+SQLITE_MMAP_BYTES = int(os.environ.get("SQLITE_MMAP_BYTES", str(256 * 1024 * 1024)))  # memory-mapped reads (0 = off)
+SQLITE_BUSY_TIMEOUT = float(os.environ.get("SQLITE_BUSY_TIMEOUT", "5"))  # seconds a writer waits for the lock
+
 # MongoDB Configuration
 MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017/chatbot")
 
 # API Keys
 GROQ_API_KEY = os.environ.get("GROQ_API_KEY", "")
-GROQ_API_URL = "https://api.groq.com/openai/v1/chat/completions"
+GROQ_API_URL = os.environ.get("GROQ_API_URL", "https://api.groq.com/openai/v1/chat/completions")
 DEFAULT_MODEL = "llama-3.3-70b-versatile"
 LOCAL_MODEL = "llama3"
 
+# Provider endpoints; override to point at a local stand-in such as mock_llm_server.py
+OPENAI_API_URL = os.environ.get("OPENAI_API_URL", "https://api.openai.com/v1/chat/completions")
+ANTHROPIC_API_URL = os.environ.get("ANTHROPIC_API_URL", "https://api.anthropic.com/v1/messages")
+OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "http://localhost:11434")
+
+# LLM provider HTTP clients (one pooled keep-alive client per provider)
+PROVIDER_CONNECT_TIMEOUT = float(os.environ.get("PROVIDER_CONNECT_TIMEOUT", "5"))
+PROVIDER_READ_TIMEOUT = float(os.environ.get("PROVIDER_READ_TIMEOUT", "60"))
+PROVIDER_POOL_SIZE = int(os.environ.get("PROVIDER_POOL_SIZE", "20"))
+PROVIDER_KEEPALIVE_EXPIRY = float(os.environ.get("PROVIDER_KEEPALIVE_EXPIRY", "60"))  # seconds an idle connection is kept
+PROVIDER_HTTP2 = os.environ.get("PROVIDER_HTTP2", "false").lower() == "true"  # needs the h2 package
+
+# Provider failover, hedging and circuit breaking
+FAILOVER_ENABLED = os.environ.get("FAILOVER_ENABLED", "true").lower() == "true"  # fall back to other providers the user has keys for
+HEDGE_ENABLED = os.environ.get("HEDGE_ENABLED", "true").lower() == "true"
+HEDGE_DEFAULT_DELAY = float(os.environ.get("HEDGE_DEFAULT_DELAY", "8"))  # seconds, until a provider has enough latency samples
+HEDGE_MIN_DELAY = float(os.environ.get("HEDGE_MIN_DELAY", "1"))
+HEDGE_MIN_SAMPLES = int(os.environ.get("HEDGE_MIN_SAMPLES", "20"))
+LATENCY_WINDOW = int(os.environ.get("LATENCY_WINDOW", "200"))  # recent calls kept per provider
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.environ.get("CIRCUIT_RESET_SECONDS", "30"))
+
+# Model choice for chat requests that don't name a model (see model_router)
+MODEL_ROUTING_ENABLED = os.environ.get("MODEL_ROUTING_ENABLED", "true").lower() == "true"
+MODEL_ROUTING_SHORT_PROMPT_TOKENS = int(os.environ.get("MODEL_ROUTING_SHORT_PROMPT_TOKENS", "1000"))  # prompts up to this size use the fast model
+
+# Cap on context tokens per prompt, on top of each model's context window (0 = no cap)
+CONTEXT_TOKEN_CAP = int(os.environ.get("CONTEXT_TOKEN_CAP", "8000"))
+
+# Document retrieval (BM25 over chunks, used for selected documents larger than a few chunks)
+RETRIEVAL_TOP_K = int(os.environ.get("RETRIEVAL_TOP_K", "8"))
+RETRIEVAL_CHUNK_WORDS = int(os.environ.get("RETRIEVAL_CHUNK_WORDS", "220"))
+RETRIEVAL_CHUNK_OVERLAP = int(os.environ.get("RETRIEVAL_CHUNK_OVERLAP", "40"))  # words shared by neighbouring chunks
+RETRIEVAL_FULL_DOCUMENT_TOKENS = int(os.environ.get("RETRIEVAL_FULL_DOCUMENT_TOKENS", "2500"))  # selected documents up to this size are sent whole
+
+# Dense vector index for semantic retrieval (needs numpy), merged with the BM25 results
+VECTOR_INDEX_ENABLED = os.environ.get("VECTOR_INDEX_ENABLED", "true").lower() == "true"
+VECTOR_INDEX_DIR = os.environ.get("VECTOR_INDEX_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), "vector_index"))
+VECTOR_DIM = int(os.environ.get("VECTOR_DIM", "512"))
+VECTOR_IVF_MIN_ROWS = int(os.environ.get("VECTOR_IVF_MIN_ROWS", "20000"))  # build IVF partitions once a user has this many chunks
+VECTOR_IVF_NPROBE = int(os.environ.get("VECTOR_IVF_NPROBE", "16"))  # partitions scanned per query
+
+# Conversation memory: recent turns sent verbatim, older ones as a rolling summary
+CONVERSATION_MEMORY_TURNS = int(os.environ.get("CONVERSATION_MEMORY_TURNS", "4"))  # 0 = no history in prompts
+CONVERSATION_MEMORY_TOKENS = int(os.environ.get("CONVERSATION_MEMORY_TOKENS", "1500"))  # cap on the history block
+CONVERSATION_SUMMARY_WORDS = int(os.environ.get("CONVERSATION_SUMMARY_WORDS", "150"))
+
+# Map-reduce summaries of large documents, built in the background at upload (see document_summary)
+DOCUMENT_SUMMARY_ENABLED = os.environ.get("DOCUMENT_SUMMARY_ENABLED", "true").lower() == "true"
+DOCUMENT_SUMMARY_MIN_TOKENS = int(os.environ.get("DOCUMENT_SUMMARY_MIN_TOKENS", "8000"))  # smaller documents aren't summarized
+DOCUMENT_SUMMARY_SECTION_WORDS = int(os.environ.get("DOCUMENT_SUMMARY_SECTION_WORDS", "2000"))  # words per summarized section
+DOCUMENT_SUMMARY_SECTION_SUMMARY_WORDS = int(os.environ.get("DOCUMENT_SUMMARY_SECTION_SUMMARY_WORDS", "120"))
+DOCUMENT_SUMMARY_WORDS = int(os.environ.get("DOCUMENT_SUMMARY_WORDS", "250"))  # length of the overall summary
+DOCUMENT_SUMMARY_PROVIDER = os.environ.get("DOCUMENT_SUMMARY_PROVIDER", "groq")  # summaries use its fast model
+
+# Batch question answering (/api/chat/batch)
+BATCH_MAX_QUESTIONS = int(os.environ.get("BATCH_MAX_QUESTIONS", "50"))
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "4"))  # concurrent calls per provider, across all batches
+
+# Per-user quotas for each provider, enforced in memory (0 = unlimited)
+QUOTA_ENABLED = os.environ.get("QUOTA_ENABLED", "true").lower() == "true"
+QUOTA_REQUESTS_PER_MINUTE = int(os.environ.get("QUOTA_REQUESTS_PER_MINUTE", "60"))
+QUOTA_TOKENS_PER_DAY = int(os.environ.get("QUOTA_TOKENS_PER_DAY", "500000"))
+QUOTA_PERSIST_SECONDS = float(os.environ.get("QUOTA_PERSIST_SECONDS", "30"))  # how often bucket levels are saved
+
+# Seconds a result stored under an Idempotency-Key header is replayed for
+IDEMPOTENCY_TTL = int(os.environ.get("IDEMPOTENCY_TTL", "86400"))
+
+# Response cache for repeated chat prompts
+RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_TTL = int(os.environ.get("RESPONSE_CACHE_TTL", "86400"))  # seconds
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "512"))  # in-process LRU size
+
 # JWT Configuration
 JWT_SECRET_KEY = os.environ.get("JWT_SECRET_KEY", "your-secret-key-change-in-production")
 JWT_ACCESS_TOKEN_EXPIRES = 86400  # 24 hours in seconds
@@ -0,0 +1,129 @@
+"""Bounded conversation memory for chat prompts.
+
+A prompt carries the last CONVERSATION_MEMORY_TURNS turns of the conversation
+word for word, plus a rolling summary of everything before them. The summary
+and the number of messages it covers are stored on the conversation row.
+After each turn, a background task on the provider event loop folds the
+messages that have left the window into the summary. The history block is
+capped at CONVERSATION_MEMORY_TOKENS, so prompts stay the same size however
+long a conversation runs.
+"""
+import asyncio
+import logging
+import threading
+
+from services import config, db, provider_clients, token_budget
+
+logger = logging.getLogger(__name__)
+
+# Share of the history budget kept for the summary; the rest is split between recent messages
+SUMMARY_SHARE = 0.25
+
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between a user and an assistant.
+
+Current summary:
+{summary}
+
+New messages:
+{messages}
+
+Rewrite the summary so it also covers the new messages. Keep the facts, names, numbers, decisions and open questions a reader would need to continue the conversation. Use at most {words} words. Reply with the summary only."""
+
+_lock = threading.Lock()
+_refreshing = set()
+
+
+def load(conversation_id, user_id):
+    """Summary and recent messages of a conversation, as a dict, or None"""
+    if not conversation_id or config.CONVERSATION_MEMORY_TURNS <= 0:
+        return None
+    try:
+        conversation = db.get_conversation(conversation_id, user_id)
+    except Exception:
+        return None
+    if not conversation:
+        return None
+    messages = conversation.get('messages') or []
+    return {
+        'summary': conversation.get('summary') or '',
+        'recent': messages[-2 * config.CONVERSATION_MEMORY_TURNS:],
+        'message_count': len(messages),
+    }
+
+
+def _format_message(message):
+    speaker = 'User' if message['role'] == 'user' else 'Assistant'
+    return f"{speaker}: {message['content']}"
+
+
+def format_history(memory, provider, model=None):
+    """The history block for a prompt, trimmed to CONVERSATION_MEMORY_TOKENS"""
+    if not memory or not (memory['summary'] or memory['recent']):
+        return ''
+    budget = config.CONVERSATION_MEMORY_TOKENS
+    parts = []
+    if memory['summary']:
+        summary_budget = int(budget * SUMMARY_SHARE)
+        parts.append("Summary of earlier messages: " + token_budget.truncate_to_tokens(memory['summary'], summary_budget, provider, model))
+        budget -= summary_budget
+    if memory['recent']:
+        # Long messages are cut so every recent message gets its share
+        per_message = budget // len(memory['recent'])
+        for message in memory['recent']:
+            text = _format_message(message)
+            if token_budget.count_tokens(text, provider, model) > per_message:
+                text = token_budget.truncate_to_tokens(text, per_message, provider, model) + ' ...'
+            parts.append(text)
+    return '\n'.join(parts)
+
+
+async def refresh_summary(conversation_id, user_id, provider, model, api_key, call_provider):
+    """Fold messages that have left the recent window into the stored summary.
+
+    call_provider(provider, prompt, api_key, model) must be a coroutine
+    returning (text, error). Failures are logged and retried after the next turn.
+    """
+    conversation = await asyncio.to_thread(db.get_conversation, conversation_id, user_id)
+    if not conversation:
+        return False
+    messages = conversation.get('messages') or []
+    done = conversation.get('summarized_count') or 0
+    pending = messages[done:len(messages) - 2 * config.CONVERSATION_MEMORY_TURNS]
+    if not pending:
+        return False
+
+    prompt = SUMMARY_PROMPT.format(
+        summary=conversation.get('summary') or '(none yet)',
+        messages='\n'.join(_format_message(m) for m in pending),
+        words=config.CONVERSATION_SUMMARY_WORDS,
+    )
+    summary, error = await call_provider(provider, prompt, api_key, model)
+    if error or not summary:
+        logger.warning("Could not update summary of conversation %s: %s", conversation_id, error)
+        return False
+    await asyncio.to_thread(
+        db.update_conversation_summary, conversation_id, user_id, summary.strip(), done + len(pending)
+    )
+    return True
+
+
+def schedule_refresh(conversation_id, user_id, provider, model, api_key, call_provider):
+    """Refresh the summary in the background after a turn; one refresh per conversation at a time"""
+    if not conversation_id or config.CONVERSATION_MEMORY_TURNS <= 0:
+        return None
+    with _lock:
+        if conversation_id in _refreshing:
+            return None
+        _refreshing.add(conversation_id)
+
+    async def run():
+        try:
+            return await refresh_summary(conversation_id, user_id, provider, model, api_key, call_provider)
+        except Exception as e:
+            logger.warning("Summary refresh for conversation %s failed: %s", conversation_id, e)
+            return False
+        finally:
+            with _lock:
+                _refreshing.discard(conversation_id)
+
+    return provider_clients.submit(run())
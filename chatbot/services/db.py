@@ -13,20 +13,20 @@ if config.DB_TYPE == "mongodb":
         add_message_to_conversation,
         get_user_conversations,
         get_conversation,
+        update_conversation_summary,
+        update_document_summary,
         save_scraped_content
     )
 else:
     # SQLite implementation (existing code)
     import datetime
-    import sqlite3
     import json
     import uuid
+    from services import sqlite_pool
     
-    # Database connection function
+    # Database connection function: the calling thread's persistent connection
     def get_db_connection():
-        conn = sqlite3.connect(config.SQLITE_DB_PATH)
-        conn.row_factory = sqlite3.Row
-        return conn
+        return sqlite_pool.connection()
     
     # Initialize database
     def init_db():
@@ -56,10 +56,20 @@ else:
             full_content TEXT,
             source_url TEXT,
             created_at TEXT NOT NULL,
+            summary TEXT,
+            section_summaries TEXT,
+            summary_status TEXT,
             FOREIGN KEY (user_id) REFERENCES users (id)
         )
         ''')
         
+        # Add the upload-time summary columns to databases created before they existed
+        cursor.execute("PRAGMA table_info(documents)")
+        columns = [row[1] for row in cursor.fetchall()]
+        for column in ('summary', 'section_summaries', 'summary_status'):
+            if column not in columns:
+                cursor.execute(f"ALTER TABLE documents ADD COLUMN {column} TEXT")
+        
         # Create conversations table
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS conversations (
@@ -69,11 +79,21 @@ else:
             context TEXT,
             document_id TEXT,
             created_at TEXT NOT NULL,
+            summary TEXT,
+            summarized_count INTEGER DEFAULT 0,
             FOREIGN KEY (user_id) REFERENCES users (id),
             FOREIGN KEY (document_id) REFERENCES documents (id)
         )
         ''')
         
+        # Add the rolling summary columns to databases created before they existed
+        cursor.execute("PRAGMA table_info(conversations)")
+        columns = [row[1] for row in cursor.fetchall()]
+        if 'summary' not in columns:
+            cursor.execute("ALTER TABLE conversations ADD COLUMN summary TEXT")
+        if 'summarized_count' not in columns:
+            cursor.execute("ALTER TABLE conversations ADD COLUMN summarized_count INTEGER DEFAULT 0")
+        
         # Create messages table
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS messages (
@@ -85,9 +105,6 @@ else:
             FOREIGN KEY (conversation_id) REFERENCES conversations (id)
         )
         ''')
-        
-        conn.commit()
-        conn.close()
     
     # Initialize the database on import
     init_db()
@@ -113,22 +130,17 @@ else:
             (user_id, email, password_hash, username, username, created_at)
         )
         
-        conn.commit()
-        conn.close()
-        
         return {"inserted_id": user_id}
     
     def get_user_by_email(email):
         """Get a user by email"""
         conn = get_db_connection()
-        conn.row_factory = dict_factory
         cursor = conn.cursor()
+        cursor.row_factory = dict_factory
         
         cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
         user = cursor.fetchone()
         
-        conn.close()
-        
         if user:
             user['_id'] = user['id']
         
@@ -137,14 +149,12 @@ else:
     def get_user_by_id(user_id):
         """Get a user by ID"""
         conn = get_db_connection()
-        conn.row_factory = dict_factory
         cursor = conn.cursor()
+        cursor.row_factory = dict_factory
         
         cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
         user = cursor.fetchone()
         
-        conn.close()
-        
         if user:
             user['_id'] = user['id']
         
@@ -165,16 +175,13 @@ else:
             (doc_id, user_id, filename, file_path, preview, content, created_at)
         )
         
-        conn.commit()
-        conn.close()
-        
         return {"inserted_id": doc_id}
     
     def get_user_documents(user_id):
         """Get all documents for a user"""
         conn = get_db_connection()
-        conn.row_factory = dict_factory
         cursor = conn.cursor()
+        cursor.row_factory = dict_factory
         
         cursor.execute(
             "SELECT * FROM documents WHERE user_id = ? ORDER BY created_at DESC", 
@@ -182,19 +189,18 @@ else:
         )
         documents_list = cursor.fetchall()
         
-        conn.close()
-        
         # Add _id field for compatibility with MongoDB version
         for doc in documents_list:
             doc['_id'] = doc['id']
+            doc['section_summaries'] = json.loads(doc['section_summaries']) if doc.get('section_summaries') else None
         
         return documents_list
     
     def get_document(doc_id, user_id):
         """Get a document by ID and user ID"""
         conn = get_db_connection()
-        conn.row_factory = dict_factory
         cursor = conn.cursor()
+        cursor.row_factory = dict_factory
         
         cursor.execute(
             "SELECT * FROM documents WHERE id = ? AND user_id = ?", 
@@ -202,51 +208,60 @@ else:
         )
         document = cursor.fetchone()
         
-        conn.close()
-        
         if document:
             document['_id'] = document['id']
+            document['section_summaries'] = json.loads(document['section_summaries']) if document.get('section_summaries') else None
         
         return document
     
-    # Conversation Functions
-    def save_conversation(user_id, title, context, user_message, assistant_response, document_id=None):
-        """Save a new conversation"""
+    def update_document_summary(doc_id, user_id, status, summary=None, section_summaries=None):
+        """Store a document's upload-time summaries and the state of the job making them"""
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        conversation_id = str(uuid.uuid4())
-        created_at = datetime.datetime.utcnow().isoformat()
-        
         cursor.execute(
-            "INSERT INTO conversations (id, user_id, title, context, document_id, created_at) VALUES (?, ?, ?, ?, ?, ?)",
-            (conversation_id, user_id, title, context, document_id, created_at)
-        )
-        
-        # Save user message
-        message_id = str(uuid.uuid4())
-        cursor.execute(
-            "INSERT INTO messages (id, conversation_id, role, content, timestamp) VALUES (?, ?, ?, ?, ?)",
-            (message_id, conversation_id, "user", user_message, created_at)
+            "UPDATE documents SET summary = ?, section_summaries = ?, summary_status = ? WHERE id = ? AND user_id = ?",
+            (summary, json.dumps(section_summaries) if section_summaries is not None else None, status, doc_id, user_id)
         )
+        updated = cursor.rowcount > 0
         
-        # Save assistant response
-        response_id = str(uuid.uuid4())
-        cursor.execute(
-            "INSERT INTO messages (id, conversation_id, role, content, timestamp) VALUES (?, ?, ?, ?, ?)",
-            (response_id, conversation_id, "assistant", assistant_response, datetime.datetime.utcnow().isoformat())
-        )
+        return updated
+    
+    # Conversation Functions
+    def save_conversation(user_id, title, context, user_message, assistant_response, document_id=None):
+        """Save a new conversation"""
+        conversation_id = str(uuid.uuid4())
+        created_at = datetime.datetime.utcnow().isoformat()
         
-        conn.commit()
-        conn.close()
+        # The conversation and its first two messages are written together
+        with sqlite_pool.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "INSERT INTO conversations (id, user_id, title, context, document_id, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (conversation_id, user_id, title, context, document_id, created_at)
+            )
+            
+            # Save user message
+            message_id = str(uuid.uuid4())
+            cursor.execute(
+                "INSERT INTO messages (id, conversation_id, role, content, timestamp) VALUES (?, ?, ?, ?, ?)",
+                (message_id, conversation_id, "user", user_message, created_at)
+            )
+            
+            # Save assistant response
+            response_id = str(uuid.uuid4())
+            cursor.execute(
+                "INSERT INTO messages (id, conversation_id, role, content, timestamp) VALUES (?, ?, ?, ?, ?)",
+                (response_id, conversation_id, "assistant", assistant_response, datetime.datetime.utcnow().isoformat())
+            )
         
         return {"inserted_id": conversation_id}
     
     def add_message_to_conversation(conversation_id, user_id, role, content):
         """Add a message to an existing conversation"""
         conn = get_db_connection()
-        conn.row_factory = dict_factory
         cursor = conn.cursor()
+        cursor.row_factory = dict_factory
         
         # Check if conversation exists and belongs to user
         cursor.execute(
@@ -256,7 +271,6 @@ else:
         conversation = cursor.fetchone()
         
         if not conversation:
-            conn.close()
             return False
         
         message_id = str(uuid.uuid4())
@@ -267,16 +281,13 @@ else:
             (message_id, conversation_id, role, content, timestamp)
         )
         
-        conn.commit()
-        conn.close()
-        
         return True
     
     def get_user_conversations(user_id):
         """Get all conversations for a user"""
         conn = get_db_connection()
-        conn.row_factory = dict_factory
         cursor = conn.cursor()
+        cursor.row_factory = dict_factory
         
         cursor.execute(
             "SELECT * FROM conversations WHERE user_id = ? ORDER BY created_at DESC",
@@ -284,8 +295,6 @@ else:
         )
         conversations_list = cursor.fetchall()
         
-        conn.close()
-        
         # Add _id field for compatibility with MongoDB version
         for conv in conversations_list:
             conv['_id'] = conv['id']
@@ -295,8 +304,8 @@ else:
     def get_conversation(conversation_id, user_id):
         """Get a conversation by ID with its messages"""
         conn = get_db_connection()
-        conn.row_factory = dict_factory
         cursor = conn.cursor()
+        cursor.row_factory = dict_factory
         
         # Get conversation
         cursor.execute(
@@ -306,7 +315,6 @@ else:
         conversation = cursor.fetchone()
         
         if not conversation:
-            conn.close()
             return None
         
         # Get messages
@@ -316,14 +324,25 @@ else:
         )
         messages_list = cursor.fetchall()
         
-        conn.close()
-        
         # Add messages to conversation
         conversation['messages'] = messages_list
         conversation['_id'] = conversation['id']
         
         return conversation
     
+    def update_conversation_summary(conversation_id, user_id, summary, summarized_count):
+        """Store the rolling summary of a conversation's older messages"""
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute(
+            "UPDATE conversations SET summary = ?, summarized_count = ? WHERE id = ? AND user_id = ?",
+            (summary, summarized_count, conversation_id, user_id)
+        )
+        updated = cursor.rowcount > 0
+        
+        return updated
+    
     def save_scraped_content(user_id, url, content):
         """Save scraped web content as a document"""
         conn = get_db_connection()
@@ -339,7 +358,4 @@ else:
             (doc_id, user_id, f"Scraped: {filename}", url, preview, content, created_at)
         )
         
-        conn.commit()
-        conn.close()
-        
         return {"inserted_id": doc_id} 
\ No newline at end of file
@@ -2,7 +2,7 @@ import os
 from PyPDF2 import PdfReader
 from docx import Document as DocxDocument
 from werkzeug.utils import secure_filename
-from services import config, db
+from services import ai_service, config, db, retrieval, vector_index
 
 def allowed_file(filename):
     """Check if a file has an allowed extension"""
@@ -72,9 +72,18 @@ def process_uploaded_file(file, user_id):
         
     # Save document metadata to database
     result = db.save_document(user_id, filename, file_path, text)
+    doc_id = str(result["inserted_id"]) if isinstance(result, dict) else str(result.inserted_id)
+    
+    # Chunk, index and embed it for retrieval at chat time
+    retrieval.index_document(doc_id, user_id, text)
+    vector_index.add_document(doc_id, user_id)
+    
+    # Large documents are summarized in the background for broad questions
+    summary_job = ai_service.schedule_document_summary(doc_id, user_id, filename, text)
     
     return {
-        'id': str(result["inserted_id"]) if isinstance(result, dict) else str(result.inserted_id),
+        'id': doc_id,
         'filename': filename,
-        'preview': text[:200] + '...' if len(text) > 200 else text
+        'preview': text[:200] + '...' if len(text) > 200 else text,
+        'summary_status': 'pending' if summary_job else None
     }, None 
\ No newline at end of file
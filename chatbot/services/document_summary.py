@@ -0,0 +1,167 @@
+"""Upload-time summaries of large documents.
+
+When a document of DOCUMENT_SUMMARY_MIN_TOKENS or more is uploaded, a
+background job on the provider event loop splits it into sections of
+DOCUMENT_SUMMARY_SECTION_WORDS words and summarizes them in parallel (map),
+then folds the section summaries into one overall summary (reduce), in
+several rounds if they don't fit in one prompt. Both are stored on the
+document with a summary_status of pending, done or failed.
+
+At chat time, broad questions about a summarized document ("what is this
+document about?") are answered from the overall summary instead of from
+retrieved passages, and context_mode 'summary' sends the section summaries
+too (see fit_summaries).
+"""
+import asyncio
+import logging
+import re
+import threading
+
+from services import config, db, provider_clients, retrieval, token_budget
+
+logger = logging.getLogger(__name__)
+
+SECTION_PROMPT = """Summarize this part of the document "{filename}" in at most {words} words. Keep the names, numbers, definitions and conclusions a reader would need.
+
+{text}
+
+Reply with the summary only."""
+
+REDUCE_PROMPT = """Below are summaries of consecutive parts of the document "{filename}". Combine them into one summary of at most {words} words covering what the document is about, how it is organised and its key points.
+
+{summaries}
+
+Reply with the summary only."""
+
+# Questions about a document as a whole rather than a detail in it
+BROAD_QUESTION_RE = re.compile(
+    r"\b(summar\w*|overview|gist|tl;?dr|outline)\b"
+    r"|\b(main|key) (point|idea|topic|theme|takeaway|finding|argument)s?\b"
+    r"|\bwhat('s| is) (this|the) (document|file|paper|pdf|text|report|book)\b"
+    r"|\bwhat (is|are) (it|this|these|they) about\b",
+    re.IGNORECASE,
+)
+
+_lock = threading.Lock()
+_running = set()
+
+
+def needs_summary(document_id, text, provider, model=None):
+    """True if a document is large enough to be worth summarizing at upload"""
+    if not config.DOCUMENT_SUMMARY_ENABLED or not text:
+        return False
+    return token_budget.document_token_count(document_id, text, provider, model) >= config.DOCUMENT_SUMMARY_MIN_TOKENS
+
+
+def is_broad_question(question):
+    return bool(BROAD_QUESTION_RE.search(question or ''))
+
+
+def _reduce_groups(summaries):
+    """Split summaries into runs of at most DOCUMENT_SUMMARY_SECTION_WORDS words, at least two per run"""
+    groups, current, words = [], [], 0
+    for summary in summaries:
+        length = len(summary.split())
+        if len(current) >= 2 and words + length > config.DOCUMENT_SUMMARY_SECTION_WORDS:
+            groups.append(current)
+            current, words = [], 0
+        current.append(summary)
+        words += length
+    if len(current) == 1 and groups:
+        groups[-1].append(current[0])
+    elif current:
+        groups.append(current)
+    return groups
+
+
+async def summarize(document_id, user_id, filename, text, answer):
+    """Map-reduce summary of a document, stored on it. Returns True on success.
+
+    answer(prompt) must be a coroutine returning (text, error).
+    """
+    sections = retrieval.chunk_text(text, config.DOCUMENT_SUMMARY_SECTION_WORDS, 0)
+
+    async def run(prompt):
+        summary, error = await answer(prompt)
+        if error or not summary:
+            raise RuntimeError(error or "empty summary")
+        return summary.strip()
+
+    try:
+        # Map: every section at once; the provider layer limits concurrency
+        section_summaries = await asyncio.gather(*(
+            run(SECTION_PROMPT.format(filename=filename, words=config.DOCUMENT_SUMMARY_SECTION_SUMMARY_WORDS, text=section))
+            for section in sections
+        ))
+        # Reduce: fold neighbouring summaries together until one is left
+        summaries = list(section_summaries)
+        while len(summaries) > 1:
+            summaries = await asyncio.gather(*(
+                run(REDUCE_PROMPT.format(filename=filename, words=config.DOCUMENT_SUMMARY_WORDS, summaries='\n\n'.join(group)))
+                for group in _reduce_groups(summaries)
+            ))
+    except Exception as e:
+        logger.warning("Could not summarize document %s: %s", document_id, e)
+        await asyncio.to_thread(db.update_document_summary, document_id, user_id, 'failed')
+        return False
+
+    sections = [{'section': i + 1, 'summary': summary} for i, summary in enumerate(section_summaries)]
+    await asyncio.to_thread(db.update_document_summary, document_id, user_id, 'done', summaries[0], sections)
+    return True
+
+
+def schedule(document_id, user_id, filename, text, answer):
+    """Summarize a document in the background; returns the job's future, or None if one is running"""
+    with _lock:
+        if document_id in _running:
+            return None
+        _running.add(document_id)
+    db.update_document_summary(document_id, user_id, 'pending')
+
+    async def job():
+        try:
+            return await summarize(document_id, user_id, filename, text, answer)
+        finally:
+            with _lock:
+                _running.discard(document_id)
+
+    return provider_clients.submit(job())
+
+
+def use_summaries(context_mode, documents, question):
+    """Whether a chat should be answered from the documents' summaries"""
+    if context_mode == 'retrieval' or not documents:
+        return False
+    if not all(doc.get('summary') for doc in documents):
+        return False
+    return context_mode == 'summary' or is_broad_question(question)
+
+
+def fit_summaries(documents, provider, model, overhead_tokens, include_sections=False):
+    """Build a prompt context from document summaries.
+
+    Sends each document's overall summary, and with include_sections also
+    its section summaries while they fit the budget. Returns (context, info)
+    like retrieval.fit_documents.
+    """
+    budget = token_budget.context_budget(provider, model, overhead_tokens)
+    blocks = [f"Summary of {doc['filename']}:\n{doc['summary']}" for doc in documents]
+    used = token_budget.count_tokens('\n\n'.join(blocks), provider, model)
+    sections_sent = 0
+    if include_sections:
+        for doc in documents:
+            for section in doc.get('section_summaries') or []:
+                block = f"[{doc['filename']}, section {section['section']}]\n{section['summary']}"
+                tokens = token_budget.count_tokens(block + '\n\n', provider, model)
+                if used + tokens > budget:
+                    break
+                blocks.append(block)
+                used += tokens
+                sections_sent += 1
+    context = '\n\n'.join(blocks)
+    if used > budget:
+        context, info = token_budget.fit_context(context, provider, model, overhead_tokens)
+    else:
+        info = token_budget.budget_info(provider, model, budget, overhead_tokens, used, False)
+    info['retrieval'] = {'mode': 'summary', 'documents': len(documents), 'sections': sections_sent}
+    return context, info
@@ -0,0 +1,57 @@
+"""Stored results for requests sent with an Idempotency-Key header.
+
+A client that retries a request with the same key gets the stored response
+instead of a second provider call and a second saved message. A key is
+bound to a hash of the request it was first used with; reusing it for a
+different request is an error. Stored results expire after IDEMPOTENCY_TTL
+seconds.
+"""
+import json
+import time
+
+from services import config, sqlite_pool
+
+MAX_KEY_LENGTH = 255
+
+
+def init_idempotency_db():
+    """Create the idempotency key table"""
+    conn = sqlite_pool.connection()
+    cursor = conn.cursor()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS idempotency_keys (
+        user_id TEXT NOT NULL,
+        idempotency_key TEXT NOT NULL,
+        request_hash TEXT NOT NULL,
+        status_code INTEGER NOT NULL,
+        response TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        PRIMARY KEY (user_id, idempotency_key)
+    )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created_at ON idempotency_keys (created_at)")
+
+# Initialize the table on import
+init_idempotency_db()
+
+
+def get(user_id, key):
+    """The stored result for a key as {'request_hash', 'status_code', 'response'}, or None"""
+    row = sqlite_pool.connection().execute(
+        "SELECT request_hash, status_code, response FROM idempotency_keys WHERE user_id = ? AND idempotency_key = ? AND created_at > ?",
+        (user_id, key, time.time() - config.IDEMPOTENCY_TTL)
+    ).fetchone()
+    if not row:
+        return None
+    return {'request_hash': row[0], 'status_code': row[1], 'response': json.loads(row[2])}
+
+
+def save(user_id, key, request_hash, status_code, response):
+    """Store a request's result under its key, dropping expired keys"""
+    now = time.time()
+    with sqlite_pool.transaction() as conn:
+        conn.execute("DELETE FROM idempotency_keys WHERE created_at <= ?", (now - config.IDEMPOTENCY_TTL,))
+        conn.execute(
+            "INSERT OR REPLACE INTO idempotency_keys (user_id, idempotency_key, request_hash, status_code, response, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (user_id, key, request_hash, status_code, json.dumps(response), now)
+        )
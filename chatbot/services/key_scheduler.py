@@ -0,0 +1,185 @@
+"""Spreads chat requests across all of a user's API keys for a provider.
+
+Each key has an in-memory budget filled from the provider's rate-limit
+response headers: remaining requests and tokens, plus when each resets.
+Keys with no budget left, or in a cool-down after a 429, are skipped until
+their reset time. The remaining keys are tried least-busy first. When a
+request gets a 429, it is retried on the next key.
+
+Budgets are keyed by a fingerprint of the key itself, so the system Groq key
+and keys passed directly in a request are tracked too.
+"""
+import hashlib
+import re
+import threading
+import time
+from datetime import datetime
+
+from services import api_manager
+
+_lock = threading.Lock()
+_budgets = {}
+
+# Retry-After fallback when a 429 carries no reset information
+DEFAULT_COOLDOWN = 10.0
+
+
+def fingerprint(api_key):
+    return hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()[:16]
+
+
+def _budget(api_key):
+    fp = fingerprint(api_key)
+    budget = _budgets.get(fp)
+    if budget is None:
+        budget = _budgets[fp] = {
+            'remaining_requests': None,
+            'remaining_tokens': None,
+            'requests_reset_at': 0.0,
+            'tokens_reset_at': 0.0,
+            'blocked_until': 0.0,
+            'inflight': 0,
+            'last_picked': 0.0,
+        }
+    return budget
+
+
+def parse_reset(value, now=None):
+    """Turn a reset header into an absolute timestamp.
+
+    Handles OpenAI/Groq durations ("1m30.5s", "250ms"), plain seconds and
+    Anthropic's RFC 3339 timestamps. Returns None if the value can't be read.
+    """
+    now = time.time() if now is None else now
+    value = (value or '').strip()
+    if not value:
+        return None
+    try:
+        return now + float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r'(\d+(?:\.\d+)?)(ms|h|m|s)', value)
+    if parts and ''.join(n + u for n, u in parts) == value:
+        scale = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+        return now + sum(float(n) * scale[u] for n, u in parts)
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return None
+
+
+def _int(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def observe(api_key, call):
+    """Update a key's budget from the stats of a call made with it"""
+    if not api_key or not call:
+        return
+    headers = call.get('rate_limit') or {}
+    now = time.time()
+
+    def header(*names):
+        for name in names:
+            if name in headers:
+                return headers[name]
+        return None
+
+    with _lock:
+        budget = _budget(api_key)
+        remaining = _int(header('x-ratelimit-remaining-requests', 'anthropic-ratelimit-requests-remaining'))
+        if remaining is not None:
+            budget['remaining_requests'] = remaining
+        remaining = _int(header('x-ratelimit-remaining-tokens', 'anthropic-ratelimit-tokens-remaining'))
+        if remaining is not None:
+            budget['remaining_tokens'] = remaining
+        reset = parse_reset(header('x-ratelimit-reset-requests', 'anthropic-ratelimit-requests-reset'), now)
+        if reset is not None:
+            budget['requests_reset_at'] = reset
+        reset = parse_reset(header('x-ratelimit-reset-tokens', 'anthropic-ratelimit-tokens-reset'), now)
+        if reset is not None:
+            budget['tokens_reset_at'] = reset
+
+        if call.get('status') == 429:
+            retry_at = parse_reset(header('retry-after'), now)
+            if retry_at is None:
+                retry_at = max(budget['requests_reset_at'], budget['tokens_reset_at'], now + DEFAULT_COOLDOWN)
+            budget['blocked_until'] = retry_at
+
+
+def available_at(api_key, now=None):
+    """When this key can next be used (<= now if it can be used right away)"""
+    now = time.time() if now is None else now
+    with _lock:
+        budget = _budget(api_key)
+        ready = budget['blocked_until']
+        if budget['remaining_requests'] == 0 and budget['requests_reset_at'] > now:
+            ready = max(ready, budget['requests_reset_at'])
+        if budget['remaining_tokens'] == 0 and budget['tokens_reset_at'] > now:
+            ready = max(ready, budget['tokens_reset_at'])
+        return ready
+
+
+def ordered_keys(user_id, provider):
+    """Usable keys for a provider, best first, as {'api_key', 'api_key_id'} dicts.
+
+    Falls back to the provider's default key (e.g. the system Groq key) when
+    the user has saved none. Exhausted keys are left out.
+    """
+    if provider == 'ollama':
+        return [{'api_key': None, 'api_key_id': None}]
+    saved = [k for k in api_manager.get_api_keys(user_id) if k['provider'] == provider and k['api_key']]
+    if not saved:
+        default = api_manager.get_default_api_key(user_id, provider)
+        saved = [default] if default and default.get('api_key') else []
+        if saved and default.get('id') == api_manager.SYSTEM_KEY_ID and api_manager.free_tier_exhausted(user_id, provider):
+            saved = []
+    keys = [{'api_key': k['api_key'], 'api_key_id': k.get('id'), 'usage_count': k.get('usage_count') or 0} for k in saved]
+    return order(keys)
+
+
+def order(keys):
+    """Drop exhausted keys and sort the rest: fewest in-flight requests, then least recently picked, then least used"""
+    now = time.time()
+    usable = [k for k in keys if available_at(k['api_key'], now) <= now]
+    with _lock:
+        usable.sort(key=lambda k: (
+            _budget(k['api_key'])['inflight'],
+            _budget(k['api_key'])['last_picked'],
+            k.get('usage_count', 0),
+        ))
+    return [{'api_key': k['api_key'], 'api_key_id': k.get('api_key_id')} for k in usable]
+
+
+def acquire(api_key):
+    with _lock:
+        budget = _budget(api_key)
+        budget['inflight'] += 1
+        budget['last_picked'] = time.time()
+        # Count the request against the budget until the next response refreshes it
+        if budget['remaining_requests']:
+            budget['remaining_requests'] -= 1
+
+
+def release(api_key):
+    with _lock:
+        budget = _budget(api_key)
+        budget['inflight'] = max(0, budget['inflight'] - 1)
+
+
+def key_status(api_key):
+    """Budget snapshot for one key (for the API key settings page)"""
+    now = time.time()
+    ready = available_at(api_key, now)
+    with _lock:
+        budget = dict(_budget(api_key))
+    return {
+        'remaining_requests': budget['remaining_requests'],
+        'remaining_tokens': budget['remaining_tokens'],
+        'inflight': budget['inflight'],
+        'available': ready <= now,
+        'available_in': round(max(0.0, ready - now), 1),
+    }
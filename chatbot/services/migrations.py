@@ -0,0 +1,95 @@
+"""Versioned changes to the SQLite schema.
+
+Each module still creates its own tables on import. Changes to tables that
+already exist in deployed databases (indexes, and new columns from here on)
+are listed in MIGRATIONS with a version number. migrate() applies the ones
+a database hasn't had yet, in version order, each in its own transaction,
+and records them in the schema_version table.
+
+A migration is left pending while any table it touches doesn't exist yet,
+e.g. the documents and conversations tables with DB_TYPE=mongodb.
+test_query_plans.py checks that the hot queries use these indexes.
+"""
+import datetime
+import logging
+import re
+
+from services import sqlite_pool
+# Not used here: imported so their tables exist (they are created on import)
+# before the migrations that change them run
+from services import api_manager, db, response_cache, retrieval  # noqa: F401
+
+logger = logging.getLogger(__name__)
+
+# (version, name, statements); never edit a released migration, add a new one
+MIGRATIONS = [
+    (1, 'Indexes for per-user listings, conversation messages and API key lookups', [
+        # WHERE user_id = ? ORDER BY created_at DESC
+        "CREATE INDEX IF NOT EXISTS idx_documents_user_created ON documents (user_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_conversations_user_created ON conversations (user_id, created_at)",
+        # WHERE conversation_id = ? ORDER BY timestamp
+        "CREATE INDEX IF NOT EXISTS idx_messages_conversation_timestamp ON messages (conversation_id, timestamp)",
+        # WHERE user_id = ? [AND provider = ? [AND is_default = 1]] ORDER BY provider, is_default DESC
+        "CREATE INDEX IF NOT EXISTS idx_api_keys_user_provider_default ON api_keys (user_id, provider, is_default DESC)",
+    ]),
+    (2, 'Indexes for retrieval statistics and response cache expiry', [
+        # WHERE user_id = ? [AND document_id IN (...)], on every document search
+        "CREATE INDEX IF NOT EXISTS idx_doc_index_stats_user ON doc_index_stats (user_id)",
+        # DELETE ... WHERE created_at < ?, on every cache store
+        "CREATE INDEX IF NOT EXISTS idx_response_cache_created ON response_cache (created_at)",
+    ]),
+]
+
+_TABLE_RE = re.compile(r'\bON (\w+)')
+
+
+def init_migrations_db():
+    """Create the schema version table"""
+    sqlite_pool.connection().execute('''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TEXT NOT NULL
+    )
+    ''')
+
+
+def applied_versions():
+    return {row[0] for row in sqlite_pool.connection().execute("SELECT version FROM schema_version")}
+
+
+def current_version():
+    """The highest migration applied to this database, 0 if none"""
+    return max(applied_versions(), default=0)
+
+
+def migrate():
+    """Apply pending migrations in order; returns the versions applied"""
+    init_migrations_db()
+    conn = sqlite_pool.connection()
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    done = applied_versions()
+    applied = []
+    for version, name, statements in MIGRATIONS:
+        if version in done:
+            continue
+        missing = {table for statement in statements for table in _TABLE_RE.findall(statement)} - tables
+        if missing:
+            logger.info("Schema migration %s left pending: no %s table", version, ', '.join(sorted(missing)))
+            continue
+        with sqlite_pool.transaction() as conn:
+            # Another process may have applied it since we looked
+            if conn.execute("SELECT 1 FROM schema_version WHERE version = ?", (version,)).fetchone():
+                continue
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(
+                "INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                (version, name, datetime.datetime.utcnow().isoformat())
+            )
+        logger.info("Applied schema migration %s: %s", version, name)
+        applied.append(version)
+    return applied
+
+# Bring the schema up to date on import
+migrate()
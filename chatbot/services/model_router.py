@@ -0,0 +1,137 @@
+"""Picks the model for a chat request that doesn't name one.
+
+Providers can list a faster 'fast_model' next to their default model in
+AI_PROVIDERS. Short questions without a document go to the fast model.
+Document questions and long prompts go to the default model, unless the
+request sets latency_target_ms and the default model's recent median
+latency is over it. A model named in the request is always used.
+
+Every decision is written to model_routing_log with the latency the call
+achieved, so the thresholds can be tuned from data. Recent latencies per
+model are also kept in memory, seeded from the log on first use.
+"""
+import logging
+import sqlite3
+import threading
+import time
+
+from services import api_manager, config, provider_router, sqlite_pool, token_budget
+
+logger = logging.getLogger(__name__)
+
+latency = provider_router.LatencyTracker(config.LATENCY_WINDOW)
+_warmed = False
+_lock = threading.Lock()
+
+
+def init_routing_db():
+    """Create the routing log table"""
+    conn = sqlite_pool.connection()
+    cursor = conn.cursor()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS model_routing_log (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT,
+        provider TEXT NOT NULL,
+        requested_model TEXT,
+        model TEXT NOT NULL,
+        reason TEXT NOT NULL,
+        prompt_tokens INTEGER,
+        has_documents BOOLEAN,
+        latency_target_ms INTEGER,
+        latency_ms REAL,
+        ok BOOLEAN,
+        created_at REAL NOT NULL
+    )
+    ''')
+
+# Initialize the table on import
+init_routing_db()
+
+
+def _key(provider, model):
+    return f"{provider}:{model}"
+
+
+def _warm():
+    """Load recent latencies from the log once per process"""
+    global _warmed
+    with _lock:
+        if _warmed:
+            return
+        _warmed = True
+    try:
+        rows = sqlite_pool.connection().execute(
+            "SELECT provider, model, latency_ms FROM model_routing_log WHERE ok = 1 AND latency_ms IS NOT NULL ORDER BY id DESC LIMIT ?",
+            (config.LATENCY_WINDOW * 4,)
+        ).fetchall()
+    except sqlite3.Error:
+        return
+    for provider, model, latency_ms in reversed(rows):
+        latency.record(_key(provider, model), latency_ms / 1000.0)
+
+
+def _fits(provider, model, prompt_tokens):
+    """True if the prompt and a full reply fit in the model's context window"""
+    return prompt_tokens + token_budget.max_output_tokens(provider) <= token_budget.context_window(provider, model)
+
+
+def choose(provider, requested_model, prompt_tokens, has_documents, latency_target_ms=None):
+    """Pick a model; returns a decision dict with 'model' and 'reason'"""
+    decision = {
+        'model': requested_model,
+        'reason': 'requested',
+        'requested_model': requested_model,
+        'prompt_tokens': prompt_tokens,
+        'has_documents': has_documents,
+        'latency_target_ms': latency_target_ms,
+    }
+    if requested_model:
+        return decision
+
+    _warm()
+    default = api_manager.AI_PROVIDERS[provider]['default_model']
+    fast = api_manager.AI_PROVIDERS[provider].get('fast_model')
+    decision['model'] = default
+    if not config.MODEL_ROUTING_ENABLED or not fast or fast == default:
+        decision['reason'] = 'default'
+    elif not _fits(provider, fast, prompt_tokens):
+        decision['reason'] = 'too_long_for_fast_model'
+    elif not has_documents and prompt_tokens <= config.MODEL_ROUTING_SHORT_PROMPT_TOKENS:
+        decision.update(model=fast, reason='short_prompt')
+    elif latency_target_ms and (latency.percentile(_key(provider, default), 50) or 0) * 1000 > latency_target_ms:
+        decision.update(model=fast, reason='latency_target')
+    else:
+        decision['reason'] = 'document' if has_documents else 'long_prompt'
+    return decision
+
+
+def record(user_id, decision, provider, model, latency_ms, ok):
+    """Log a decision with the provider and model that answered and how long it took"""
+    model = model or api_manager.AI_PROVIDERS[provider]['default_model']
+    if ok and latency_ms is not None:
+        latency.record(_key(provider, model), latency_ms / 1000.0)
+    logger.info(
+        "Model routing: %s %s (%s, %s prompt tokens) answered in %s ms",
+        provider, model, decision['reason'], decision['prompt_tokens'], latency_ms,
+    )
+    try:
+        sqlite_pool.connection().execute(
+            "INSERT INTO model_routing_log (user_id, provider, requested_model, model, reason, prompt_tokens, has_documents, latency_target_ms, latency_ms, ok, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (user_id, provider, decision['requested_model'], model, decision['reason'], decision['prompt_tokens'],
+             decision['has_documents'], decision['latency_target_ms'], latency_ms, ok, time.time())
+        )
+    except sqlite3.Error as e:
+        logger.warning("Could not write model routing log: %s", e)
+
+
+def get_status():
+    """Median and p95 latency per provider model, in ms"""
+    status = {}
+    for provider, info in api_manager.AI_PROVIDERS.items():
+        for model in info['models']:
+            p50 = latency.percentile(_key(provider, model), 50)
+            p95 = latency.percentile(_key(provider, model), 95)
+            if p50 is not None:
+                status[_key(provider, model)] = {'p50_ms': round(p50 * 1000, 1), 'p95_ms': round(p95 * 1000, 1)}
+    return status
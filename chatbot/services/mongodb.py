@@ -204,6 +204,22 @@ def get_conversation(conversation_id, user_id):
     
     return conversation
 
+def update_conversation_summary(conversation_id, user_id, summary, summarized_count):
+    """Store the rolling summary of a conversation's older messages"""
+    result = conversations.update_one(
+        {"_id": conversation_id, "user_id": user_id},
+        {"$set": {"summary": summary, "summarized_count": summarized_count}}
+    )
+    return result.matched_count > 0
+
+def update_document_summary(doc_id, user_id, status, summary=None, section_summaries=None):
+    """Store a document's upload-time summaries and the state of the job making them"""
+    result = documents.update_one(
+        {"_id": doc_id, "user_id": user_id},
+        {"$set": {"summary": summary, "section_summaries": section_summaries, "summary_status": status}}
+    )
+    return result.matched_count > 0
+
 def save_scraped_content(user_id, url, content):
     """Save scraped web content as a document"""
     filename = url.split("//")[-1].split("/")[0]
@@ -1,11 +1,30 @@
-from typing import Tuple, Optional, Dict, Any
+from typing import Tuple, Optional, Dict, Any, List
+from contextlib import asynccontextmanager
 import asyncio
+import logging
+import os
+from html import unescape
 
 from playwright.sync_api import sync_playwright
 from playwright.async_api import async_playwright
 from bs4 import BeautifulSoup
 import re
 
+from .ucr_logging import get_logger
+
+logger = get_logger("playwright")
+
+# psutil is optional; without it RSS is read from /proc (Linux only)
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
+# Recycling thresholds for long-running batches (see UCRBrowserPool)
+UCR_MAX_PAGES_PER_CONTEXT = int(os.environ.get("UCR_MAX_PAGES_PER_CONTEXT", "25"))
+UCR_MAX_BROWSER_RSS_MB = int(os.environ.get("UCR_MAX_BROWSER_RSS_MB", "768"))
+
 
 def fetch_ucr_fee(
     acct_key: str,
@@ -24,139 +43,290 @@ def fetch_ucr_fee(
     try:
         with sync_playwright() as p:
             browser = p.chromium.launch(headless=True)
-            context = browser.new_context()
-            page = context.new_page()
-
-            page.goto(url, wait_until="domcontentloaded")
-
-            # Attempt to find the actual content frame robustly
-            def find_middle_frame():
-                # Prefer frame by URL pattern first
-                for f in page.frames:
-                    u = (getattr(f, "url", "") or "").lower()
-                    n = (getattr(f, "name", "") or "").lower()
-                    if "/welcome.html/getbody" in u:
-                        return f
-                    if n == "middle" or "body" in n:
-                        return f
-                return None
-
-            middle = None
-            for _ in range(20):  # wait up to ~5s
-                middle = find_middle_frame()
-                if middle:
-                    break
-                page.wait_for_timeout(250)
-
-            # Last-resort: try to switch via frame_locator (some pages delay names)
-            if middle is None:
-                try:
-                    page.frame_locator("iframe[name=middle]")
-                    for f in page.frames:
-                        if (f.name or "").lower() == "middle":
-                            middle = f
-                            break
-                except Exception:
-                    pass
+            try:
+                context = browser.new_context()
+                page = context.new_page()
 
-            if middle is None:
-                html = page.content()
-                browser.close()
-                return None, "Unable to locate middle frame on UCR page"
+                page.goto(url, wait_until="domcontentloaded")
 
-            # Helpers to robustly target varying selector names
-            def fill_first(value: str, selectors: list[str], wait_ms: int = 8000) -> None:
-                last_err = None
-                for sel in selectors:
-                    try:
-                        middle.wait_for_selector(sel, timeout=wait_ms)
-                        middle.fill(sel, value)
-                        return
-                    except Exception as e:
-                        last_err = e
-                if last_err:
-                    raise last_err
-
-            def select_first(value: str, selectors: list[str], wait_ms: int = 8000) -> None:
-                last_err = None
-                for sel in selectors:
+                # Attempt to find the actual content frame robustly
+                def find_middle_frame():
+                    # Prefer frame by URL pattern first
+                    for f in page.frames:
+                        u = (getattr(f, "url", "") or "").lower()
+                        n = (getattr(f, "name", "") or "").lower()
+                        if "/welcome.html/getbody" in u:
+                            return f
+                        if n == "middle" or "body" in n:
+                            return f
+                    return None
+
+                middle = None
+                for _ in range(20):  # wait up to ~5s
+                    middle = find_middle_frame()
+                    if middle:
+                        break
+                    page.wait_for_timeout(250)
+
+                # Last-resort: try to switch via frame_locator (some pages delay names)
+                if middle is None:
                     try:
-                        middle.wait_for_selector(sel, timeout=wait_ms)
+                        page.frame_locator("iframe[name=middle]")
+                        for f in page.frames:
+                            if (f.name or "").lower() == "middle":
+                                middle = f
+                                break
+                    except Exception:
+                        pass
+
+                if middle is None:
+                    return None, "Unable to locate middle frame on UCR page"
+
+                # Helpers to robustly target varying selector names
+                def fill_first(value: str, selectors: list[str], wait_ms: int = 8000) -> None:
+                    last_err = None
+                    for sel in selectors:
                         try:
-                            middle.select_option(sel, value=value)
-                            return
-                        except Exception:
-                            middle.select_option(sel, label=f"{value}th Percentile")
+                            middle.wait_for_selector(sel, timeout=wait_ms)
+                            middle.fill(sel, value)
                             return
-                    except Exception as e:
-                        last_err = e
-                if last_err:
-                    raise last_err
-
-            # Fill out the form fields with resilient selectors
-            fill_first(service_date, [
-                'input[name="serviceDate"]',
-                'input[name="Sdate"]',
-                '#serviceDate',
-                'input[placeholder*="Service"]',
-            ])
-
-            fill_first(procedure_code, [
-                'input[name="procedureCode"]',
-                'input[name="cpt"]',
-                '#procedureCode',
-            ])
-
-            fill_first(zip_code, [
-                'input[name="zipCode"]',
-                'input[name="zip"]',
-                '#zipCode',
-            ])
-
-            # Percentile handling: site returns 50-95 automatically; dropdown is only 25-45
-            if str(percentile) in {"25", "30", "35", "40", "45"}:
-                # Only attempt selection when in the supported dropdown range
-                try:
-                    # Ensure element is interactable
-                    middle.click('select[name="percentile"], #percentile, select', timeout=5000)
-                except Exception:
-                    pass
-                select_first(str(percentile), [
-                    'select[name="percentile"]',
-                    '#percentile',
-                    'select',
+                        except Exception as e:
+                            last_err = e
+                    if last_err:
+                        raise last_err
+
+                def select_first(value: str, selectors: list[str], wait_ms: int = 8000) -> None:
+                    last_err = None
+                    for sel in selectors:
+                        try:
+                            middle.wait_for_selector(sel, timeout=wait_ms)
+                            try:
+                                middle.select_option(sel, value=value)
+                                return
+                            except Exception:
+                                middle.select_option(sel, label=f"{value}th Percentile")
+                                return
+                        except Exception as e:
+                            last_err = e
+                    if last_err:
+                        raise last_err
+
+                # Fill out the form fields with resilient selectors
+                fill_first(service_date, [
+                    'input[name="serviceDate"]',
+                    'input[name="Sdate"]',
+                    '#serviceDate',
+                    'input[placeholder*="Service"]',
                 ])
-            # else: skip selecting; server will return 50-95 by default
 
-            # Submit
-            try:
-                middle.click('input[type="submit"], input[value="Submit"], button:has-text("Submit")')
-            except Exception:
-                # try pressing Enter in last field
-                middle.press('input[name="zipCode"], input[name="zip"]', 'Enter')
+                fill_first(procedure_code, [
+                    'input[name="procedureCode"]',
+                    'input[name="cpt"]',
+                    '#procedureCode',
+                ])
 
-            # Wait until the loading message is gone or a likely result appears
-            try:
-                middle.wait_for_timeout(800)  # brief settle
-                # Prefer a table-like element, else disappearance of loading text
-                middle.wait_for_selector("table, #resultsDiv, .table", timeout=max(timeout_ms, 20000))
-            except Exception:
+                fill_first(zip_code, [
+                    'input[name="zipCode"]',
+                    'input[name="zip"]',
+                    '#zipCode',
+                ])
+
+                # Percentile handling: site returns 50-95 automatically; dropdown is only 25-45
+                if str(percentile) in {"25", "30", "35", "40", "45"}:
+                    # Only attempt selection when in the supported dropdown range
+                    try:
+                        # Ensure element is interactable
+                        middle.click('select[name="percentile"], #percentile, select', timeout=5000)
+                    except Exception:
+                        pass
+                    select_first(str(percentile), [
+                        'select[name="percentile"]',
+                        '#percentile',
+                        'select',
+                    ])
+                # else: skip selecting; server will return 50-95 by default
+
+                # Submit
                 try:
-                    middle.wait_for_selector(
-                        'text=/^(?:(?!Loading your estimated charge).)*$/',
-                        timeout=timeout_ms,
-                    )
+                    middle.click('input[type="submit"], input[value="Submit"], button:has-text("Submit")')
                 except Exception:
-                    pass
+                    # try pressing Enter in last field
+                    middle.press('input[name="zipCode"], input[name="zip"]', 'Enter')
 
-            html = middle.content()
-            browser.close()
-            return html, None
+                # Wait until the loading message is gone or a likely result appears
+                try:
+                    middle.wait_for_timeout(800)  # brief settle
+                    # Prefer a table-like element, else disappearance of loading text
+                    middle.wait_for_selector("table, #resultsDiv, .table", timeout=max(timeout_ms, 20000))
+                except Exception:
+                    try:
+                        middle.wait_for_selector(
+                            'text=/^(?:(?!Loading your estimated charge).)*$/',
+                            timeout=timeout_ms,
+                        )
+                    except Exception:
+                        pass
+
+                html = middle.content()
+                return html, None
+            finally:
+                # Every exit path (early return or exception) must tear the browser down
+                browser.close()
     except Exception as e:
         return None, str(e)
 
 
 # ---- Async Playwright version that fills by IDs and submits form reliably ----
+async def _submit_ucr_form(
+    page,
+    acct_key: str,
+    service_date: str,
+    procedure_code: str,
+    zip_code: str,
+    percentile: str,
+    timeout_ms: int,
+) -> None:
+    """Submit the UCR form on an already-open page and wait for the results."""
+    # Go directly to the middle frame content instead of the frameset
+    url = f"https://www.feeinfo.com/DecisionPointUCR/welcome.html/getBody/?acctkey={acct_key}"
+    await page.goto(url, timeout=timeout_ms)
+    await page.wait_for_load_state("domcontentloaded")
+
+    # Fill fields directly by IDs present on the frame page
+    # These exist on the middle frame content page too when navigated directly
+    try:
+        await page.fill("#servicedate", service_date)
+        await page.fill("#procCode", procedure_code)
+        await page.fill("#zip", zip_code)
+        if percentile in {"25", "30", "35", "40", "45"}:
+            await page.select_option("#percentile", percentile)
+        else:
+            # Default to All so 50–95 are returned
+            await page.select_option("#percentile", "All")
+    except Exception:
+        pass
+
+    # Submit via button then wait for results containers
+    try:
+        await page.click("#submitBtn")
+    except Exception:
+        # JS fallback
+        await page.evaluate(
+            "() => { const f=document.forms['search']; if(f){ if(f.requestSubmit) f.requestSubmit(); else f.submit(); }}"
+        )
+
+    try:
+        await page.wait_for_selector("#fulltablediv, #filtertablediv", timeout=timeout_ms)
+    except Exception:
+        # Fallback: spinner hidden or any table appears
+        try:
+            await page.wait_for_selector("table", timeout=timeout_ms)
+        except Exception:
+            pass
+
+    await asyncio.sleep(1.5)
+
+
+async def _query_ucr_page(page, **query) -> str:
+    """Submit the UCR form and return the resulting HTML."""
+    await _submit_ucr_form(page, **query)
+    return await page.content()
+
+
+# Runs in the page: reads the results container the same way parse_ucr_html_fast
+# does (up to the first </table> in it) and returns ~200 bytes instead of the
+# whole document. It reports the cases where the fast parser gives up, percentile
+# rows outside that region (rowsOutside) or a "Code:"/"Desc:" label ahead of the
+# container (labelsBefore), so the caller falls back to the full HTML. Percentiles
+# come back as [pct, "value"] pairs so row order survives and Python does the float().
+_EXTRACT_UCR_JS = r"""
+() => {
+  const box = document.querySelector('div#fulltablediv, div#filtertablediv');
+  if (!box) return null;
+  // The first </table> in the container is that of its first table without tables inside
+  let end = box.querySelector('table');
+  if (!end) return null;
+  for (let inner = end.querySelector('table'); inner; inner = end.querySelector('table')) end = inner;
+  const inRegion = (node) =>
+    end.contains(node) || !!(node.compareDocumentPosition(end) & Node.DOCUMENT_POSITION_FOLLOWING);
+  const before = (node) => !!(node.compareDocumentPosition(box) & Node.DOCUMENT_POSITION_FOLLOWING);
+  const strings = (node, keep) => {
+    const out = [];
+    const walker = document.createTreeWalker(node, NodeFilter.SHOW_TEXT);
+    while (walker.nextNode()) {
+      const t = walker.currentNode.nodeValue.trim();
+      if (t && keep(walker.currentNode)) out.push(t);
+    }
+    return out;
+  };
+  const percentiles = [];
+  let outside = 0;
+  for (const row of document.querySelectorAll('tr')) {
+    if (!/percentiles[1-5]/.test(row.className)) continue;
+    if (!box.contains(row) || !inRegion(row)) { outside++; continue; }
+    for (const cell of row.querySelectorAll('td')) {
+      let m = /(\d{2})<sup>th<\/sup>\s*:\s*\$\s*([0-9,.]+)/.exec(cell.outerHTML);
+      if (!m) m = /(\d{2})th\s*:\s*\$\s*([0-9,.]+)/.exec(strings(cell, () => true).join(''));
+      if (m) percentiles.push([m[1], m[2]]);
+    }
+  }
+  const labelsBefore = /(?:Code|Desc)\s*:/.test(strings(document.documentElement, before).join(' '));
+  const text = strings(box, inRegion).join(' ');
+  const code = /Code\s*:\s*([A-Za-z0-9]+)/.exec(text);
+  const desc = /Desc\s*:\s*(.+?)\s*Percentiles/.exec(text);
+  return {
+    percentiles: percentiles,
+    code: code ? code[1] : null,
+    description: desc ? desc[1].trim() : null,
+    rowsOutside: outside,
+    labelsBefore: labelsBefore,
+  };
+}
+"""
+
+
+def _parsed_from_extract(data: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Build the parse_ucr_html result from in-page extraction, or None if it can't be trusted."""
+    if not data or data.get("rowsOutside") or data.get("labelsBefore"):
+        return None
+    if not data.get("code") or data.get("description") is None:
+        return None
+    percentiles: Dict[str, Any] = {}
+    try:
+        for pct, value in data.get("percentiles") or []:
+            percentiles[pct] = float(value.replace(",", ""))
+    except (TypeError, ValueError):
+        return None
+    if not percentiles:
+        return None
+    return {
+        "procedureCode": data["code"],
+        "description": data["description"],
+        "percentiles": percentiles,
+        "currency": "USD",
+    }
+
+
+async def _query_ucr_result(page, want_html: bool = False, **query) -> Tuple[Dict[str, Any], Optional[str]]:
+    """Submit the UCR form and extract the result in the page.
+
+    The full HTML is only pulled back when asked for (debug/snapshots) or when
+    in-page extraction finds nothing usable, in which case it is parsed here.
+    """
+    await _submit_ucr_form(page, **query)
+    parsed = None
+    try:
+        parsed = _parsed_from_extract(await page.evaluate(_EXTRACT_UCR_JS))
+    except Exception:
+        parsed = None
+    html = None
+    if want_html or parsed is None:
+        html = await page.content()
+    if parsed is None:
+        parsed = parse_ucr_html(html)
+    return parsed, html
+
+
 async def fetch_ucr_fee_async(
     acct_key: str,
     service_date: str,
@@ -164,56 +334,357 @@ async def fetch_ucr_fee_async(
     zip_code: str,
     percentile: str = "50",
     timeout_ms: int = 30000,
+    pool: Optional["UCRBrowserPool"] = None,
 ) -> Tuple[Optional[str], Optional[str]]:
+    """Fetch one UCR result page.
+
+    When a pool is given the page is borrowed from its long-lived browser,
+    otherwise a throwaway browser is launched (and always closed) for this call.
+    """
+    query = dict(
+        acct_key=acct_key,
+        service_date=service_date,
+        procedure_code=procedure_code,
+        zip_code=zip_code,
+        percentile=percentile,
+        timeout_ms=timeout_ms,
+    )
     try:
+        if pool is not None:
+            async with pool.page() as page:
+                return await _query_ucr_page(page, **query), None
+
         async with async_playwright() as p:
             browser = await p.chromium.launch(headless=True)
-            context = await browser.new_context()
-            page = await context.new_page()
+            try:
+                context = await browser.new_context()
+                page = await context.new_page()
+                return await _query_ucr_page(page, **query), None
+            finally:
+                await browser.close()
+    except Exception as e:
+        return None, f"Playwright async error: {str(e)}"
+
 
-            # Go directly to the middle frame content instead of the frameset
-            url = f"https://www.feeinfo.com/DecisionPointUCR/welcome.html/getBody/?acctkey={acct_key}"
-            await page.goto(url, timeout=timeout_ms)
-            await page.wait_for_load_state("domcontentloaded")
+async def fetch_ucr_result_async(
+    acct_key: str,
+    service_date: str,
+    procedure_code: str,
+    zip_code: str,
+    percentile: str = "50",
+    timeout_ms: int = 30000,
+    pool: Optional["UCRBrowserPool"] = None,
+    want_html: bool = False,
+) -> Tuple[Optional[Dict[str, Any]], Optional[str], Optional[str]]:
+    """Fetch and parse one UCR lookup without shipping the page back to Python.
 
-            # Fill fields directly by IDs present on the frame page
-            # These exist on the middle frame content page too when navigated directly
+    Returns (parsed, html, error); html is None unless want_html is set or the
+    in-page extraction had to fall back to parsing the document.
+    """
+    query = dict(
+        acct_key=acct_key,
+        service_date=service_date,
+        procedure_code=procedure_code,
+        zip_code=zip_code,
+        percentile=percentile,
+        timeout_ms=timeout_ms,
+    )
+    try:
+        if pool is not None:
+            async with pool.page() as page:
+                parsed, html = await _query_ucr_result(page, want_html=want_html, **query)
+                return parsed, html, None
+
+        async with async_playwright() as p:
+            browser = await p.chromium.launch(headless=True)
             try:
-                await page.fill("#servicedate", service_date)
-                await page.fill("#procCode", procedure_code)
-                await page.fill("#zip", zip_code)
-                if percentile in {"25", "30", "35", "40", "45"}:
-                    await page.select_option("#percentile", percentile)
-                else:
-                    # Default to All so 50–95 are returned
-                    await page.select_option("#percentile", "All")
-            except Exception:
-                pass
+                context = await browser.new_context()
+                page = await context.new_page()
+                parsed, html = await _query_ucr_result(page, want_html=want_html, **query)
+                return parsed, html, None
+            finally:
+                await browser.close()
+    except Exception as e:
+        return None, None, f"Playwright async error: {str(e)}"
+
+
+# ---- Process-tree memory accounting ----
+def _process_table() -> Dict[int, Tuple[int, int]]:
+    """Return {pid: (ppid, rss_bytes)} for every visible process, or {} if unsupported."""
+    table: Dict[int, Tuple[int, int]] = {}
+    if PSUTIL_AVAILABLE:
+        for proc in psutil.process_iter(["ppid", "memory_info"]):
+            info = proc.info
+            if info.get("memory_info") is None:
+                continue
+            table[proc.pid] = (info["ppid"] or 0, info["memory_info"].rss)
+        return table
+
+    if not os.path.isdir("/proc"):
+        return table
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The command name may contain spaces, so split after its closing paren.
+        # Remaining fields start at "state": ppid is index 1, rss (pages) index 21.
+        fields = stat.rsplit(")", 1)[-1].split()
+        try:
+            table[int(entry)] = (int(fields[1]), int(fields[21]) * page_size)
+        except (IndexError, ValueError):
+            continue
+    return table
+
+
+def _descendants(root_pid: int, table: Dict[int, Tuple[int, int]]) -> List[int]:
+    children: Dict[int, List[int]] = {}
+    for pid, (ppid, _) in table.items():
+        children.setdefault(ppid, []).append(pid)
+    found: List[int] = []
+    stack = [root_pid]
+    while stack:
+        for child in children.get(stack.pop(), []):
+            found.append(child)
+            stack.append(child)
+    return found
+
+
+class UCRBrowserPool:
+    """Long-lived Chromium for batch runs that keeps its memory flat.
+
+    Pages are served from a shared browser context. The context is recycled
+    after ``max_pages_per_context`` pages, and the whole browser is relaunched
+    when its process tree grows past ``max_rss_mb``. Every page, context and
+    browser opened is counted so handles that survive teardown show up in
+    ``stats()`` as leaks.
+    """
 
-            # Submit via button then wait for results containers
+    def __init__(
+        self,
+        max_pages_per_context: int = UCR_MAX_PAGES_PER_CONTEXT,
+        max_rss_mb: int = UCR_MAX_BROWSER_RSS_MB,
+        headless: bool = True,
+    ):
+        self.max_pages_per_context = max(1, max_pages_per_context)
+        self.max_rss_bytes = max_rss_mb * 1024 * 1024 if max_rss_mb else 0
+        self.headless = headless
+
+        self._playwright = None
+        self._browser = None
+        self._context = None
+        self._browser_pids: List[int] = []
+        self._context_pages = 0
+
+        self.pages_served = 0
+        self.context_recycles = 0
+        self.browser_relaunches = 0
+        self.peak_rss_bytes = 0
+        self.leaked_pages = 0
+        self.leaked_contexts = 0
+        self.leaked_processes = 0
+
+    async def __aenter__(self) -> "UCRBrowserPool":
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.close()
+
+    async def start(self) -> None:
+        if self._playwright is None:
+            self._playwright = await async_playwright().start()
+        if self._browser is None:
+            await self._launch_browser()
+        elif self._context is None:
+            self._context = await self._browser.new_context()
+            self._context_pages = 0
+
+    async def _launch_browser(self) -> None:
+        # Anything that appears under our process tree during launch is Chromium
+        before = set(_descendants(os.getpid(), _process_table()))
+        self._browser = await self._playwright.chromium.launch(headless=self.headless)
+        table = _process_table()
+        new_pids = [pid for pid in _descendants(os.getpid(), table) if pid not in before]
+        self._browser_pids = [pid for pid in new_pids if table[pid][0] not in new_pids]
+        self._context = await self._browser.new_context()
+        self._context_pages = 0
+
+    async def _close_context(self) -> None:
+        context, self._context = self._context, None
+        if context is None:
+            return
+        try:
+            self.leaked_pages += len(context.pages)
+            await context.close()
+        except Exception:
+            self.leaked_contexts += 1
+
+    async def _close_browser(self) -> None:
+        await self._close_context()
+        browser, self._browser = self._browser, None
+        if browser is None:
+            return
+        try:
+            # Contexts we did not create (or failed to close) are leaks
+            self.leaked_contexts += len(browser.contexts)
+            await browser.close()
+        except Exception:
+            pass
+        table = _process_table()
+        self.leaked_processes += sum(1 for pid in self._browser_pids if pid in table)
+        self._browser_pids = []
+
+    def browser_rss(self) -> Optional[int]:
+        """Summed RSS in bytes of the current browser's process tree, or None if unknown."""
+        if not self._browser_pids:
+            return None
+        table = _process_table()
+        if not table:
+            return None
+        pids = set(self._browser_pids)
+        for root in self._browser_pids:
+            pids.update(_descendants(root, table))
+        return sum(table[pid][1] for pid in pids if pid in table)
+
+    async def _maybe_recycle(self) -> None:
+        rss = self.browser_rss()
+        if rss is not None:
+            self.peak_rss_bytes = max(self.peak_rss_bytes, rss)
+        if self.max_rss_bytes and rss is not None and rss > self.max_rss_bytes:
+            logger.info("Browser RSS %.0f MB over ceiling; relaunching", rss / (1024 * 1024))
+            await self._close_browser()
+            await self._launch_browser()
+            self.browser_relaunches += 1
+        elif self._context_pages >= self.max_pages_per_context:
+            await self._close_context()
+            self._context = await self._browser.new_context()
+            self._context_pages = 0
+            self.context_recycles += 1
+
+    @asynccontextmanager
+    async def page(self):
+        """Borrow a fresh page; it is closed (and recycling checked) on exit."""
+        await self.start()
+        page = await self._context.new_page()
+        try:
+            yield page
+        finally:
             try:
-                await page.click("#submitBtn")
+                await page.close()
             except Exception:
-                # JS fallback
-                await page.evaluate(
-                    "() => { const f=document.forms['search']; if(f){ if(f.requestSubmit) f.requestSubmit(); else f.submit(); }}"
-                )
-
+                self.leaked_pages += 1
+            self._context_pages += 1
+            self.pages_served += 1
             try:
-                await page.wait_for_selector("#fulltablediv, #filtertablediv", timeout=timeout_ms)
+                await self._maybe_recycle()
             except Exception:
-                # Fallback: spinner hidden or any table appears
+                # Drop the browser; the next page() relaunches a clean one
+                await self._close_browser()
+
+    async def close(self) -> Dict[str, Any]:
+        try:
+            await self._close_browser()
+        finally:
+            if self._playwright is not None:
                 try:
-                    await page.wait_for_selector("table", timeout=timeout_ms)
-                except Exception:
-                    pass
+                    await self._playwright.stop()
+                finally:
+                    self._playwright = None
+        return self.stats()
+
+    def stats(self) -> Dict[str, Any]:
+        rss = self.browser_rss()
+        return {
+            "pages_served": self.pages_served,
+            "context_pages": self._context_pages,
+            "context_recycles": self.context_recycles,
+            "browser_relaunches": self.browser_relaunches,
+            "rss_mb": round(rss / (1024 * 1024), 1) if rss is not None else None,
+            "peak_rss_mb": round(self.peak_rss_bytes / (1024 * 1024), 1),
+            "leaked_pages": self.leaked_pages,
+            "leaked_contexts": self.leaked_contexts,
+            "leaked_processes": self.leaked_processes,
+        }
 
-            await asyncio.sleep(1.5)
-            html = await page.content()
-            await browser.close()
-            return html, None
-    except Exception as e:
-        return None, f"Playwright async error: {str(e)}"
+
+class UCRFetchSession:
+    """Synchronous handle on a UCRBrowserPool for the batch runners.
+
+    Owns a private event loop so one browser survives across rows instead of
+    ``fetch_ucr_fee_sync`` launching Chromium per call. Use as a context
+    manager so the browser is torn down however the batch exits.
+    """
+
+    def __init__(self, **pool_kwargs):
+        self._loop = asyncio.new_event_loop()
+        self.pool = UCRBrowserPool(**pool_kwargs)
+
+    def __enter__(self) -> "UCRFetchSession":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def fetch(
+        self,
+        acct_key: str,
+        service_date: str,
+        procedure_code: str,
+        zip_code: str,
+        percentile: str = "50",
+        timeout_ms: int = 30000,
+    ) -> Tuple[Optional[str], Optional[str]]:
+        return self._loop.run_until_complete(
+            fetch_ucr_fee_async(
+                acct_key=acct_key,
+                service_date=service_date,
+                procedure_code=procedure_code,
+                zip_code=zip_code,
+                percentile=percentile,
+                timeout_ms=timeout_ms,
+                pool=self.pool,
+            )
+        )
+
+    def fetch_result(
+        self,
+        acct_key: str,
+        service_date: str,
+        procedure_code: str,
+        zip_code: str,
+        percentile: str = "50",
+        timeout_ms: int = 30000,
+        want_html: bool = False,
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[str], Optional[str]]:
+        """Parsed result extracted in the page; see fetch_ucr_result_async."""
+        return self._loop.run_until_complete(
+            fetch_ucr_result_async(
+                acct_key=acct_key,
+                service_date=service_date,
+                procedure_code=procedure_code,
+                zip_code=zip_code,
+                percentile=percentile,
+                timeout_ms=timeout_ms,
+                pool=self.pool,
+                want_html=want_html,
+            )
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return self.pool.stats()
+
+    def close(self) -> Dict[str, Any]:
+        if self._loop.is_closed():
+            return self.pool.stats()
+        try:
+            return self._loop.run_until_complete(self.pool.close())
+        finally:
+            self._loop.close()
 
 
 def fetch_ucr_fee_sync(
@@ -240,8 +711,111 @@ def fetch_ucr_fee_sync(
 def parse_ucr_html(html: str) -> Dict[str, Any]:
     """Parse UCR HTML and extract a single row of results if present.
 
-    Returns a dict with normalized keys or an error key.
+    Returns a dict with normalized keys or an error key. Uses the targeted
+    scanner when the page has the usual results table and falls back to the
+    full BeautifulSoup parse otherwise; both produce the same output.
+    """
+    fast = parse_ucr_html_fast(html)
+    if fast is not None:
+        return fast
+    return parse_ucr_html_soup(html)
+
+
+# ---- Targeted parser: scans only the results container of the raw HTML ----
+_RESULTS_DIV_RE = re.compile(r'<div\b[^>]*\bid\s*=\s*["\']?(?:fulltablediv|filtertablediv)\b', re.I)
+_TABLE_END_RE = re.compile(r'</table\s*>', re.I)
+_PCT_CLASS_RE = re.compile(r'percentiles[1-5]')
+_PCT_ROW_RE = re.compile(
+    r'<tr\b[^>]*\bclass\s*=\s*["\']?[^"\'>]*percentiles[1-5][^>]*>(.*?)</tr\s*>', re.I | re.S
+)
+_CELL_RE = re.compile(r'<td\b[^>]*>.*?</td\s*>', re.I | re.S)
+_CELL_HTML_RE = re.compile(r'(\d{2})<sup>th</sup>\s*:\s*\$\s*([0-9,.]+)')
+_CELL_TEXT_RE = re.compile(r'(\d{2})th\s*:\s*\$\s*([0-9,.]+)')
+_CODE_RE = re.compile(r"Code\s*:\s*([A-Za-z0-9]+)")
+_DESC_RE = re.compile(r"Desc\s*:\s*(.+?)\s*Percentiles")
+_LABEL_TAIL_RE = re.compile(r'(?:\s|&nbsp;|&#160;|<[^>]*>)*(?::|&#58;|&colon;)')
+_COMMENT_RE = re.compile(r'<!--.*?-->', re.S)
+_TAG_RE = re.compile(r'<[^>]*>')
+
+
+def _strings(fragment: str) -> List[str]:
+    """Stripped, non-empty text nodes of an HTML fragment (as BeautifulSoup sees them)."""
+    fragment = _COMMENT_RE.sub("", fragment)
+    out = []
+    for piece in _TAG_RE.split(fragment):
+        piece = unescape(piece).strip()
+        if piece:
+            out.append(piece)
+    return out
+
+
+def _has_label(fragment: str) -> bool:
+    """True if a "Code:" or "Desc:" label appears; one before the results would win in the full-page parse."""
+    for label in ("Code", "Desc"):
+        idx = fragment.find(label)
+        while idx != -1:
+            if _LABEL_TAIL_RE.match(fragment, idx + len(label)):
+                return True
+            idx = fragment.find(label, idx + 1)
+    return False
+
+
+def parse_ucr_html_fast(html: str) -> Optional[Dict[str, Any]]:
+    """Extract percentiles, code and description from the results container only.
+
+    Returns None whenever the page is not the standard results layout (no
+    container, no percentile rows, or labels outside the container) so the
+    caller can fall back to ``parse_ucr_html_soup``.
     """
+    try:
+        start_match = _RESULTS_DIV_RE.search(html)
+        if not start_match:
+            return None
+        start = start_match.start()
+        end_match = _TABLE_END_RE.search(html, start)
+        if not end_match:
+            return None
+        end = end_match.end()
+        prefix = html[:start]
+        # Rows or labels outside the container would change the full-page result
+        if _PCT_CLASS_RE.search(prefix) or _PCT_CLASS_RE.search(html, end):
+            return None
+        if _has_label(_COMMENT_RE.sub("", prefix)):
+            return None
+
+        container = html[start:end]
+        percentiles: Dict[str, Any] = {}
+        for row in _PCT_ROW_RE.finditer(container):
+            if "<tr" in row.group(1).lower():
+                return None  # unclosed row; let the tree builder sort it out
+            for cell in _CELL_RE.finditer(row.group(1)):
+                cell_html = cell.group(0)
+                match = _CELL_HTML_RE.search(cell_html)
+                if not match:
+                    match = _CELL_TEXT_RE.search("".join(_strings(cell_html)))
+                if match:
+                    percentiles[match.group(1)] = float(match.group(2).replace(",", ""))
+        if not percentiles:
+            return None
+
+        text = " ".join(_strings(container))
+        m_code = _CODE_RE.search(text)
+        m_desc = _DESC_RE.search(text)
+        if not m_code or not m_desc:
+            return None
+
+        return {
+            "procedureCode": m_code.group(1),
+            "description": m_desc.group(1).strip(),
+            "percentiles": percentiles,
+            "currency": "USD",
+        }
+    except Exception:
+        return None
+
+
+def parse_ucr_html_soup(html: str) -> Dict[str, Any]:
+    """Reference parser: full BeautifulSoup tree plus regexes over the page text."""
     try:
         soup = BeautifulSoup(html, "html.parser")
         text = soup.get_text(" ", strip=True)
@@ -249,13 +823,14 @@ def parse_ucr_html(html: str) -> Dict[str, Any]:
         description = None
         code = None
 
-        print(f"HTML content length: {len(html)}")
-        print(f"Text content preview: {text[:500]}...")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("HTML content length: %d", len(html))
+            logger.debug("Text content preview: %s...", text[:500])
 
         # Method 1: Look for specific percentile table rows (percentiles1-5 classes)
         percentile_rows = soup.find_all("tr", class_=re.compile(r"percentiles[1-5]"))
         if percentile_rows:
-            print(f"Found {len(percentile_rows)} percentile rows")
+            logger.debug("Found %d percentile rows", len(percentile_rows))
             for row in percentile_rows:
                 cells = row.find_all("td")
                 for cell in cells:
@@ -269,16 +844,16 @@ def parse_ucr_html(html: str) -> Dict[str, Any]:
                         pct_num = match.group(1)
                         value = float(match.group(2).replace(",", ""))
                         percentiles[pct_num] = value
-                        print(f"Found {pct_num}th percentile: {value}")
+                        logger.debug("Found %sth percentile: %s", pct_num, value)
 
         # Method 2: Fallback to regex over whole page
         if not percentiles:
-            print("Trying regex fallback...")
+            logger.debug("Trying regex fallback...")
             for m in re.finditer(r"(\d{2})th\s*:\s*\$\s*([0-9,.]+)", text):
                 pct_num = m.group(1)
                 value = float(m.group(2).replace(",", ""))
                 percentiles[pct_num] = value
-                print(f"Regex found {pct_num}th percentile: {value}")
+                logger.debug("Regex found %sth percentile: %s", pct_num, value)
 
         # Extract code and description
         m_code = re.search(r"Code\s*:\s*([A-Za-z0-9]+)", text)
@@ -297,11 +872,11 @@ def parse_ucr_html(html: str) -> Dict[str, Any]:
         if not percentiles:
             result["error"] = "Percentiles not found"
             result["debug_html_preview"] = text[:1000]
-        
-        print(f"Final result: {result}")
+
+        logger.debug("Final result: %s", result)
         return result
     except Exception as e:
-        print(f"Parse error: {str(e)}")
+        logger.warning("Parse error: %s", e)
         return {"error": str(e)}
 
 
@@ -0,0 +1,343 @@
+"""Pooled HTTP clients for the LLM providers.
+
+Each provider gets one long-lived httpx.Client, so chat turns reuse an open
+keep-alive connection instead of paying a TCP and TLS handshake every time.
+Timeouts and pool sizes come from config and are the same for every provider.
+HTTP/2 is used when PROVIDER_HTTP2 is on and the h2 package is installed.
+
+Every request is traced. A request that opens a new TCP connection counts as
+"new" and anything else counts as "reused". The latest call's numbers are
+kept per thread (see last_call_stats), and running totals per provider are
+available from get_stats.
+
+Async calls use httpx.AsyncClient instances that live on one background
+event loop thread shared by the whole process. Sync code hands coroutines to
+that loop with run_sync, so a thread waiting on a provider only blocks
+itself, and any number of calls can be in flight on the loop at once.
+"""
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import httpx
+
+from services import config
+
+# HTTP/2 needs the optional h2 package
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+_clients = {}
+_async_clients = {}
+_stats = {}
+_lock = threading.Lock()
+_local = threading.local()
+_last_call = contextvars.ContextVar('provider_last_call', default=None)
+# Stats of a stream that is still being read, so usage in the stream can be attached to it
+_open_call = contextvars.ContextVar('provider_open_call', default=None)
+_loop = None
+
+
+def _timeout(read_timeout=None):
+    return httpx.Timeout(
+        read_timeout or config.PROVIDER_READ_TIMEOUT,
+        connect=config.PROVIDER_CONNECT_TIMEOUT,
+    )
+
+
+def _client_options():
+    return dict(
+        timeout=_timeout(),
+        limits=httpx.Limits(
+            max_connections=config.PROVIDER_POOL_SIZE,
+            max_keepalive_connections=config.PROVIDER_POOL_SIZE,
+            keepalive_expiry=config.PROVIDER_KEEPALIVE_EXPIRY,
+        ),
+        http2=config.PROVIDER_HTTP2 and HTTP2_AVAILABLE,
+    )
+
+
+def _init_stats(provider):
+    _stats.setdefault(provider, {
+        'requests': 0, 'new_connections': 0, 'reused_connections': 0, 'errors': 0,
+        'input_tokens': 0, 'output_tokens': 0, 'cached_tokens': 0, 'cache_write_tokens': 0,
+    })
+
+
+def get_client(provider):
+    """Return the shared client for a provider, creating it on first use"""
+    client = _clients.get(provider)
+    if client is not None:
+        return client
+    with _lock:
+        client = _clients.get(provider)
+        if client is None:
+            client = httpx.Client(**_client_options())
+            _clients[provider] = client
+            _init_stats(provider)
+    return client
+
+
+def get_async_client(provider):
+    """Return the provider's AsyncClient. Only call this from the background loop."""
+    client = _async_clients.get(provider)
+    if client is None:
+        client = httpx.AsyncClient(**_client_options())
+        _async_clients[provider] = client
+        with _lock:
+            _init_stats(provider)
+    return client
+
+
+def _get_loop():
+    """Start the background event loop on first use"""
+    global _loop
+    if _loop is not None:
+        return _loop
+    with _lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name='provider-loop', daemon=True)
+            thread.start()
+            _loop = loop
+    return _loop
+
+
+def submit(coro):
+    """Schedule a coroutine on the background loop without waiting for it; returns its future"""
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop())
+
+
+def run_sync(coro, timeout=None):
+    """Run a coroutine on the background loop and wait for its result.
+
+    The stats of the coroutine's last provider call become this thread's
+    last_call_stats.
+    """
+    loop = _get_loop()
+    if threading.current_thread().name == 'provider-loop':
+        raise RuntimeError("run_sync called from the provider loop; await the coroutine instead")
+
+    async def capture():
+        result = await coro
+        return result, _last_call.get()
+
+    result, call = asyncio.run_coroutine_threadsafe(capture(), loop).result(timeout)
+    if call is not None:
+        _local.last_call = call
+    return result
+
+
+def _record(provider, call):
+    with _lock:
+        stats = _stats[provider]
+        stats['requests'] += 1
+        if call.get('error'):
+            stats['errors'] += 1
+        elif call['new_connection']:
+            stats['new_connections'] += 1
+        else:
+            stats['reused_connections'] += 1
+    _local.last_call = call
+    _last_call.set(call)
+    logger.debug(
+        "%s %s in %.1f ms (%s connection, %s)",
+        provider, call.get('status'), call['elapsed_ms'],
+        'new' if call['new_connection'] else 'reused', call.get('http_version'),
+    )
+
+
+def _rate_limit_headers(response):
+    """Rate-limit and Retry-After headers from a provider response, if any"""
+    return {
+        name: value for name, value in response.headers.items()
+        if name.startswith(('x-ratelimit-', 'anthropic-ratelimit-')) or name == 'retry-after'
+    }
+
+
+def _tracer(is_async=False):
+    """Return (events, trace) where events['connect'] flips if a new TCP connection is opened"""
+    events = {'connect': False}
+
+    def trace(event_name, info):
+        if event_name == 'connection.connect_tcp.started':
+            events['connect'] = True
+
+    async def atrace(event_name, info):
+        trace(event_name, info)
+
+    return events, atrace if is_async else trace
+
+
+async def apost_json(provider, url, headers, payload, timeout=None):
+    """POST a JSON payload through the provider's pooled AsyncClient.
+
+    Returns the httpx.Response. Transport errors (httpx.ConnectError,
+    httpx.TimeoutException, ...) are raised to the caller unchanged.
+    """
+    client = get_async_client(provider)
+    events, trace = _tracer(is_async=True)
+    start = time.perf_counter()
+    call = {'provider': provider}
+    try:
+        response = await client.post(
+            url,
+            headers=headers,
+            json=payload,
+            timeout=_timeout(timeout) if timeout else httpx.USE_CLIENT_DEFAULT,
+            extensions={'trace': trace},
+        )
+        call['status'] = response.status_code
+        call['http_version'] = response.http_version
+        call['rate_limit'] = _rate_limit_headers(response)
+        return response
+    except Exception as e:
+        call['error'] = type(e).__name__
+        raise
+    finally:
+        call['new_connection'] = events['connect']
+        call['elapsed_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        _record(provider, call)
+
+
+@contextmanager
+def stream_post(provider, url, headers, payload, timeout=None):
+    """Streaming POST through the provider's pooled client.
+
+    Yields the httpx.Response with the body unread, for iter_lines(). The
+    connection goes back to the pool when the block exits. Stats also
+    record time to response headers (headers_ms).
+    """
+    client = get_client(provider)
+    events, trace = _tracer()
+    start = time.perf_counter()
+    call = {'provider': provider}
+    try:
+        with client.stream(
+            'POST',
+            url,
+            headers=headers,
+            json=payload,
+            timeout=_timeout(timeout) if timeout else httpx.USE_CLIENT_DEFAULT,
+            extensions={'trace': trace},
+        ) as response:
+            call['status'] = response.status_code
+            call['http_version'] = response.http_version
+            call['rate_limit'] = _rate_limit_headers(response)
+            call['headers_ms'] = round((time.perf_counter() - start) * 1000, 1)
+            token = _open_call.set(call)
+            try:
+                yield response
+            finally:
+                _open_call.reset(token)
+    except Exception as e:
+        call['error'] = type(e).__name__
+        raise
+    finally:
+        call['new_connection'] = events['connect']
+        call['elapsed_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        _record(provider, call)
+
+
+def normalize_usage(usage):
+    """Token usage from an OpenAI-style or Anthropic response body, in one shape.
+
+    input_tokens includes cached prompt tokens; cached_tokens are the ones
+    read from the provider's prompt cache and cache_write_tokens the ones
+    written to it (Anthropic only).
+    """
+    if not usage:
+        return None
+    if 'prompt_tokens' in usage:
+        details = usage.get('prompt_tokens_details') or {}
+        return {
+            'input_tokens': usage.get('prompt_tokens') or 0,
+            'output_tokens': usage.get('completion_tokens') or 0,
+            'cached_tokens': details.get('cached_tokens') or 0,
+            'cache_write_tokens': 0,
+        }
+    cached = usage.get('cache_read_input_tokens') or 0
+    written = usage.get('cache_creation_input_tokens') or 0
+    return {
+        'input_tokens': (usage.get('input_tokens') or 0) + cached + written,
+        'output_tokens': usage.get('output_tokens') or 0,
+        'cached_tokens': cached,
+        'cache_write_tokens': written,
+    }
+
+
+def record_usage(provider, usage):
+    """Attach token usage to the current call's stats and add it to the provider's totals.
+
+    Call this while reading a stream, or after an apost_json in the same task.
+    """
+    usage = normalize_usage(usage)
+    if usage is None:
+        return None
+    call = _open_call.get() or _last_call.get()
+    if call is not None and call.get('provider') == provider:
+        call['usage'] = usage
+    with _lock:
+        _init_stats(provider)
+        for name, value in usage.items():
+            _stats[provider][name] += value
+    return usage
+
+
+def record_local_call(provider, elapsed_ms, usage=None):
+    """Stats for a call made outside the pooled clients (e.g. through the Ollama library)"""
+    call = {'provider': provider, 'status': 200, 'elapsed_ms': round(elapsed_ms, 1), 'new_connection': False, 'local': True}
+    with _lock:
+        _init_stats(provider)
+        _stats[provider]['requests'] += 1
+    _local.last_call = call
+    _last_call.set(call)
+    record_usage(provider, usage)
+    return call
+
+
+def current_call():
+    """Stats of the last provider call in the current asyncio task / context, or None"""
+    return _last_call.get()
+
+
+def last_call_stats():
+    """Connection stats for the last provider call made on this thread, or None"""
+    call = getattr(_local, 'last_call', None)
+    return dict(call) if call else None
+
+
+def get_stats():
+    """Per-provider request, connection-reuse and token counters"""
+    with _lock:
+        result = {}
+        for provider, stats in _stats.items():
+            served = stats['new_connections'] + stats['reused_connections']
+            result[provider] = dict(
+                stats,
+                reuse_ratio=round(stats['reused_connections'] / served, 3) if served else None,
+                prompt_cache_ratio=round(stats['cached_tokens'] / stats['input_tokens'], 3) if stats['input_tokens'] else None,
+            )
+        return result
+
+
+def close_all():
+    """Close every pooled client (used on shutdown and in tests)"""
+    with _lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+    if _loop is not None and _async_clients:
+        async def close_async():
+            for client in list(_async_clients.values()):
+                await client.aclose()
+            _async_clients.clear()
+        asyncio.run_coroutine_threadsafe(close_async(), _loop).result()
@@ -0,0 +1,290 @@
+"""Hedged requests and failover across AI providers.
+
+A chat request goes to the requested provider first. If that provider hasn't
+answered by its recent p95 latency, a hedge request is sent to the next
+provider the user has a key for, and the first good answer wins; the other
+request is cancelled. A failed attempt moves straight on to the next
+provider. Providers that keep failing are skipped for a while by a per-provider
+circuit breaker.
+
+Latency windows and breakers are kept in memory and shared by every request
+in the process.
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+
+from services import api_manager, config, key_scheduler, provider_clients
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+
+
+class LatencyTracker:
+    """Rolling window of successful response times per provider"""
+
+    def __init__(self, window):
+        self.window = window
+        self.samples = {}
+
+    def record(self, provider, seconds):
+        with _lock:
+            self.samples.setdefault(provider, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, provider, pct):
+        with _lock:
+            samples = sorted(self.samples.get(provider, ()))
+        if len(samples) < config.HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * pct / 100.0))]
+
+    def hedge_delay(self, provider):
+        """Seconds to wait for a provider before hedging: its p95, or the default until there's enough data"""
+        p95 = self.percentile(provider, 95)
+        if p95 is None:
+            return config.HEDGE_DEFAULT_DELAY
+        return max(config.HEDGE_MIN_DELAY, p95)
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker per provider.
+
+    After CIRCUIT_FAILURE_THRESHOLD failures in a row the provider is skipped
+    for CIRCUIT_RESET_SECONDS. After that one trial request is let through;
+    success closes the breaker and failure opens it again.
+    """
+
+    def __init__(self):
+        self.failures = {}
+        self.opened_at = {}
+        self.trial = set()
+
+    def allow(self, provider):
+        with _lock:
+            opened = self.opened_at.get(provider)
+            if opened is None:
+                return True
+            if time.time() - opened < config.CIRCUIT_RESET_SECONDS or provider in self.trial:
+                return False
+            self.trial.add(provider)
+            return True
+
+    def release(self, provider):
+        """Give back a half-open trial that was cancelled before it finished"""
+        with _lock:
+            self.trial.discard(provider)
+
+    def success(self, provider):
+        with _lock:
+            if provider in self.opened_at:
+                logger.info("Circuit for %s closed", provider)
+            self.failures[provider] = 0
+            self.opened_at.pop(provider, None)
+            self.trial.discard(provider)
+
+    def failure(self, provider):
+        with _lock:
+            self.failures[provider] = self.failures.get(provider, 0) + 1
+            if provider in self.trial or self.failures[provider] >= config.CIRCUIT_FAILURE_THRESHOLD:
+                if provider not in self.opened_at or provider in self.trial:
+                    logger.warning("Circuit for %s opened after %d failures", provider, self.failures[provider])
+                self.opened_at[provider] = time.time()
+                self.trial.discard(provider)
+
+    def state(self, provider):
+        with _lock:
+            opened = self.opened_at.get(provider)
+            if opened is None:
+                return 'closed'
+            if provider in self.trial or time.time() - opened >= config.CIRCUIT_RESET_SECONDS:
+                return 'half_open'
+            return 'open'
+
+
+latency = LatencyTracker(config.LATENCY_WINDOW)
+breaker = CircuitBreaker()
+
+
+def is_provider_fault(call):
+    """True if a failed call looks like the provider's problem (5xx, 429, timeout, connection error)"""
+    if call is None:
+        return False
+    if call.get('error'):
+        return True
+    status = call.get('status') or 0
+    return status >= 500 or status == 429
+
+
+def build_candidates(user_id, provider, model=None, api_key=None, failover=True):
+    """Providers to try in order: the requested one, then others the user has keys for.
+
+    Each candidate carries its usable keys in scheduler order. A key passed
+    in the request is used on its own.
+    """
+    keys = [{'api_key': api_key, 'api_key_id': None}] if api_key else key_scheduler.ordered_keys(user_id, provider)
+    candidates = [{'provider': provider, 'model': model, 'keys': keys}]
+    if not failover or not config.FAILOVER_ENABLED:
+        return candidates
+    keyed = []
+    for key in api_manager.get_api_keys(user_id):
+        if key['provider'] != provider and key['provider'] in api_manager.AI_PROVIDERS and key['provider'] not in keyed:
+            keyed.append(key['provider'])
+    for other in keyed:
+        keys = key_scheduler.ordered_keys(user_id, other)
+        if keys:
+            candidates.append({'provider': other, 'model': None, 'keys': keys})
+    return candidates
+
+
+def rate_limited_error(provider):
+    name = api_manager.AI_PROVIDERS[provider]['name']
+    return f"All {name} API keys are rate limited right now. Please try again shortly."
+
+
+async def _attempt(candidate, prompt, call_provider):
+    """Call one provider, moving to the user's next key when a key gets a 429.
+
+    An exception from the prompt builder or the provider call is returned as
+    the attempt's error, so the router can fail over.
+    """
+    start = time.perf_counter()
+    provider = candidate['provider']
+    text, error, call, used = None, rate_limited_error(provider), None, None
+    try:
+        if callable(prompt):
+            # Builders read SQLite and count tokens: keep that off the shared event loop
+            prompt = await asyncio.to_thread(prompt, provider, candidate['model'])
+        for key in candidate['keys']:
+            before = provider_clients.current_call()
+            key_scheduler.acquire(key['api_key'])
+            try:
+                text, error = await call_provider(provider, prompt, key['api_key'], candidate['model'])
+            except asyncio.CancelledError:
+                breaker.release(provider)
+                raise
+            finally:
+                key_scheduler.release(key['api_key'])
+            # The provider call ran in this task, so its stats are in this task's context
+            call = provider_clients.current_call()
+            call = call if call is not before else None
+            key_scheduler.observe(key['api_key'], call)
+            used = key
+            if error and call and call.get('status') == 429:
+                logger.info("%s key rate limited, trying the next one", provider)
+                continue
+            break
+    except Exception as e:
+        logger.exception("%s attempt failed", provider)
+        name = api_manager.AI_PROVIDERS[provider]['name']
+        text, error = None, f"Error getting response from {name}: {e}"
+    return text, error, call, used, time.perf_counter() - start
+
+
+def record_outcome(provider, ok, call):
+    """Update the provider's breaker after an attempt"""
+    if ok:
+        breaker.success(provider)
+    elif is_provider_fault(call):
+        breaker.failure(provider)
+    else:
+        # e.g. a bad key: not the provider's fault, but a half-open trial is used up
+        breaker.release(provider)
+
+
+def _finish(candidate, text, error, call, elapsed):
+    provider = candidate['provider']
+    if not error:
+        latency.record(provider, elapsed)
+    record_outcome(provider, not error, call)
+    return {
+        'provider': provider,
+        'ok': not error,
+        'elapsed_ms': round(elapsed * 1000, 1),
+        'status': call.get('status') if call else None,
+    }
+
+
+async def route_async(candidates, prompt, call_provider):
+    """Race candidates with hedging and failover.
+
+    call_provider(provider, prompt, api_key, model) must be a coroutine
+    returning (text, error). prompt may be a string or a function
+    (provider, model) -> string when each provider needs its own prompt. Returns (text, error, winner, routing) where
+    winner is {'provider', 'model', 'api_key', 'api_key_id'} for the call
+    that answered.
+    """
+    queue = list(candidates)
+    routing = {'requested': candidates[0]['provider'], 'hedged': False, 'failover': False, 'attempts': []}
+    running = {}
+    first_error = None
+
+    def launch():
+        # Skip providers whose circuit is open
+        while queue:
+            candidate = queue.pop(0)
+            if breaker.allow(candidate['provider']):
+                task = asyncio.ensure_future(_attempt(candidate, prompt, call_provider))
+                running[task] = candidate
+                return candidate
+            routing['attempts'].append({'provider': candidate['provider'], 'ok': False, 'skipped': 'circuit_open'})
+        return None
+
+    waiting_on = launch()
+    if waiting_on is None:
+        name = api_manager.AI_PROVIDERS[candidates[0]['provider']]['name']
+        return None, f"{name} is temporarily unavailable after repeated errors. Please try again shortly.", None, routing
+
+    while running:
+        timeout = latency.hedge_delay(waiting_on['provider']) if queue and config.HEDGE_ENABLED else None
+        done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        if not done:
+            # Slower than its p95: hedge to the next provider
+            hedge = launch()
+            if hedge is not None:
+                routing['hedged'] = True
+                waiting_on = hedge
+                logger.info("Hedging %s request to %s", routing['requested'], hedge['provider'])
+            continue
+
+        for task in done:
+            candidate = running.pop(task)
+            text, error, call, used, elapsed = task.result()
+            routing['attempts'].append(_finish(candidate, text, error, call, elapsed))
+            if not error:
+                for other in running:
+                    other.cancel()
+                routing['failover'] = candidate is not candidates[0]
+                routing['connection'] = call
+                winner = {'provider': candidate['provider'], 'model': candidate['model'],
+                          'api_key': used['api_key'], 'api_key_id': used['api_key_id']}
+                return text, None, winner, routing
+            first_error = first_error or error
+
+        if not running and launch() is not None:
+            waiting_on = next(iter(running.values()))
+
+    return None, first_error, None, routing
+
+
+def route(candidates, prompt, call_provider):
+    """Sync facade for route_async"""
+    return provider_clients.run_sync(route_async(candidates, prompt, call_provider))
+
+
+def get_status():
+    """Latency percentiles and breaker state per provider"""
+    status = {}
+    for provider in api_manager.AI_PROVIDERS:
+        p50 = latency.percentile(provider, 50)
+        p95 = latency.percentile(provider, 95)
+        status[provider] = {
+            'p50_ms': round(p50 * 1000, 1) if p50 is not None else None,
+            'p95_ms': round(p95 * 1000, 1) if p95 is not None else None,
+            'hedge_delay_ms': round(latency.hedge_delay(provider) * 1000, 1),
+            'circuit': breaker.state(provider),
+            'consecutive_failures': breaker.failures.get(provider, 0),
+        }
+    return status
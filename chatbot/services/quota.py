@@ -0,0 +1,173 @@
+"""Per-user, per-provider request and token quotas.
+
+Each user gets two token buckets per provider: requests per minute and
+tokens per day. Both refill continuously. A chat request takes one request
+from its bucket when it is admitted; the tokens a call used are charged
+after it returns, so the token bucket can go into debt and the next request
+waits until it has refilled. Buckets live in process memory, so checking a
+quota is a dict lookup under a lock. Changed buckets are written to the
+quota_buckets table every QUOTA_PERSIST_SECONDS by a background thread and
+read back the first time a user is seen, so restarts don't hand out a fresh
+quota.
+"""
+import atexit
+import math
+import sqlite3
+import threading
+import time
+
+from services import config, sqlite_pool
+
+REQUESTS = 'requests'
+TOKENS = 'tokens'
+
+_buckets = {}  # (user_id, provider, kind) -> [level, updated_at]
+_loaded = set()  # users whose saved buckets have been read
+_dirty = set()
+_lock = threading.Lock()
+_flusher = None
+
+
+def init_quota_db():
+    """Create the table buckets are persisted to"""
+    conn = sqlite_pool.connection()
+    cursor = conn.cursor()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS quota_buckets (
+        user_id TEXT NOT NULL,
+        provider TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        level REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (user_id, provider, kind)
+    )
+    ''')
+
+# Initialize the table on import
+init_quota_db()
+
+
+def _limits():
+    """(capacity, refill per second) for each bucket kind; capacity 0 means unlimited"""
+    return {
+        REQUESTS: (config.QUOTA_REQUESTS_PER_MINUTE, config.QUOTA_REQUESTS_PER_MINUTE / 60.0),
+        TOKENS: (config.QUOTA_TOKENS_PER_DAY, config.QUOTA_TOKENS_PER_DAY / 86400.0),
+    }
+
+
+def _load(user_id):
+    """Read a user's saved buckets once per process. Call with _lock held."""
+    _loaded.add(user_id)
+    try:
+        rows = sqlite_pool.connection().execute(
+            "SELECT provider, kind, level, updated_at FROM quota_buckets WHERE user_id = ?", (user_id,)
+        ).fetchall()
+    except sqlite3.Error:
+        return
+    for provider, kind, level, updated_at in rows:
+        _buckets.setdefault((user_id, provider, kind), [level, updated_at])
+
+
+def _bucket(user_id, provider, kind, now):
+    """The bucket, refilled up to now. Call with _lock held."""
+    if user_id not in _loaded:
+        _load(user_id)
+    capacity, rate = _limits()[kind]
+    bucket = _buckets.get((user_id, provider, kind))
+    if bucket is None:
+        bucket = _buckets[(user_id, provider, kind)] = [float(capacity), now]
+    else:
+        bucket[0] = min(float(capacity), bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+    return bucket
+
+
+def acquire(user_id, provider, requests=1):
+    """Take `requests` from the user's request bucket for a provider.
+
+    Returns 0 if the request is admitted, or the whole number of seconds to
+    wait before retrying (for a Retry-After header) if either bucket is empty.
+    """
+    if not config.QUOTA_ENABLED or not user_id:
+        return 0
+    limits = _limits()
+    now = time.time()
+    wait = 0.0
+    with _lock:
+        capacity, rate = limits[REQUESTS]
+        if capacity:
+            requests_bucket = _bucket(user_id, provider, REQUESTS, now)
+            if requests_bucket[0] < requests:
+                wait = (requests - requests_bucket[0]) / rate
+        capacity, rate = limits[TOKENS]
+        if capacity:
+            tokens_bucket = _bucket(user_id, provider, TOKENS, now)
+            if tokens_bucket[0] <= 0:
+                wait = max(wait, (1 - tokens_bucket[0]) / rate)
+        if wait:
+            return max(1, math.ceil(wait))
+        if limits[REQUESTS][0]:
+            requests_bucket[0] -= requests
+            _dirty.add((user_id, provider, REQUESTS))
+    _start_flusher()
+    return 0
+
+
+def charge_tokens(user_id, provider, tokens):
+    """Take the tokens a call used from the user's daily token bucket"""
+    if not config.QUOTA_ENABLED or not user_id or not tokens or not config.QUOTA_TOKENS_PER_DAY:
+        return
+    with _lock:
+        bucket = _bucket(user_id, provider, TOKENS, time.time())
+        bucket[0] -= tokens
+        _dirty.add((user_id, provider, TOKENS))
+    _start_flusher()
+
+
+def status(user_id):
+    """Remaining requests and tokens per provider the user has used, as a dict"""
+    result = {}
+    now = time.time()
+    with _lock:
+        if user_id not in _loaded:
+            _load(user_id)
+        for (owner, provider, kind) in list(_buckets):
+            if owner == user_id and _limits()[kind][0]:
+                level = _bucket(user_id, provider, kind, now)[0]
+                result.setdefault(provider, {})[f"{kind}_remaining"] = max(0, int(level))
+    return result
+
+
+def flush():
+    """Write changed buckets to the database"""
+    with _lock:
+        rows = [(user_id, provider, kind, *_buckets[(user_id, provider, kind)]) for user_id, provider, kind in _dirty]
+        _dirty.clear()
+    if not rows:
+        return 0
+    with sqlite_pool.transaction() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO quota_buckets (user_id, provider, kind, level, updated_at) VALUES (?, ?, ?, ?, ?)",
+            rows
+        )
+    return len(rows)
+
+
+def _flush_forever():
+    while True:
+        time.sleep(config.QUOTA_PERSIST_SECONDS)
+        try:
+            flush()
+        except sqlite3.Error:
+            pass
+
+
+def _start_flusher():
+    global _flusher
+    if _flusher is not None:
+        return
+    with _lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_forever, name='quota-flush', daemon=True)
+            _flusher.start()
+            atexit.register(flush)
@@ -0,0 +1,152 @@
+"""Cache of AI responses for repeated chat prompts.
+
+Entries are keyed by provider, model and a SHA-256 of the final prompt from
+create_prompt, so the same question against the same document is answered
+from the cache. There are two tiers: an in-process LRU, which is checked
+first, and a response_cache table in the shared SQLite database, so workers
+and restarts can reuse each other's answers. Both tiers expire entries after
+RESPONSE_CACHE_TTL seconds.
+
+Users who opt out neither read from nor write to the cache.
+"""
+import datetime
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from services import config, sqlite_pool
+
+_memory = OrderedDict()
+_lock = threading.Lock()
+_metrics = {'memory_hits': 0, 'sqlite_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'expired': 0}
+
+
+def init_cache_db():
+    """Create the response cache and opt-out tables"""
+    conn = sqlite_pool.connection()
+    cursor = conn.cursor()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS response_cache (
+        cache_key TEXT PRIMARY KEY,
+        provider TEXT NOT NULL,
+        model TEXT NOT NULL,
+        response TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        hits INTEGER DEFAULT 0
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS response_cache_optout (
+        user_id TEXT PRIMARY KEY,
+        updated_at TEXT NOT NULL
+    )
+    ''')
+
+# Initialize the tables on import
+init_cache_db()
+
+
+def make_key(provider, model, prompt):
+    digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+    return f"{provider}:{model}:{digest}"
+
+
+def _fresh(created_at):
+    return time.time() - created_at < config.RESPONSE_CACHE_TTL
+
+
+def _remember(key, response, created_at):
+    with _lock:
+        _memory[key] = (response, created_at)
+        _memory.move_to_end(key)
+        while len(_memory) > config.RESPONSE_CACHE_MAX_ENTRIES:
+            _memory.popitem(last=False)
+            _metrics['evictions'] += 1
+
+
+def get(provider, model, prompt):
+    """Return the cached response for this prompt, or None"""
+    if not config.RESPONSE_CACHE_ENABLED:
+        return None
+    key = make_key(provider, model, prompt)
+
+    with _lock:
+        entry = _memory.get(key)
+        if entry is not None:
+            if _fresh(entry[1]):
+                _memory.move_to_end(key)
+                _metrics['memory_hits'] += 1
+                return entry[0]
+            del _memory[key]
+            _metrics['expired'] += 1
+
+    conn = sqlite_pool.connection()
+    row = conn.execute(
+        "SELECT response, created_at FROM response_cache WHERE cache_key = ?", (key,)
+    ).fetchone()
+    if row and _fresh(row[1]):
+        conn.execute("UPDATE response_cache SET hits = hits + 1 WHERE cache_key = ?", (key,))
+        _remember(key, row[0], row[1])
+        with _lock:
+            _metrics['sqlite_hits'] += 1
+        return row[0]
+
+    with _lock:
+        _metrics['misses'] += 1
+        if row:
+            _metrics['expired'] += 1
+    return None
+
+
+def put(provider, model, prompt, response):
+    """Store a response in both tiers and drop expired SQLite rows"""
+    if not config.RESPONSE_CACHE_ENABLED or not response:
+        return
+    key = make_key(provider, model, prompt)
+    now = time.time()
+    _remember(key, response, now)
+
+    with sqlite_pool.transaction() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO response_cache (cache_key, provider, model, response, created_at, hits) "
+            "VALUES (?, ?, ?, ?, ?, 0)",
+            (key, provider, model, response, now)
+        )
+        conn.execute("DELETE FROM response_cache WHERE created_at < ?", (now - config.RESPONSE_CACHE_TTL,))
+    with _lock:
+        _metrics['stores'] += 1
+
+
+def clear():
+    """Empty both tiers"""
+    with _lock:
+        _memory.clear()
+    sqlite_pool.connection().execute("DELETE FROM response_cache")
+
+
+def is_opted_out(user_id):
+    row = sqlite_pool.connection().execute("SELECT 1 FROM response_cache_optout WHERE user_id = ?", (user_id,)).fetchone()
+    return row is not None
+
+
+def set_opt_out(user_id, opted_out):
+    conn = sqlite_pool.connection()
+    if opted_out:
+        conn.execute(
+            "INSERT OR REPLACE INTO response_cache_optout (user_id, updated_at) VALUES (?, ?)",
+            (user_id, datetime.datetime.utcnow().isoformat())
+        )
+    else:
+        conn.execute("DELETE FROM response_cache_optout WHERE user_id = ?", (user_id,))
+
+
+def get_metrics():
+    """Hit/miss counters for this process plus the size of each tier"""
+    with _lock:
+        metrics = dict(_metrics)
+        metrics['memory_entries'] = len(_memory)
+    metrics['sqlite_entries'] = sqlite_pool.connection().execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+    lookups = metrics['memory_hits'] + metrics['sqlite_hits'] + metrics['misses']
+    metrics['hit_ratio'] = round((metrics['memory_hits'] + metrics['sqlite_hits']) / lookups, 3) if lookups else None
+    return metrics
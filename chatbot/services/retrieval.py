@@ -0,0 +1,289 @@
+"""BM25 retrieval over chunked user documents.
+
+Documents are split into overlapping word-window chunks when they are
+uploaded. Each chunk's term frequencies go into an inverted index in the
+SQLite database, as chunk_postings rows keyed by (user_id, term). Searching
+for a question is one indexed lookup for the question's terms, scored with
+BM25 in Python over just the matching chunks, so it stays fast however many
+documents a user has.
+
+The index lives in SQLite for both database backends. Documents stored in
+MongoDB, or uploaded before this index existed, are indexed on first use.
+"""
+import datetime
+import math
+import re
+from collections import Counter
+
+from services import config, sqlite_pool, token_budget
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+# Reciprocal rank fusion constant, for merging with vector search results
+RRF_K = 60
+
+TOKEN_RE = re.compile(r"[^\W_]+", re.UNICODE)
+STOPWORDS = frozenset("""
+a an and are as at be been but by can did do does for from had has have how i if in into is it its
+me my no not of on or our so such than that the their them then there these they this to was we
+were what when where which who why will with would you your
+""".split())
+
+
+def init_retrieval_db():
+    """Create the chunk and inverted index tables"""
+    conn = sqlite_pool.connection()
+    cursor = conn.cursor()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS doc_chunks (
+        chunk_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        document_id TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        ordinal INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        length INTEGER NOT NULL
+    )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_doc_chunks_document ON doc_chunks (document_id, ordinal)")
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS chunk_postings (
+        user_id TEXT NOT NULL,
+        term TEXT NOT NULL,
+        chunk_id INTEGER NOT NULL,
+        document_id TEXT NOT NULL,
+        tf INTEGER NOT NULL,
+        PRIMARY KEY (user_id, term, chunk_id)
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS doc_index_stats (
+        document_id TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        content_length INTEGER NOT NULL,
+        chunk_count INTEGER NOT NULL,
+        total_length INTEGER NOT NULL,
+        indexed_at TEXT NOT NULL
+    )
+    ''')
+
+# Initialize the tables on import
+init_retrieval_db()
+
+
+def tokenize(text):
+    """Lowercased word tokens without stopwords, for indexing and queries"""
+    return [t for t in TOKEN_RE.findall(text.lower()) if len(t) > 1 and t not in STOPWORDS]
+
+
+def chunk_text(text, chunk_words=None, overlap_words=None):
+    """Split text into overlapping windows of whole words"""
+    chunk_words = chunk_words or config.RETRIEVAL_CHUNK_WORDS
+    overlap_words = min(overlap_words if overlap_words is not None else config.RETRIEVAL_CHUNK_OVERLAP, chunk_words - 1)
+    words = text.split()
+    if not words:
+        return []
+    chunks = []
+    step = chunk_words - overlap_words
+    for start in range(0, len(words), step):
+        chunks.append(' '.join(words[start:start + chunk_words]))
+        if start + chunk_words >= len(words):
+            break
+    return chunks
+
+
+def index_document(document_id, user_id, text):
+    """Chunk a document and (re)build its postings. Returns the number of chunks."""
+    document_id, user_id = str(document_id), str(user_id)
+    chunks = chunk_text(text or '')
+    with sqlite_pool.transaction() as conn:
+        cursor = conn.cursor()
+        _delete_index(cursor, document_id)
+        total_length = 0
+        postings = []
+        for ordinal, chunk in enumerate(chunks):
+            terms = tokenize(chunk)
+            total_length += len(terms)
+            cursor.execute(
+                "INSERT INTO doc_chunks (document_id, user_id, ordinal, text, length) VALUES (?, ?, ?, ?, ?)",
+                (document_id, user_id, ordinal, chunk, len(terms))
+            )
+            chunk_id = cursor.lastrowid
+            postings.extend((user_id, term, chunk_id, document_id, tf) for term, tf in Counter(terms).items())
+        cursor.executemany(
+            "INSERT INTO chunk_postings (user_id, term, chunk_id, document_id, tf) VALUES (?, ?, ?, ?, ?)",
+            postings
+        )
+        cursor.execute(
+            "INSERT OR REPLACE INTO doc_index_stats (document_id, user_id, content_length, chunk_count, total_length, indexed_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (document_id, user_id, len(text or ''), len(chunks), total_length, datetime.datetime.utcnow().isoformat())
+        )
+    return len(chunks)
+
+
+def _delete_index(cursor, document_id):
+    cursor.execute("DELETE FROM chunk_postings WHERE chunk_id IN (SELECT chunk_id FROM doc_chunks WHERE document_id = ?)", (document_id,))
+    cursor.execute("DELETE FROM doc_chunks WHERE document_id = ?", (document_id,))
+    cursor.execute("DELETE FROM doc_index_stats WHERE document_id = ?", (document_id,))
+
+
+def ensure_indexed(document_id, user_id, text):
+    """Index a document if it has no index yet or its content changed"""
+    row = sqlite_pool.connection().execute(
+        "SELECT content_length FROM doc_index_stats WHERE document_id = ?", (str(document_id),)
+    ).fetchone()
+    if row is None or row[0] != len(text or ''):
+        index_document(document_id, user_id, text)
+
+
+def search(user_id, query, document_ids=None, top_k=None):
+    """Top-k chunks for a query across the user's documents (or just document_ids).
+
+    Returns a list of dicts with chunk_id, document_id, ordinal, text and
+    score, best first.
+    """
+    top_k = top_k or config.RETRIEVAL_TOP_K
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not terms:
+        return []
+    user_id = str(user_id)
+    doc_filter = ''
+    doc_params = []
+    if document_ids:
+        doc_params = [str(d) for d in document_ids]
+        doc_filter = f" AND document_id IN ({','.join('?' * len(doc_params))})"
+
+    conn = sqlite_pool.connection()
+    stats = conn.execute(
+        f"SELECT COALESCE(SUM(chunk_count), 0), COALESCE(SUM(total_length), 0) FROM doc_index_stats WHERE user_id = ?{doc_filter}",
+        [user_id] + doc_params
+    ).fetchone()
+    chunk_total, length_total = stats
+    if not chunk_total:
+        return []
+    postings = conn.execute(
+        f"SELECT p.term, p.chunk_id, p.tf, c.length FROM chunk_postings p JOIN doc_chunks c ON c.chunk_id = p.chunk_id "
+        f"WHERE p.user_id = ? AND p.term IN ({','.join('?' * len(terms))}){doc_filter.replace('document_id', 'p.document_id')}",
+        [user_id] + terms + doc_params
+    ).fetchall()
+
+    avg_length = length_total / chunk_total
+    df = Counter(term for term, _, _, _ in postings)
+    scores = {}
+    for term, chunk_id, tf, length in postings:
+        idf = math.log(1 + (chunk_total - df[term] + 0.5) / (df[term] + 0.5))
+        norm = tf + K1 * (1 - B + B * length / avg_length)
+        scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (K1 + 1) / norm
+    best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+    if not best:
+        return []
+
+    chunks = get_chunks([chunk_id for chunk_id, _ in best])
+    return [
+        dict(chunks[chunk_id], score=round(score, 4))
+        for chunk_id, score in best if chunk_id in chunks
+    ]
+
+
+def get_chunks(chunk_ids):
+    """Chunks by id, as {chunk_id: {'chunk_id', 'document_id', 'ordinal', 'text'}}"""
+    if not chunk_ids:
+        return {}
+    rows = sqlite_pool.connection().execute(
+        f"SELECT chunk_id, document_id, ordinal, text FROM doc_chunks WHERE chunk_id IN ({','.join('?' * len(chunk_ids))})",
+        [int(chunk_id) for chunk_id in chunk_ids]
+    ).fetchall()
+    return {row[0]: {'chunk_id': row[0], 'document_id': row[1], 'ordinal': row[2], 'text': row[3]} for row in rows}
+
+
+def document_chunks(document_id):
+    """(chunk_id, text) pairs of a document, in order"""
+    return sqlite_pool.connection().execute(
+        "SELECT chunk_id, text FROM doc_chunks WHERE document_id = ? ORDER BY ordinal", (str(document_id),)
+    ).fetchall()
+
+
+def chunk_ids_for(user_id, document_ids):
+    """Ids of every chunk in the given documents"""
+    rows = sqlite_pool.connection().execute(
+        f"SELECT chunk_id FROM doc_chunks WHERE user_id = ? AND document_id IN ({','.join('?' * len(document_ids))})",
+        [str(user_id)] + [str(d) for d in document_ids]
+    ).fetchall()
+    return [row[0] for row in rows]
+
+
+def fuse(*rankings, top_k=None):
+    """Merge ranked hit lists with reciprocal rank fusion"""
+    top_k = top_k or config.RETRIEVAL_TOP_K
+    scores = {}
+    hits = {}
+    for ranking in rankings:
+        for rank, hit in enumerate(ranking):
+            scores[hit['chunk_id']] = scores.get(hit['chunk_id'], 0.0) + 1.0 / (RRF_K + rank + 1)
+            hits.setdefault(hit['chunk_id'], hit)
+    best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+    return [dict(hits[chunk_id], score=round(score, 4)) for chunk_id, score in best]
+
+def _label(doc, ordinal=None):
+    if ordinal is None:
+        return f"[{doc['filename']}]"
+    return f"[{doc['filename']}, part {ordinal + 1}]"
+
+
+def fit_documents(documents, query_hits, provider, model, overhead_tokens, whole_documents=True):
+    """Build the context for a prompt from the selected documents.
+
+    documents is a list of {'id', 'filename', 'text'} dicts. Documents no
+    bigger than about RETRIEVAL_TOP_K chunks (RETRIEVAL_FULL_DOCUMENT_TOKENS)
+    are sent whole, unless whole_documents is False. Otherwise the
+    best-scoring chunks from query_hits() are packed until the budget is used
+    up, and put back in document order. Returns (context, info) like
+    token_budget.fit_context, with a 'retrieval' entry describing what was sent.
+    """
+    budget = token_budget.context_budget(provider, model, overhead_tokens)
+    if len(documents) == 1:
+        whole = token_budget.document_token_count(documents[0]['id'], documents[0]['text'], provider, model)
+    else:
+        whole = sum(
+            token_budget.document_token_count(doc['id'], doc['text'], provider, model)
+            + token_budget.count_tokens(_label(doc) + '\n\n', provider, model)
+            for doc in documents
+        )
+    if whole_documents and whole <= min(budget, config.RETRIEVAL_FULL_DOCUMENT_TOKENS):
+        if len(documents) == 1:
+            context = documents[0]['text']
+        else:
+            context = '\n\n'.join(f"{_label(doc)}\n{doc['text']}" for doc in documents)
+        info = token_budget.budget_info(provider, model, budget, overhead_tokens, whole, False)
+        info['retrieval'] = {'mode': 'full', 'documents': len(documents)}
+        return context, info
+
+    by_id = {doc['id']: doc for doc in documents}
+    picked = []
+    used = 0
+    for hit in query_hits():
+        block = f"{_label(by_id[hit['document_id']], hit['ordinal'])}\n{hit['text']}"
+        tokens = token_budget.count_tokens(block + '\n\n', provider, model)
+        if used + tokens > budget:
+            continue
+        picked.append((hit, block))
+        used += tokens
+
+    if not picked:
+        # Nothing in the documents matches the question: fall back to their beginning
+        context = '\n\n'.join(doc['text'] for doc in documents)
+        context, info = token_budget.fit_context(context, provider, model, overhead_tokens)
+        info['retrieval'] = {'mode': 'truncated', 'documents': len(documents)}
+        return context, info
+
+    order = {doc['id']: i for i, doc in enumerate(documents)}
+    picked.sort(key=lambda item: (order[item[0]['document_id']], item[0]['ordinal']))
+    context = '\n\n'.join(block for _, block in picked)
+    info = token_budget.budget_info(provider, model, budget, overhead_tokens, used, True)
+    info['retrieval'] = {
+        'mode': 'chunks',
+        'documents': len(documents),
+        'chunks': [{'document_id': hit['document_id'], 'part': hit['ordinal'] + 1, 'score': hit['score']} for hit, _ in picked],
+    }
+    return context, info
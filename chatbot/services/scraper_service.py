@@ -1,6 +1,6 @@
 import requests
 from bs4 import BeautifulSoup
-from services import db
+from services import db, retrieval, vector_index
 
 def scrape_url(url, form_data=None, method='GET'):
     """Scrape content from a URL, optionally with form data"""
@@ -235,5 +235,7 @@ def process_scraped_content(url, user_id, save=False, form_data=None, method='GE
     if save and content:
         doc_result = db.save_scraped_content(user_id, url, content)
         result['document_id'] = str(doc_result["inserted_id"]) if isinstance(doc_result, dict) else str(doc_result.inserted_id)
+        retrieval.index_document(result['document_id'], user_id, content)
+        vector_index.add_document(result['document_id'], user_id)
     
     return result, None 
\ No newline at end of file
@@ -0,0 +1,67 @@
+"""Coalesces identical requests that are in flight at the same time.
+
+The first caller for a key runs the work; callers that arrive with the same
+key before it finishes wait for it and get the same result, instead of
+repeating the provider call and saving the exchange twice. Nothing is kept
+once the work finishes, so a later identical request runs again (use an
+Idempotency-Key to replay finished requests, see idempotency).
+"""
+import hashlib
+import json
+import threading
+
+_calls = {}
+_lock = threading.Lock()
+_metrics = {'leaders': 0, 'coalesced': 0}
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exception = None
+
+
+def request_key(*parts):
+    """A stable key for a request from its JSON-serialisable parts"""
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def do(key, fn):
+    """Run fn() once for all concurrent callers with this key.
+
+    Returns (result, shared); shared is True for callers that waited on
+    another caller's run. If fn raises, every waiting caller gets the error.
+    """
+    with _lock:
+        call = _calls.get(key)
+        leader = call is None
+        if leader:
+            call = _calls[key] = _Call()
+            _metrics['leaders'] += 1
+        else:
+            _metrics['coalesced'] += 1
+
+    if not leader:
+        call.done.wait()
+        if call.exception is not None:
+            raise call.exception
+        return call.result, True
+
+    try:
+        call.result = fn()
+    except Exception as e:
+        call.exception = e
+        raise
+    finally:
+        with _lock:
+            _calls.pop(key, None)
+        call.done.set()
+    return call.result, False
+
+
+def get_metrics():
+    """Requests run and requests coalesced onto another in this process"""
+    with _lock:
+        return dict(_metrics, in_flight=len(_calls))
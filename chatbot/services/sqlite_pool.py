@@ -0,0 +1,105 @@
+"""Persistent SQLite connections, one per thread and database file.
+
+Opening a connection means opening the file, reading the schema and
+setting up a page cache, and a chat turn used to do that about seven
+times. connection() returns the calling thread's connection instead,
+opened once with:
+
+- WAL journaling, so readers don't block the writer or each other
+- synchronous=NORMAL, which only syncs at WAL checkpoints (safe across
+  application crashes; a power loss can lose the last commits)
+- a larger page cache and memory-mapped reads
+- a busy timeout, so concurrent writers wait instead of failing with
+  "database is locked"
+
+Connections are in autocommit mode: a single statement commits by itself.
+Several writes that belong together go in a transaction() block, which
+takes the write lock up front (BEGIN IMMEDIATE), commits on success and
+rolls back on error, so a failed request never leaves a transaction open
+on the shared connection. transaction() blocks nest into the outermost one.
+
+Set SQLITE_PERSISTENT_CONNECTIONS=false to open a connection per call
+again, e.g. to compare (see bench_db.py).
+"""
+import contextlib
+import os
+import sqlite3
+import threading
+
+from services import config
+
+_local = threading.local()
+
+
+def _state():
+    """This thread's open connections and transaction depths, reset after a fork"""
+    if getattr(_local, 'pid', None) != os.getpid():
+        # Connections inherited from a parent process must not be used (or closed) here
+        _local.pid = os.getpid()
+        _local.connections = {}
+        _local.depth = {}
+    return _local
+
+
+def _open(path):
+    conn = sqlite3.connect(path, timeout=config.SQLITE_BUSY_TIMEOUT, isolation_level=None)
+    if config.SQLITE_PERSISTENT_CONNECTIONS:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{config.SQLITE_CACHE_KB}")
+        conn.execute(f"PRAGMA mmap_size={config.SQLITE_MMAP_BYTES}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+def connection(path=None):
+    """The calling thread's connection to path (default SQLITE_DB_PATH)"""
+    path = path or config.SQLITE_DB_PATH
+    state = _state()
+    conn = state.connections.get(path)
+    if conn is None:
+        conn = _open(path)
+        if config.SQLITE_PERSISTENT_CONNECTIONS:
+            state.connections[path] = conn
+    return conn
+
+
+@contextlib.contextmanager
+def transaction(path=None):
+    """A connection with a write transaction open for the block"""
+    path = path or config.SQLITE_DB_PATH
+    state = _state()
+    if state.depth.get(path):
+        state.depth[path] += 1
+        try:
+            yield state.connections[path]
+        finally:
+            state.depth[path] -= 1
+        return
+
+    conn = connection(path)
+    # Keep the connection for nested blocks and connection() calls inside this one
+    state.connections[path] = conn
+    state.depth[path] = 1
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    finally:
+        state.depth[path] = 0
+        if not config.SQLITE_PERSISTENT_CONNECTIONS:
+            del state.connections[path]
+            conn.close()
+
+
+def close():
+    """Close the calling thread's connections"""
+    state = _state()
+    for conn in state.connections.values():
+        conn.close()
+    state.connections.clear()
+    state.depth.clear()
@@ -0,0 +1,182 @@
+"""Token counting and prompt budgeting per model.
+
+Each model's context window and reserved output tokens come from
+AI_PROVIDERS. Tokens are counted with tiktoken when it is installed and has
+an encoding for the model. Otherwise a characters-per-token estimate,
+calibrated per tokenizer family on English prose, is used. Estimates are
+padded by ESTIMATE_MARGIN so they err on the side of fitting.
+
+Token counts of stored documents are cached in memory and in SQLite, keyed by
+document id and tokenizer, so a document is only counted once per tokenizer.
+"""
+import math
+import threading
+
+from services import api_manager, config, sqlite_pool
+
+# Check if tiktoken is available
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+# Average characters per token by tokenizer family
+CHARS_PER_TOKEN = {
+    'cl100k': 4.0,     # gpt-3.5-turbo
+    'o200k': 4.2,      # gpt-4o
+    'llama3': 4.0,     # 128k-vocab tiktoken-style BPE
+    'mistral': 3.3,    # 32k sentencepiece
+    'claude': 3.5,
+}
+ESTIMATE_MARGIN = 0.10
+DEFAULT_CONTEXT_WINDOW = 8192
+
+_encodings = {}
+_count_cache = {}
+_lock = threading.Lock()
+
+
+def init_token_db():
+    """Create the document token count cache table"""
+    sqlite_pool.connection().execute('''
+    CREATE TABLE IF NOT EXISTS document_token_counts (
+        document_id TEXT NOT NULL,
+        tokenizer TEXT NOT NULL,
+        content_length INTEGER NOT NULL,
+        token_count INTEGER NOT NULL,
+        PRIMARY KEY (document_id, tokenizer)
+    )
+    ''')
+
+# Initialize the table on import
+init_token_db()
+
+
+def tokenizer_for(provider, model):
+    """Name of the tokenizer family used by a model"""
+    model = model or api_manager.AI_PROVIDERS[provider]['default_model']
+    if provider == 'openai':
+        return 'o200k' if model.startswith('gpt-4o') else 'cl100k'
+    if provider == 'anthropic':
+        return 'claude'
+    if 'mistral' in model:
+        return 'mistral'
+    return 'llama3'
+
+
+def _encoding(tokenizer):
+    """tiktoken encoding for OpenAI tokenizers, or None to use the estimator"""
+    if not TIKTOKEN_AVAILABLE or tokenizer not in ('cl100k', 'o200k'):
+        return None
+    if tokenizer not in _encodings:
+        try:
+            _encodings[tokenizer] = tiktoken.get_encoding(f"{tokenizer}_base")
+        except Exception:
+            # Encoding files can't be downloaded (offline); fall back to estimating
+            _encodings[tokenizer] = None
+    return _encodings[tokenizer]
+
+
+def is_exact(provider, model):
+    return _encoding(tokenizer_for(provider, model)) is not None
+
+
+def count_tokens(text, provider, model=None):
+    if not text:
+        return 0
+    tokenizer = tokenizer_for(provider, model)
+    encoding = _encoding(tokenizer)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return int(math.ceil(len(text) / CHARS_PER_TOKEN[tokenizer] * (1 + ESTIMATE_MARGIN)))
+
+
+def truncate_to_tokens(text, max_tokens, provider, model=None):
+    """Return the longest prefix of text that fits in max_tokens"""
+    if max_tokens <= 0:
+        return ''
+    tokenizer = tokenizer_for(provider, model)
+    encoding = _encoding(tokenizer)
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+    chars = int(max_tokens * CHARS_PER_TOKEN[tokenizer] / (1 + ESTIMATE_MARGIN))
+    return text[:chars]
+
+
+def context_window(provider, model=None):
+    info = api_manager.AI_PROVIDERS[provider]
+    return info.get('context_windows', {}).get(model or info['default_model'], DEFAULT_CONTEXT_WINDOW)
+
+
+def max_output_tokens(provider):
+    return api_manager.AI_PROVIDERS[provider].get('max_output_tokens', 1024)
+
+
+def document_token_count(document_id, text, provider, model=None):
+    """Token count of a stored document, cached per tokenizer"""
+    tokenizer = tokenizer_for(provider, model)
+    key = (str(document_id), tokenizer)
+    with _lock:
+        cached = _count_cache.get(key)
+    if cached and cached[0] == len(text):
+        return cached[1]
+
+    conn = sqlite_pool.connection()
+    row = conn.execute(
+        "SELECT content_length, token_count FROM document_token_counts WHERE document_id = ? AND tokenizer = ?",
+        key
+    ).fetchone()
+    if row and row[0] == len(text):
+        count = row[1]
+    else:
+        count = count_tokens(text, provider, model)
+        conn.execute(
+            "INSERT OR REPLACE INTO document_token_counts (document_id, tokenizer, content_length, token_count) "
+            "VALUES (?, ?, ?, ?)",
+            (key[0], tokenizer, len(text), count)
+        )
+    with _lock:
+        _count_cache[key] = (len(text), count)
+    return count
+
+
+def context_budget(provider, model, overhead_tokens):
+    """Tokens left for context after the prompt overhead and the reserved output"""
+    budget = context_window(provider, model) - max_output_tokens(provider) - overhead_tokens
+    if config.CONTEXT_TOKEN_CAP:
+        budget = min(budget, config.CONTEXT_TOKEN_CAP)
+    return max(0, budget)
+
+
+def fit_context(context, provider, model, overhead_tokens, document_id=None):
+    """Trim context to the model's budget.
+
+    Returns (context, info) where info reports the window, budget and tokens
+    used, for the chat response.
+    """
+    budget = context_budget(provider, model, overhead_tokens)
+    if document_id:
+        context_tokens = document_token_count(document_id, context, provider, model)
+    else:
+        context_tokens = count_tokens(context, provider, model)
+    truncated = context_tokens > budget
+    if truncated:
+        context = truncate_to_tokens(context, budget, provider, model)
+        context_tokens = count_tokens(context, provider, model)
+    return context, budget_info(provider, model, budget, overhead_tokens, context_tokens, truncated)
+
+
+def budget_info(provider, model, budget, overhead_tokens, context_tokens, truncated):
+    """Token figures for a built prompt, reported in the chat response"""
+    return {
+        'tokenizer': tokenizer_for(provider, model),
+        'exact': is_exact(provider, model),
+        'context_window': context_window(provider, model),
+        'reserved_output_tokens': max_output_tokens(provider),
+        'context_budget': budget,
+        'context_tokens': context_tokens,
+        'context_truncated': truncated,
+        'prompt_tokens': overhead_tokens + context_tokens,
+    }
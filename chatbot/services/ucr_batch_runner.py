@@ -1,12 +1,83 @@
 import sys
 import os
 import json
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 import re
 from openpyxl import load_workbook
 
-from .playwright_ucr import fetch_ucr_fee_sync, parse_ucr_html
+from .playwright_ucr import UCRFetchSession
+from .ucr_cache import get_cached_result, store_result
+from .ucr_logging import BatchSampler, configure_logging, get_logger
+
+logger = get_logger("batch")
+
+# Excel runs keep the raw HTML of every Nth row as an audit snapshot (0 disables);
+# all other rows are extracted in the browser without transferring the page
+UCR_SNAPSHOT_EVERY = int(os.environ.get("UCR_SNAPSHOT_EVERY", "10"))
+
+
+def wants_snapshot(row: int) -> bool:
+    return UCR_SNAPSHOT_EVERY > 0 and (row - 2) % UCR_SNAPSHOT_EVERY == 0
+
+
+def _log_row(sampler: BatchSampler, label: str, index: int, result: dict) -> None:
+    """Failures are always logged, progress only on sampled rows, full results at DEBUG."""
+    error = result.get("error")
+    sampler.record(not error)
+    if error:
+        logger.warning(
+            "%s %d: %s", label, index, error,
+            extra={"ucr": {"row": index, "cpt": result.get("procedureCode"),
+                           "zip": result.get("zip_code"), "date": result.get("date"), "error": error}},
+        )
+    else:
+        logger.debug("%s %d: %s", label, index, result)
+    if sampler.sampled(index):
+        logger.info(
+            "%s %d: %d ok, %d failed", label, index, sampler.ok, sampler.failed,
+            extra={"ucr": dict(sampler.fields(), row=index)},
+        )
+
+
+def _log_browser_stats(session: UCRFetchSession) -> None:
+    stats = session.stats()
+    logger.info("Browser stats: %s", stats, extra={"ucr": {"browser": stats}})
+
+def lookup_ucr(
+    session: UCRFetchSession,
+    acctkey: str,
+    service_date: str,
+    procedure_code: str,
+    zip_code: str,
+    percentile: str = "50",
+    timeout_ms: int = 20000,
+    want_html: bool = False,
+) -> Tuple[Optional[dict], Optional[str], Optional[str]]:
+    """Look up one CPT/ZIP/date, serving from the UCR cache when possible.
+
+    Returns (parsed, html, error). html is only returned when want_html is
+    set (and never on cache hits); fresh parses with percentiles are written
+    back to the cache.
+    """
+    cached = get_cached_result(acctkey, procedure_code, zip_code, service_date, percentile)
+    if cached is not None:
+        return cached, None, None
+
+    parsed, html, err = session.fetch_result(
+        acct_key=acctkey,
+        service_date=service_date,
+        procedure_code=procedure_code,
+        zip_code=zip_code,
+        percentile=percentile,
+        timeout_ms=timeout_ms,
+        want_html=want_html,
+    )
+    if err or parsed is None:
+        return None, None, err
+
+    store_result(acctkey, procedure_code, zip_code, service_date, parsed, percentile)
+    return parsed, html, None
 
 
 def process_json_input(json_data: dict, acctkey: str) -> dict:
@@ -17,123 +88,120 @@ def process_json_input(json_data: dict, acctkey: str) -> dict:
     if not line_items:
         return {"error": "No line_items found in input JSON"}
     
-    for index, item in enumerate(line_items, start=1):
-        # Extract and normalize data from JSON
-        zip_code = str(item.get("ZipCode", "")).strip()
-        cpt_code = str(item.get("CPTcode", "")).strip()
-        date_str = str(item.get("date", "")).strip()
+    sampler = BatchSampler(total=len(line_items))
+    # One browser for the whole batch; recycled and torn down by the session
+    with UCRFetchSession() as session:
+        for index, item in enumerate(line_items, start=1):
+            # Extract and normalize data from JSON
+            zip_code = str(item.get("ZipCode", "")).strip()
+            cpt_code = str(item.get("CPTcode", "")).strip()
+            date_str = str(item.get("date", "")).strip()
         
-        # Normalize date format (convert from YYYY-MM-DD to MM/DD/YYYY)
-        def normalize_date(date_input: str) -> str:
-            if not date_input:
-                return ""
-            try:
-                # Try YYYY-MM-DD format first
-                if "-" in date_input and len(date_input) == 10:
-                    dt = datetime.strptime(date_input, "%Y-%m-%d")
-                    return dt.strftime("%m/%d/%Y")
-                # Try MM/DD/YYYY format
-                elif "/" in date_input:
-                    dt = datetime.strptime(date_input, "%m/%d/%Y")
-                    return dt.strftime("%m/%d/%Y")
-                else:
+            # Normalize date format (convert from YYYY-MM-DD to MM/DD/YYYY)
+            def normalize_date(date_input: str) -> str:
+                if not date_input:
+                    return ""
+                try:
+                    # Try YYYY-MM-DD format first
+                    if "-" in date_input and len(date_input) == 10:
+                        dt = datetime.strptime(date_input, "%Y-%m-%d")
+                        return dt.strftime("%m/%d/%Y")
+                    # Try MM/DD/YYYY format
+                    elif "/" in date_input:
+                        dt = datetime.strptime(date_input, "%m/%d/%Y")
+                        return dt.strftime("%m/%d/%Y")
+                    else:
+                        return date_input
+                except Exception:
                     return date_input
-            except Exception:
-                return date_input
         
-        service_date = normalize_date(date_str)
-        procedure_code = re.sub(r"\D", "", cpt_code).strip()  # digits only
-        zip_code = re.sub(r"\D", "", zip_code).strip().zfill(5)  # exactly 5 digits
+            service_date = normalize_date(date_str)
+            procedure_code = re.sub(r"\D", "", cpt_code).strip()  # digits only
+            zip_code = re.sub(r"\D", "", zip_code).strip().zfill(5)  # exactly 5 digits
         
-        # Basic validations
-        if len(service_date) != 10 or service_date.count('/') != 2:
-            error_result = {
-                "procedureCode": procedure_code,
-                "percentiles": {},
-                "currency": "USD",
-                "zip_code": int(zip_code) if zip_code.isdigit() else 0,
-                "date": service_date,
-                "line_number": index,
-                "error": f"Invalid date format: '{date_str}' (expected YYYY-MM-DD or MM/DD/YYYY)"
-            }
-            results.append(error_result)
-            print(f"Line {index}: error invalid date '{date_str}'", flush=True)
-            continue
+            # Basic validations
+            if len(service_date) != 10 or service_date.count('/') != 2:
+                error_result = {
+                    "procedureCode": procedure_code,
+                    "percentiles": {},
+                    "currency": "USD",
+                    "zip_code": int(zip_code) if zip_code.isdigit() else 0,
+                    "date": service_date,
+                    "line_number": index,
+                    "error": f"Invalid date format: '{date_str}' (expected YYYY-MM-DD or MM/DD/YYYY)"
+                }
+                results.append(error_result)
+                _log_row(sampler, "Line", index, error_result)
+                continue
             
-        if not procedure_code:
-            error_result = {
-                "procedureCode": "",
-                "percentiles": {},
-                "currency": "USD",
-                "zip_code": int(zip_code) if zip_code.isdigit() else 0,
-                "date": service_date,
-                "line_number": index,
-                "error": "Missing CPT code"
-            }
-            results.append(error_result)
-            print(f"Line {index}: error missing CPT", flush=True)
-            continue
+            if not procedure_code:
+                error_result = {
+                    "procedureCode": "",
+                    "percentiles": {},
+                    "currency": "USD",
+                    "zip_code": int(zip_code) if zip_code.isdigit() else 0,
+                    "date": service_date,
+                    "line_number": index,
+                    "error": "Missing CPT code"
+                }
+                results.append(error_result)
+                _log_row(sampler, "Line", index, error_result)
+                continue
             
-        if not re.match(r"^\d{5}$", zip_code):
-            error_result = {
-                "procedureCode": procedure_code,
-                "percentiles": {},
-                "currency": "USD",
-                "zip_code": int(zip_code) if zip_code.isdigit() else 0,
-                "date": service_date,
-                "line_number": index,
-                "error": f"Invalid ZIP code: '{zip_code}' (expected 5 digits)"
-            }
-            results.append(error_result)
-            print(f"Line {index}: error invalid ZIP '{zip_code}'", flush=True)
-            continue
+            if not re.match(r"^\d{5}$", zip_code):
+                error_result = {
+                    "procedureCode": procedure_code,
+                    "percentiles": {},
+                    "currency": "USD",
+                    "zip_code": int(zip_code) if zip_code.isdigit() else 0,
+                    "date": service_date,
+                    "line_number": index,
+                    "error": f"Invalid ZIP code: '{zip_code}' (expected 5 digits)"
+                }
+                results.append(error_result)
+                _log_row(sampler, "Line", index, error_result)
+                continue
         
-        print(f"Line {index}: date={service_date} cpt={procedure_code} zip={zip_code} ...", flush=True)
+            logger.debug("Line %d: date=%s cpt=%s zip=%s ...", index, service_date, procedure_code, zip_code)
         
-        # Scrape UCR data
-        html, err = fetch_ucr_fee_sync(
-            acct_key=acctkey,
-            service_date=service_date,
-            procedure_code=procedure_code,
-            zip_code=zip_code,
-            percentile="50",
-            timeout_ms=20000,
-        )
+            # Scrape UCR data
+            parsed, html, err = lookup_ucr(session, acctkey, service_date, procedure_code, zip_code)
         
-        if not err and html:
-            parsed = parse_ucr_html(html)
+            if parsed is not None:
             
-            # Create result without description field
-            result = {
-                "procedureCode": parsed.get("procedureCode", procedure_code),
-                "percentiles": parsed.get("percentiles", {}),
-                "currency": parsed.get("currency", "USD"),
-                "zip_code": int(zip_code),
-                "date": service_date,
-                "line_number": index
-            }
+                # Create result without description field
+                result = {
+                    "procedureCode": parsed.get("procedureCode", procedure_code),
+                    "percentiles": parsed.get("percentiles", {}),
+                    "currency": parsed.get("currency", "USD"),
+                    "zip_code": int(zip_code),
+                    "date": service_date,
+                    "line_number": index
+                }
             
-            # Add error field if no percentiles found
-            if not parsed.get("percentiles"):
-                result["error"] = "No percentiles found in response"
+                # Add error field if no percentiles found
+                if not parsed.get("percentiles"):
+                    result["error"] = "No percentiles found in response"
             
-            results.append(result)
-            print(f"Line {index}: {json.dumps(result, indent=2)}", flush=True)
+                results.append(result)
+                _log_row(sampler, "Line", index, result)
             
-        else:
-            # Create error result
-            error_result = {
-                "procedureCode": procedure_code,
-                "percentiles": {},
-                "currency": "USD",
-                "zip_code": int(zip_code),
-                "date": service_date,
-                "line_number": index,
-                "error": f"Scraping failed: {err}" if err else "Unknown error"
-            }
-            results.append(error_result)
-            print(f"Line {index}: error {err}", flush=True)
+            else:
+                # Create error result
+                error_result = {
+                    "procedureCode": procedure_code,
+                    "percentiles": {},
+                    "currency": "USD",
+                    "zip_code": int(zip_code),
+                    "date": service_date,
+                    "line_number": index,
+                    "error": f"Scraping failed: {err}" if err else "Unknown error"
+                }
+                results.append(error_result)
+                _log_row(sampler, "Line", index, error_result)
     
+    _log_browser_stats(session)
+
     return {
         "results": results,
         "total_processed": len(results),
@@ -148,115 +216,119 @@ def process_to_json(input_path: str, acctkey: str) -> str:
     ws = wb.active
     
     results: List[Dict] = []
+    # Data starts on row 2, below the header
+    sampler = BatchSampler(total=max(0, ws.max_row - 1), first_index=2)
     
     # Iterate rows starting from 2 (assuming row 1 is header)
-    row = 2
-    while True:
-        date_v = ws[f"A{row}"].value
-        cpt_v = ws[f"B{row}"].value
-        zip_v = ws[f"C{row}"].value
-        if not date_v and not cpt_v and not zip_v:
-            break
-
-        if date_v and cpt_v and zip_v:
-            # Normalize date to strict MM/DD/YYYY (10 chars with slashes)
-            def coerce_date(val) -> str:
-                if isinstance(val, datetime):
-                    return val.strftime("%m/%d/%Y")
-                s = str(val).strip()
-                for fmt in ("%m/%d/%Y", "%m/%d/%y", "%Y-%m-%d", "%Y/%m/%d"):
-                    try:
-                        return datetime.strptime(s, fmt).strftime("%m/%d/%Y")
-                    except Exception:
-                        continue
-                # last resort: try M/D/YYYY and pad
-                m = re.match(r"^(\d{1,2})/(\d{1,2})/(\d{4})$", s)
-                if m:
-                    mm = m.group(1).zfill(2)
-                    dd = m.group(2).zfill(2)
-                    yy = m.group(3)
-                    return f"{mm}/{dd}/{yy}"
-                return s
-
-            service_date = coerce_date(date_v)
-            procedure_code = re.sub(r"\D", "", str(cpt_v)).strip()  # digits only
-            zip_code = re.sub(r"\D", "", str(zip_v)).strip().zfill(5)  # exactly 5 digits
-
-            # Basic validations per site requirements
-            if len(service_date) != 10 or service_date.count('/') != 2:
-                print(f"Row {row}: error invalid date '{service_date}'", flush=True)
-                row += 1
-                continue
-            if not procedure_code:
-                print(f"Row {row}: error missing CPT", flush=True)
-                row += 1
-                continue
-            if not re.match(r"^\d{5}$", zip_code):
-                print(f"Row {row}: error invalid ZIP '{zip_code}'", flush=True)
-                row += 1
-                continue
+    # One browser for the whole batch; recycled and torn down by the session
+    with UCRFetchSession() as session:
+        row = 2
+        while True:
+            date_v = ws[f"A{row}"].value
+            cpt_v = ws[f"B{row}"].value
+            zip_v = ws[f"C{row}"].value
+            if not date_v and not cpt_v and not zip_v:
+                break
 
-            print(f"Row {row}: date={service_date} cpt={procedure_code} zip={zip_code} ...", flush=True)
-            html, err = fetch_ucr_fee_sync(
-                acct_key=acctkey,
-                service_date=service_date,
-                procedure_code=procedure_code,
-                zip_code=zip_code,
-                percentile="50",
-                timeout_ms=20000,
-            )
+            if date_v and cpt_v and zip_v:
+                # Normalize date to strict MM/DD/YYYY (10 chars with slashes)
+                def coerce_date(val) -> str:
+                    if isinstance(val, datetime):
+                        return val.strftime("%m/%d/%Y")
+                    s = str(val).strip()
+                    for fmt in ("%m/%d/%Y", "%m/%d/%y", "%Y-%m-%d", "%Y/%m/%d"):
+                        try:
+                            return datetime.strptime(s, fmt).strftime("%m/%d/%Y")
+                        except Exception:
+                            continue
+                    # last resort: try M/D/YYYY and pad
+                    m = re.match(r"^(\d{1,2})/(\d{1,2})/(\d{4})$", s)
+                    if m:
+                        mm = m.group(1).zfill(2)
+                        dd = m.group(2).zfill(2)
+                        yy = m.group(3)
+                        return f"{mm}/{dd}/{yy}"
+                    return s
+
+                service_date = coerce_date(date_v)
+                procedure_code = re.sub(r"\D", "", str(cpt_v)).strip()  # digits only
+                zip_code = re.sub(r"\D", "", str(zip_v)).strip().zfill(5)  # exactly 5 digits
+
+                # Basic validations per site requirements
+                if len(service_date) != 10 or service_date.count('/') != 2:
+                    logger.warning("Row %d: invalid date %r", row, service_date)
+                    sampler.record(False)
+                    row += 1
+                    continue
+                if not procedure_code:
+                    logger.warning("Row %d: missing CPT", row)
+                    sampler.record(False)
+                    row += 1
+                    continue
+                if not re.match(r"^\d{5}$", zip_code):
+                    logger.warning("Row %d: invalid ZIP %r", row, zip_code)
+                    sampler.record(False)
+                    row += 1
+                    continue
+
+                logger.debug("Row %d: date=%s cpt=%s zip=%s ...", row, service_date, procedure_code, zip_code)
+                parsed, html, err = lookup_ucr(
+                    session, acctkey, service_date, procedure_code, zip_code, want_html=wants_snapshot(row)
+                )
             
-            if not err and html:
-                parsed = parse_ucr_html(html)
+                if parsed is not None:
                 
-                # Create enhanced JSON result with additional fields
-                result = {
-                    "procedureCode": parsed.get("procedureCode", procedure_code),
-                    "percentiles": parsed.get("percentiles", {}),
-                    "currency": parsed.get("currency", "USD"),
-                    "zip_code": int(zip_code),
-                    "date": service_date,
-                    "row_number": row
-                }
+                    # Create enhanced JSON result with additional fields
+                    result = {
+                        "procedureCode": parsed.get("procedureCode", procedure_code),
+                        "percentiles": parsed.get("percentiles", {}),
+                        "currency": parsed.get("currency", "USD"),
+                        "zip_code": int(zip_code),
+                        "date": service_date,
+                        "row_number": row
+                    }
                 
-                # Add error field if no percentiles found
-                if not parsed.get("percentiles"):
-                    result["error"] = "No percentiles found in response"
+                    # Add error field if no percentiles found
+                    if not parsed.get("percentiles"):
+                        result["error"] = "No percentiles found in response"
                 
-                results.append(result)
-                print(f"Row {row}: {json.dumps(result, indent=2)}", flush=True)
+                    results.append(result)
+                    _log_row(sampler, "Row", row, result)
                 
-                # Save HTML snapshot for debugging
-                try:
-                    snap_dir = os.path.dirname(input_path)
-                    snap_name = f"row_{row}_{procedure_code}_{zip_code}.html"
-                    with open(os.path.join(snap_dir, snap_name), "w", encoding="utf-8") as f:
-                        f.write(html)
-                except Exception:
-                    pass
-            else:
-                # Create error result
-                error_result = {
-                    "procedureCode": procedure_code,
-                    "percentiles": {},
-                    "currency": "USD",
-                    "zip_code": int(zip_code),
-                    "date": service_date,
-                    "row_number": row,
-                    "error": f"Scraping failed: {err}" if err else "Unknown error"
-                }
-                results.append(error_result)
-                print(f"Row {row}: error {err}", flush=True)
+                    # Save HTML snapshot for debugging
+                    if html:
+                        try:
+                            snap_dir = os.path.dirname(input_path)
+                            snap_name = f"row_{row}_{procedure_code}_{zip_code}.html"
+                            with open(os.path.join(snap_dir, snap_name), "w", encoding="utf-8") as f:
+                                f.write(html)
+                        except Exception:
+                            pass
+                else:
+                    # Create error result
+                    error_result = {
+                        "procedureCode": procedure_code,
+                        "percentiles": {},
+                        "currency": "USD",
+                        "zip_code": int(zip_code),
+                        "date": service_date,
+                        "row_number": row,
+                        "error": f"Scraping failed: {err}" if err else "Unknown error"
+                    }
+                    results.append(error_result)
+                    _log_row(sampler, "Row", row, error_result)
+
+            row += 1
 
-        row += 1
+    _log_browser_stats(session)
 
     # Save results to JSON file
     output_path = os.path.splitext(input_path)[0] + "_results.json"
     with open(output_path, "w", encoding="utf-8") as f:
         json.dump(results, f, indent=2, ensure_ascii=False)
     
-    print(f"Wrote JSON results to: {output_path}", flush=True)
-    print(f"Total rows processed: {len(results)}", flush=True)
+    logger.info("Wrote JSON results to: %s (%d rows)", output_path, len(results),
+                extra={"ucr": dict(sampler.fields(), output=output_path)})
     return output_path
 
 
@@ -281,86 +353,93 @@ def fill_sheet(input_path: str, acctkey: str) -> str:
         if not ws[f"{col}1"].value:
             ws[f"{col}1"] = pct
 
+    # Data starts on row 2, below the header
+    sampler = BatchSampler(total=max(0, ws.max_row - 1), first_index=2)
+
     # Iterate rows starting from 2 (assuming row 1 is header)
-    row = 2
-    while True:
-        date_v = ws[f"A{row}"].value
-        cpt_v = ws[f"B{row}"].value
-        zip_v = ws[f"C{row}"].value
-        if not date_v and not cpt_v and not zip_v:
-            break
-
-        if date_v and cpt_v and zip_v:
-            # Normalize date to strict MM/DD/YYYY (10 chars with slashes)
-            def coerce_date(val) -> str:
-                if isinstance(val, datetime):
-                    return val.strftime("%m/%d/%Y")
-                s = str(val).strip()
-                for fmt in ("%m/%d/%Y", "%m/%d/%y", "%Y-%m-%d", "%Y/%m/%d"):
-                    try:
-                        return datetime.strptime(s, fmt).strftime("%m/%d/%Y")
-                    except Exception:
-                        continue
-                # last resort: try M/D/YYYY and pad
-                m = re.match(r"^(\d{1,2})/(\d{1,2})/(\d{4})$", s)
-                if m:
-                    mm = m.group(1).zfill(2)
-                    dd = m.group(2).zfill(2)
-                    yy = m.group(3)
-                    return f"{mm}/{dd}/{yy}"
-                return s
-
-            service_date = coerce_date(date_v)
-            procedure_code = re.sub(r"\D", "", str(cpt_v)).strip()  # digits only
-            zip_code = re.sub(r"\D", "", str(zip_v)).strip().zfill(5)  # exactly 5 digits
-
-            # Basic validations per site requirements
-            if len(service_date) != 10 or service_date.count('/') != 2:
-                print(f"Row {row}: error invalid date '{service_date}'", flush=True)
-                row += 1
-                continue
-            if not procedure_code:
-                print(f"Row {row}: error missing CPT", flush=True)
-                row += 1
-                continue
-            if not re.match(r"^\d{5}$", zip_code):
-                print(f"Row {row}: error invalid ZIP '{zip_code}'", flush=True)
-                row += 1
-                continue
+    # One browser for the whole batch; recycled and torn down by the session
+    with UCRFetchSession() as session:
+        row = 2
+        while True:
+            date_v = ws[f"A{row}"].value
+            cpt_v = ws[f"B{row}"].value
+            zip_v = ws[f"C{row}"].value
+            if not date_v and not cpt_v and not zip_v:
+                break
 
-            print(f"Row {row}: date={service_date} cpt={procedure_code} zip={zip_code} ...", flush=True)
-            html, err = fetch_ucr_fee_sync(
-                acct_key=acctkey,
-                service_date=service_date,
-                procedure_code=procedure_code,
-                zip_code=zip_code,
-                percentile="50",
-                timeout_ms=20000,
-            )
-            if not err and html:
-                parsed = parse_ucr_html(html)
-                # Save snapshot for auditing
-                try:
-                    snap_dir = os.path.dirname(input_path)
-                    snap_name = f"row_{row}_{procedure_code}_{zip_code}.html"
-                    with open(os.path.join(snap_dir, snap_name), "w", encoding="utf-8") as f:
-                        f.write(html)
-                except Exception:
-                    pass
-                per = parsed.get("percentiles", {}) if isinstance(parsed.get("percentiles"), dict) else {}
-                for pct, col in headers.items():
-                    if pct in per:
-                        ws[f"{col}{row}"] = per[pct]
-                print(f"Row {row}: percentiles={json.dumps(per)}", flush=True)
-            else:
-                ws[f"{headers['50']}{row}"] = f"ERR: {err}" if err else "ERR"
-                print(f"Row {row}: error {err}", flush=True)
+            if date_v and cpt_v and zip_v:
+                # Normalize date to strict MM/DD/YYYY (10 chars with slashes)
+                def coerce_date(val) -> str:
+                    if isinstance(val, datetime):
+                        return val.strftime("%m/%d/%Y")
+                    s = str(val).strip()
+                    for fmt in ("%m/%d/%Y", "%m/%d/%y", "%Y-%m-%d", "%Y/%m/%d"):
+                        try:
+                            return datetime.strptime(s, fmt).strftime("%m/%d/%Y")
+                        except Exception:
+                            continue
+                    # last resort: try M/D/YYYY and pad
+                    m = re.match(r"^(\d{1,2})/(\d{1,2})/(\d{4})$", s)
+                    if m:
+                        mm = m.group(1).zfill(2)
+                        dd = m.group(2).zfill(2)
+                        yy = m.group(3)
+                        return f"{mm}/{dd}/{yy}"
+                    return s
+
+                service_date = coerce_date(date_v)
+                procedure_code = re.sub(r"\D", "", str(cpt_v)).strip()  # digits only
+                zip_code = re.sub(r"\D", "", str(zip_v)).strip().zfill(5)  # exactly 5 digits
+
+                # Basic validations per site requirements
+                if len(service_date) != 10 or service_date.count('/') != 2:
+                    logger.warning("Row %d: invalid date %r", row, service_date)
+                    sampler.record(False)
+                    row += 1
+                    continue
+                if not procedure_code:
+                    logger.warning("Row %d: missing CPT", row)
+                    sampler.record(False)
+                    row += 1
+                    continue
+                if not re.match(r"^\d{5}$", zip_code):
+                    logger.warning("Row %d: invalid ZIP %r", row, zip_code)
+                    sampler.record(False)
+                    row += 1
+                    continue
+
+                logger.debug("Row %d: date=%s cpt=%s zip=%s ...", row, service_date, procedure_code, zip_code)
+                parsed, html, err = lookup_ucr(
+                    session, acctkey, service_date, procedure_code, zip_code, want_html=wants_snapshot(row)
+                )
+                if parsed is not None:
+                    # Save snapshot for auditing
+                    if html:
+                        try:
+                            snap_dir = os.path.dirname(input_path)
+                            snap_name = f"row_{row}_{procedure_code}_{zip_code}.html"
+                            with open(os.path.join(snap_dir, snap_name), "w", encoding="utf-8") as f:
+                                f.write(html)
+                        except Exception:
+                            pass
+                    per = parsed.get("percentiles", {}) if isinstance(parsed.get("percentiles"), dict) else {}
+                    for pct, col in headers.items():
+                        if pct in per:
+                            ws[f"{col}{row}"] = per[pct]
+                    _log_row(sampler, "Row", row, {"procedureCode": procedure_code, "zip_code": zip_code,
+                                                   "date": service_date, "percentiles": per})
+                else:
+                    ws[f"{headers['50']}{row}"] = f"ERR: {err}" if err else "ERR"
+                    _log_row(sampler, "Row", row, {"procedureCode": procedure_code, "zip_code": zip_code,
+                                                   "date": service_date, "error": err or "Unknown error"})
+
+            row += 1
 
-        row += 1
+    _log_browser_stats(session)
 
     out_path = os.path.splitext(input_path)[0] + "_filled.xlsx"
     wb.save(out_path)
-    print(f"Wrote: {out_path}", flush=True)
+    logger.info("Wrote: %s", out_path, extra={"ucr": dict(sampler.fields(), output=out_path)})
     return out_path
 
 
@@ -371,6 +450,7 @@ if __name__ == "__main__":
         print("  --json-input: Input is JSON file instead of Excel")
         sys.exit(1)
     
+    configure_logging()
     input_path = sys.argv[1]
     acct = sys.argv[2]
     output_json = "--json" in sys.argv
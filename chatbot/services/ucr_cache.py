@@ -0,0 +1,208 @@
+"""SQLite cache of parsed UCR fee lookups.
+
+Results are keyed by (account, procedure code, ZIP, service date,
+percentile): the fee schedule behind a lookup belongs to the account key
+it was made with, so one account's results are never served to another.
+Accounts are stored as a hash of the key, not the key itself. Only
+successful parses are stored so a failed scrape is always retried. The
+cache lives in its own database file so the standalone scraper can use it
+without the Flask app's configuration.
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+UCR_CACHE_DB_PATH = os.environ.get(
+    "UCR_CACHE_DB_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "ucr_cache.db"),
+)
+# Fee schedules are published monthly, so a cached row is good for about that long
+UCR_CACHE_TTL_DAYS = float(os.environ.get("UCR_CACHE_TTL_DAYS", "45"))
+
+_initialized = False
+
+
+def _connect() -> sqlite3.Connection:
+    global _initialized
+    conn = sqlite3.connect(UCR_CACHE_DB_PATH)
+    if not _initialized:
+        init_ucr_cache(conn)
+        _initialized = True
+    return conn
+
+
+def init_ucr_cache(conn: Optional[sqlite3.Connection] = None) -> None:
+    """Create the cache and prefetch job tables if they don't exist."""
+    own_conn = conn is None
+    conn = conn or sqlite3.connect(UCR_CACHE_DB_PATH)
+    cursor = conn.cursor()
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(ucr_results)")]
+    if columns and "account" not in columns:
+        # Rows cached before results were keyed by account can't be attributed to one
+        cursor.execute("DROP TABLE ucr_results")
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS ucr_results (
+        account TEXT NOT NULL,
+        procedure_code TEXT NOT NULL,
+        zip_code TEXT NOT NULL,
+        service_date TEXT NOT NULL,
+        percentile TEXT NOT NULL,
+        result TEXT NOT NULL,
+        fetched_at REAL NOT NULL,
+        PRIMARY KEY (account, procedure_code, zip_code, service_date, percentile)
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS ucr_prefetch_jobs (
+        job_id TEXT PRIMARY KEY,
+        params TEXT NOT NULL,
+        total INTEGER NOT NULL,
+        done INTEGER DEFAULT 0,
+        failed INTEGER DEFAULT 0,
+        status TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    )
+    ''')
+    conn.commit()
+    if own_conn:
+        conn.close()
+
+
+def normalize_service_date(value: str) -> Optional[str]:
+    """Return the date as MM/DD/YYYY (the form the UCR site and cache use), or None."""
+    s = str(value).strip()
+    for fmt in ("%Y-%m-%d", "%m/%d/%Y", "%m/%d/%y", "%Y/%m/%d"):
+        try:
+            return datetime.strptime(s, fmt).strftime("%m/%d/%Y")
+        except ValueError:
+            continue
+    return None
+
+
+def normalize_key(procedure_code: str, zip_code: str, service_date: str) -> Optional[Tuple[str, str, str]]:
+    """Normalize user input to the (CPT digits, 5-digit ZIP, MM/DD/YYYY) cache key, or None."""
+    code = re.sub(r"\D", "", str(procedure_code))
+    digits = re.sub(r"\D", "", str(zip_code))
+    z = digits.zfill(5)
+    date = normalize_service_date(service_date)
+    if not code or not digits or len(z) != 5 or not date:
+        return None
+    return code, z, date
+
+
+def account_id(acct_key: str) -> str:
+    """The cache's identifier for an account key (a hash, so keys aren't stored)."""
+    return hashlib.sha256(str(acct_key).strip().encode("utf-8")).hexdigest()[:32]
+
+
+def _is_fresh(fetched_at: float) -> bool:
+    if UCR_CACHE_TTL_DAYS <= 0:
+        return True
+    return time.time() - fetched_at < UCR_CACHE_TTL_DAYS * 86400
+
+
+def get_cached_result(
+    acct_key: str,
+    procedure_code: str,
+    zip_code: str,
+    service_date: str,
+    percentile: str = "50",
+) -> Optional[Dict[str, Any]]:
+    """Return the cached parse for this lookup, or None on a miss or stale row."""
+    conn = _connect()
+    try:
+        row = conn.execute(
+            "SELECT result, fetched_at FROM ucr_results "
+            "WHERE account = ? AND procedure_code = ? AND zip_code = ? AND service_date = ? AND percentile = ?",
+            (account_id(acct_key), procedure_code, zip_code, service_date, str(percentile)),
+        ).fetchone()
+    finally:
+        conn.close()
+    if not row or not _is_fresh(row[1]):
+        return None
+    return json.loads(row[0])
+
+
+def store_result(
+    acct_key: str,
+    procedure_code: str,
+    zip_code: str,
+    service_date: str,
+    parsed: Dict[str, Any],
+    percentile: str = "50",
+) -> bool:
+    """Cache a parsed result. Results without percentiles are not stored."""
+    if not parsed or parsed.get("error") or not parsed.get("percentiles"):
+        return False
+    conn = _connect()
+    try:
+        conn.execute(
+            "INSERT OR REPLACE INTO ucr_results "
+            "(account, procedure_code, zip_code, service_date, percentile, result, fetched_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (account_id(acct_key), procedure_code, zip_code, service_date, str(percentile),
+             json.dumps(parsed), time.time()),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    return True
+
+
+def cached_keys(
+    acct_key: str,
+    keys: Iterable[Tuple[str, str, str]],
+    percentile: str = "50",
+) -> Set[Tuple[str, str, str]]:
+    """Return the subset of (procedure_code, zip_code, service_date) keys with a fresh cached row."""
+    keys = set(keys)
+    if not keys:
+        return set()
+    conn = _connect()
+    try:
+        # Look up only the requested keys, each through the primary key
+        conn.execute(
+            "CREATE TEMP TABLE wanted_keys (procedure_code TEXT, zip_code TEXT, service_date TEXT)"
+        )
+        conn.executemany("INSERT INTO wanted_keys VALUES (?, ?, ?)", keys)
+        rows = conn.execute(
+            "SELECT r.procedure_code, r.zip_code, r.service_date, r.fetched_at FROM wanted_keys w "
+            "JOIN ucr_results r ON r.account = ? AND r.procedure_code = w.procedure_code "
+            "AND r.zip_code = w.zip_code AND r.service_date = w.service_date AND r.percentile = ?",
+            (account_id(acct_key), str(percentile)),
+        ).fetchall()
+    finally:
+        conn.close()
+    return {(r[0], r[1], r[2]) for r in rows if _is_fresh(r[3])}
+
+
+def save_job(job_id: str, params: Dict[str, Any], total: int, done: int, failed: int, status: str) -> None:
+    conn = _connect()
+    try:
+        conn.execute(
+            "INSERT OR REPLACE INTO ucr_prefetch_jobs (job_id, params, total, done, failed, status, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, json.dumps(params), total, done, failed, status, time.time()),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    conn = _connect()
+    conn.row_factory = sqlite3.Row
+    try:
+        row = conn.execute("SELECT * FROM ucr_prefetch_jobs WHERE job_id = ?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+    if not row:
+        return None
+    job = dict(row)
+    job["params"] = json.loads(job["params"])
+    return job
@@ -0,0 +1,104 @@
+"""Logging for the UCR scraping path.
+
+All UCR modules log under the ``ucr`` logger. Messages use %-style args so
+nothing is formatted unless a handler will actually emit the record, and
+per-row progress goes through a BatchSampler so a 5,000-row batch writes a
+few dozen lines instead of 5,000. Structured fields ride along in
+``extra={"ucr": {...}}`` and are emitted as JSON when UCR_LOG_JSON=1.
+
+Environment:
+    UCR_LOG_LEVEL         DEBUG / INFO / WARNING (default INFO)
+    UCR_LOG_JSON          1 for one JSON object per line (default 0)
+    UCR_LOG_SAMPLE_EVERY  progress line every N rows (default 25)
+"""
+import json
+import logging
+import os
+import sys
+import time
+from typing import Any, Dict, Optional
+
+UCR_LOG_LEVEL = os.environ.get("UCR_LOG_LEVEL", "INFO").upper()
+UCR_LOG_JSON = os.environ.get("UCR_LOG_JSON", "0") == "1"
+UCR_LOG_SAMPLE_EVERY = int(os.environ.get("UCR_LOG_SAMPLE_EVERY", "25"))
+
+ROOT_LOGGER = "ucr"
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, including any ``extra={"ucr": {...}}`` fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload: Dict[str, Any] = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        fields = getattr(record, "ucr", None)
+        if fields:
+            payload.update(fields)
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str)
+
+
+def configure_logging(level: Optional[str] = None, json_format: Optional[bool] = None, stream=None) -> logging.Logger:
+    """Attach a handler to the ``ucr`` logger for command-line runs.
+
+    Logs go to stderr so stdout stays clean for the JSON results. Calling this
+    more than once only updates the level and format.
+    """
+    logger = logging.getLogger(ROOT_LOGGER)
+    logger.setLevel(level or UCR_LOG_LEVEL)
+    use_json = UCR_LOG_JSON if json_format is None else json_format
+    formatter = JsonFormatter() if use_json else logging.Formatter(
+        "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+    handler = next((h for h in logger.handlers if getattr(h, "_ucr_handler", False)), None)
+    if handler is None:
+        handler = logging.StreamHandler(stream or sys.stderr)
+        handler._ucr_handler = True
+        logger.addHandler(handler)
+        logger.propagate = False
+    handler.setFormatter(formatter)
+    return logger
+
+
+class BatchSampler:
+    """Decides which rows of a batch get an INFO progress line.
+
+    The first and last rows and every ``every``-th row are sampled; failures
+    should be logged unconditionally by the caller. ``first_index`` is the
+    index of the first row, e.g. 2 for spreadsheet rows below a header.
+    """
+
+    def __init__(self, total: Optional[int] = None, every: int = UCR_LOG_SAMPLE_EVERY, first_index: int = 1):
+        self.total = total
+        self.every = max(1, every)
+        self.first_index = first_index
+        self.ok = 0
+        self.failed = 0
+        self.started = time.time()
+
+    def record(self, ok: bool) -> None:
+        if ok:
+            self.ok += 1
+        else:
+            self.failed += 1
+
+    def sampled(self, index: int) -> bool:
+        position = index - self.first_index + 1
+        return position == 1 or position % self.every == 0 or (self.total is not None and position == self.total)
+
+    def fields(self) -> Dict[str, Any]:
+        return {
+            "ok": self.ok,
+            "failed": self.failed,
+            "total": self.total,
+            "elapsed_s": round(time.time() - self.started, 1),
+        }
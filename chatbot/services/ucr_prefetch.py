@@ -0,0 +1,220 @@
+"""Off-peak prefetch of UCR fees for a CPT x ZIP grid.
+
+Expands a CPT list and a ZIP list for one service date into a de-duplicated
+work matrix and fills the UCR cache through the batch runner's browser
+session. Cells already in the cache are skipped, so re-running the same job
+resumes where it stopped; progress is recorded in ``ucr_prefetch_jobs``.
+
+Usage:
+    python -m chatbot.services.ucr_prefetch <acctkey> --date 2025-09-12 \\
+        --zips 77449,90001 --cpt-file cpts.txt [--cpt-from-snapshots exel] \\
+        [--offpeak 22-6]
+"""
+import argparse
+import hashlib
+import os
+import re
+import sys
+import time
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from .playwright_ucr import UCRFetchSession
+from .ucr_batch_runner import lookup_ucr
+from .ucr_cache import account_id, cached_keys, get_job, normalize_service_date, save_job
+from .ucr_logging import configure_logging, get_logger
+
+logger = get_logger("prefetch")
+
+WorkItem = Tuple[str, str, str]  # (procedure_code, zip_code, service_date)
+
+
+def build_work_matrix(
+    cpt_codes: Iterable[str],
+    zip_codes: Iterable[str],
+    service_date: str,
+) -> Tuple[List[WorkItem], List[str]]:
+    """Expand CPT x ZIP for one date into unique, normalized work items.
+
+    Returns (items, rejected) where rejected lists inputs that could not be
+    normalized. Order follows the inputs so progress is predictable.
+    """
+    rejected: List[str] = []
+    date = normalize_service_date(service_date)
+    if not date:
+        return [], [f"date:{service_date}"]
+
+    cpts: List[str] = []
+    for raw in cpt_codes:
+        code = re.sub(r"\D", "", str(raw))
+        if not code:
+            rejected.append(f"cpt:{raw}")
+        elif code not in cpts:
+            cpts.append(code)
+
+    zips: List[str] = []
+    for raw in zip_codes:
+        digits = re.sub(r"\D", "", str(raw))
+        z = digits.zfill(5)
+        if not digits or not re.match(r"^\d{5}$", z):
+            rejected.append(f"zip:{raw}")
+        elif z not in zips:
+            zips.append(z)
+
+    return [(cpt, z, date) for z in zips for cpt in cpts], rejected
+
+
+def parse_offpeak_window(spec: Optional[str]) -> Optional[Tuple[int, int]]:
+    """Parse "22-6" into (22, 6). The window may wrap past midnight."""
+    if not spec:
+        return None
+    start, end = (int(part) % 24 for part in spec.split("-", 1))
+    return start, end
+
+
+def in_window(window: Optional[Tuple[int, int]], now: Optional[datetime] = None) -> bool:
+    if window is None:
+        return True
+    hour = (now or datetime.now()).hour
+    start, end = window
+    if start == end:
+        return True
+    if start < end:
+        return start <= hour < end
+    return hour >= start or hour < end
+
+
+def seconds_until_window(window: Optional[Tuple[int, int]], now: Optional[datetime] = None) -> float:
+    if in_window(window, now):
+        return 0.0
+    now = now or datetime.now()
+    hours_ahead = (window[0] - now.hour) % 24
+    return max(60.0, hours_ahead * 3600 - now.minute * 60 - now.second)
+
+
+def job_id_for(acctkey: str, items: List[WorkItem]) -> str:
+    """Jobs are per account, like the cache they fill (accounts are hashed as in ucr_cache)."""
+    lines = [account_id(acctkey)] + ["|".join(item) for item in sorted(items)]
+    digest = hashlib.sha1("\n".join(lines).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def run_prefetch(
+    acctkey: str,
+    cpt_codes: Iterable[str],
+    zip_codes: Iterable[str],
+    service_date: str,
+    offpeak: Optional[str] = None,
+    progress: Optional[Callable[[Dict], None]] = None,
+    progress_every: int = 10,
+) -> Dict:
+    """Fill the UCR cache for every CPT x ZIP cell not already cached.
+
+    Work only runs inside the off-peak window; outside it the browser is
+    closed and the job sleeps until the window reopens.
+    """
+    items, rejected = build_work_matrix(cpt_codes, zip_codes, service_date)
+    job_id = job_id_for(acctkey, items)
+    window = parse_offpeak_window(offpeak)
+    params = {"service_date": service_date, "cells": len(items), "offpeak": offpeak}
+
+    already = cached_keys(acctkey, items)
+    pending = [item for item in items if item not in already]
+    state = {
+        "job_id": job_id,
+        "total": len(items),
+        "cached": len(already),
+        "fetched": 0,
+        "failed": 0,
+        "rejected": rejected,
+    }
+    previous = get_job(job_id)
+    if previous and previous["status"] != "done":
+        logger.info("Resuming prefetch job %s: %d/%d cells already cached", job_id, len(already), len(items))
+
+    def report(status: str) -> None:
+        done = state["cached"] + state["fetched"]
+        save_job(job_id, params, state["total"], done, state["failed"], status)
+        state["status"] = status
+        if progress:
+            progress(dict(state))
+        else:
+            pct = 100.0 * done / state["total"] if state["total"] else 100.0
+            logger.info(
+                "Prefetch %s: %d/%d (%.1f%%) fetched=%d failed=%d status=%s",
+                job_id, done, state["total"], pct, state["fetched"], state["failed"], status,
+                extra={"ucr": {"job_id": job_id, "done": done, "total": state["total"],
+                               "fetched": state["fetched"], "failed": state["failed"], "status": status}},
+            )
+
+    if pending:
+        report("running")
+    started = time.time()
+    queue = list(pending)
+    while queue:
+        wait = seconds_until_window(window)
+        if wait:
+            report("waiting")
+            time.sleep(wait)
+            continue
+
+        with UCRFetchSession() as session:
+            while queue and in_window(window):
+                cpt, zip_code, date = queue.pop(0)
+                parsed, _, err = lookup_ucr(session, acctkey, date, cpt, zip_code)
+                if parsed is not None and parsed.get("percentiles"):
+                    state["fetched"] += 1
+                else:
+                    state["failed"] += 1
+                    logger.warning("Prefetch %s/%s/%s: failed %s", cpt, zip_code, date, err or "no percentiles")
+                if (state["fetched"] + state["failed"]) % progress_every == 0:
+                    report("running")
+
+    state["elapsed_s"] = round(time.time() - started, 1)
+    report("done")
+    return state
+
+
+def _read_list(value: Optional[str], path: Optional[str]) -> List[str]:
+    items: List[str] = []
+    if value:
+        items.extend(v.strip() for v in value.split(","))
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                items.extend(v.strip() for v in line.split(","))
+    return [i for i in items if i]
+
+
+def cpts_from_snapshots(directory: str) -> List[str]:
+    """Collect CPT codes from saved snapshot names like row_10_15120_77449.html."""
+    codes = []
+    for name in sorted(os.listdir(directory)):
+        m = re.match(r"^row_\d+_(\d+)_\d{5}\.html$", name)
+        if m and m.group(1) not in codes:
+            codes.append(m.group(1))
+    return codes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prefetch UCR fees for a CPT x ZIP grid into the cache")
+    parser.add_argument("acctkey", help="UCR account key")
+    parser.add_argument("--date", required=True, help="Service date (YYYY-MM-DD or MM/DD/YYYY)")
+    parser.add_argument("--cpt", help="Comma-separated CPT codes")
+    parser.add_argument("--cpt-file", help="File of CPT codes (one per line or comma-separated)")
+    parser.add_argument("--cpt-from-snapshots", help="Directory of row_*_<cpt>_<zip>.html snapshots")
+    parser.add_argument("--zips", help="Comma-separated ZIP codes")
+    parser.add_argument("--zip-file", help="File of ZIP codes")
+    parser.add_argument("--offpeak", help="Local-hour window to run in, e.g. 22-6")
+    args = parser.parse_args()
+    configure_logging()
+
+    cpts = _read_list(args.cpt, args.cpt_file)
+    if args.cpt_from_snapshots:
+        cpts.extend(cpts_from_snapshots(args.cpt_from_snapshots))
+    zips = _read_list(args.zips, args.zip_file)
+    if not cpts or not zips:
+        parser.error("at least one CPT code and one ZIP code are required")
+
+    summary = run_prefetch(args.acctkey, cpts, zips, args.date, offpeak=args.offpeak)
+    sys.exit(0 if summary["failed"] == 0 else 1)
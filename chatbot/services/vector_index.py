@@ -0,0 +1,370 @@
+"""Dense vector index of document chunks, for semantic retrieval.
+
+Chunks are embedded locally, without a model download or an outside service.
+The character trigrams of each chunk's words are hashed into a VECTOR_DIM
+vector, which is L2 normalized. Trigrams make related word forms such as
+"migrate" and "migration" land close together, which BM25's exact terms
+miss. Queries are embedded the same way and compared by cosine similarity.
+
+Each user has two append-only files under VECTOR_INDEX_DIR:
+vectors.<dim>.f32, a float32 matrix with one row per chunk, and
+ids.<dim>.i64, the chunk id of each row. They are opened lazily as
+read-only np.memmap arrays, so gunicorn workers share the same pages through
+the OS page cache. Once a user has VECTOR_IVF_MIN_ROWS rows, an IVF
+partitioning is built: rows are assigned to k-means centroids, and a query
+only scans the VECTOR_IVF_NPROBE closest partitions, plus any rows added
+since the last build.
+
+Rows of re-indexed documents stay in the files but point at chunk ids that no
+longer exist, so they are dropped when results are looked up. Whenever the IVF
+partitioning is rebuilt, the files are first compacted to the rows whose
+chunks still exist.
+"""
+import datetime
+import logging
+import os
+import re
+import threading
+import zlib
+from collections import Counter
+from contextlib import contextmanager
+
+from services import config, retrieval, sqlite_pool
+
+# Check if numpy is available
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# File locks keep appends from several gunicorn workers apart (POSIX only)
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+DIM = config.VECTOR_DIM
+VECTOR_BYTES = DIM * 4
+ID_BYTES = 8
+KMEANS_ITERATIONS = 8
+ID_LOOKUP_BATCH = 900  # chunk ids per query, under SQLite's variable limit
+
+_lock = threading.Lock()  # guards the two dicts below, never held for long
+_open_indexes = {}
+_user_locks = {}  # one writer per user in this process; the file lock covers other processes
+
+
+def init_vector_db():
+    """Create the table recording which documents have been embedded"""
+    sqlite_pool.connection().execute('''
+    CREATE TABLE IF NOT EXISTS vector_documents (
+        document_id TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        first_chunk_id INTEGER,
+        chunk_count INTEGER NOT NULL,
+        embedded_at TEXT NOT NULL
+    )
+    ''')
+
+# Initialize the table on import
+init_vector_db()
+
+
+def is_enabled():
+    return NUMPY_AVAILABLE and config.VECTOR_INDEX_ENABLED
+
+
+def _features(text):
+    for token in retrieval.tokenize(text):
+        padded = f"#{token}#"
+        for i in range(len(padded) - 2):
+            yield padded[i:i + 3]
+
+
+def embed(texts):
+    """Embed texts as L2-normalized float32 rows"""
+    vectors = np.zeros((len(texts), DIM), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for feature, count in Counter(_features(text)).items():
+            h = zlib.crc32(feature.encode('utf-8'))
+            # Low bits pick the dimension, the top bit the sign
+            vectors[row, h % DIM] += np.sqrt(count) * (1.0 if h & 0x80000000 else -1.0)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _user_dir(user_id):
+    return os.path.join(config.VECTOR_INDEX_DIR, re.sub(r'[^\w-]', '_', str(user_id)))
+
+
+def _paths(user_id):
+    user_dir = _user_dir(user_id)
+    return (
+        os.path.join(user_dir, f"vectors.{DIM}.f32"),
+        os.path.join(user_dir, f"ids.{DIM}.i64"),
+        os.path.join(user_dir, f"ivf.{DIM}.npz"),
+    )
+
+
+def _row_count(vectors_path, ids_path):
+    """Rows present in both files (a crash mid-append can leave one longer)"""
+    if not os.path.exists(vectors_path) or not os.path.exists(ids_path):
+        return 0
+    return min(os.path.getsize(vectors_path) // VECTOR_BYTES, os.path.getsize(ids_path) // ID_BYTES)
+
+
+@contextmanager
+def _file_lock(user_id, mode):
+    user_dir = _user_dir(user_id)
+    os.makedirs(user_dir, exist_ok=True)
+    with open(os.path.join(user_dir, '.lock'), 'a') as lock_file:
+        if FCNTL_AVAILABLE:
+            fcntl.flock(lock_file, mode)
+        try:
+            yield
+        finally:
+            if FCNTL_AVAILABLE:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@contextmanager
+def _write_lock(user_id):
+    with _lock:
+        user_lock = _user_locks.setdefault(str(user_id), threading.Lock())
+    with user_lock, _file_lock(user_id, fcntl.LOCK_EX if FCNTL_AVAILABLE else None):
+        yield
+
+
+@contextmanager
+def _read_lock(user_id):
+    """Keeps a compaction from replacing the files while they are being opened"""
+    with _file_lock(user_id, fcntl.LOCK_SH if FCNTL_AVAILABLE else None):
+        yield
+
+
+def add_document(document_id, user_id):
+    """Embed a document's chunks (from the retrieval index) and append them to the user's index"""
+    if not is_enabled():
+        return 0
+    chunks = retrieval.document_chunks(document_id)
+    if chunks:
+        vectors = embed([text for _, text in chunks])
+        ids = np.array([chunk_id for chunk_id, _ in chunks], dtype=np.int64)
+    vectors_path, ids_path, ivf_path = _paths(user_id)
+    with _write_lock(user_id):
+        if chunks:
+            rows = _row_count(vectors_path, ids_path)
+            with open(vectors_path, 'ab') as vectors_file, open(ids_path, 'ab') as ids_file:
+                # Drop a partial row left by an interrupted append
+                vectors_file.truncate(rows * VECTOR_BYTES)
+                ids_file.truncate(rows * ID_BYTES)
+                vectors_file.write(vectors.tobytes())
+                ids_file.write(ids.tobytes())
+            rows += len(chunks)
+            if rows >= config.VECTOR_IVF_MIN_ROWS and _ivf_stale(ivf_path, rows):
+                rows = _compact(user_id, rows)
+                if rows >= config.VECTOR_IVF_MIN_ROWS:
+                    _build_ivf(user_id, rows)
+
+        # Recorded under the file lock, in the order the rows were appended
+        with sqlite_pool.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO vector_documents (document_id, user_id, first_chunk_id, chunk_count, embedded_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (str(document_id), str(user_id), chunks[0][0] if chunks else None, len(chunks),
+                 datetime.datetime.utcnow().isoformat())
+            )
+    return len(chunks)
+
+
+def ensure_embedded(document_id, user_id):
+    """Embed a document if it hasn't been, or its chunks changed since"""
+    if not is_enabled():
+        return
+    conn = sqlite_pool.connection()
+    row = conn.execute(
+        "SELECT first_chunk_id FROM vector_documents WHERE document_id = ?", (str(document_id),)
+    ).fetchone()
+    first = conn.execute(
+        "SELECT MIN(chunk_id) FROM doc_chunks WHERE document_id = ?", (str(document_id),)
+    ).fetchone()[0]
+    if row is None or row[0] != first:
+        add_document(document_id, user_id)
+
+
+def _ivf_stale(ivf_path, rows):
+    """True if there's no IVF yet or over a quarter of the rows were added after it was built"""
+    if not os.path.exists(ivf_path):
+        return True
+    with np.load(ivf_path) as ivf:
+        built = len(ivf['assign'])
+    return rows - built > rows // 4
+
+
+def _existing_chunk_ids(chunk_ids):
+    """The given chunk ids that are still in the retrieval index"""
+    conn = sqlite_pool.connection()
+    existing = []
+    for start in range(0, len(chunk_ids), ID_LOOKUP_BATCH):
+        batch = chunk_ids[start:start + ID_LOOKUP_BATCH]
+        existing.extend(row[0] for row in conn.execute(
+            f"SELECT chunk_id FROM doc_chunks WHERE chunk_id IN ({','.join('?' * len(batch))})", batch
+        ))
+    return existing
+
+
+def _compact(user_id, rows):
+    """Rewrite the user's files without rows of deleted chunks (or repeated ones); returns the row count.
+
+    Called with the write lock held. The IVF file is removed when rows are
+    dropped, since its assignments are by row number.
+    """
+    vectors_path, ids_path, ivf_path = _paths(user_id)
+    ids = np.fromfile(ids_path, dtype=np.int64, count=rows)
+    unique_ids, first_rows = np.unique(ids, return_index=True)
+    keep = np.sort(first_rows[np.isin(unique_ids, _existing_chunk_ids(unique_ids.tolist()))])
+    if len(keep) == rows:
+        return rows
+
+    vectors = np.memmap(vectors_path, dtype=np.float32, mode='r', shape=(rows, DIM))
+    with open(vectors_path + '.tmp', 'wb') as vectors_file:
+        for start in range(0, len(keep), 65536):
+            vectors_file.write(np.asarray(vectors[keep[start:start + 65536]]).tobytes())
+    del vectors
+    ids[keep].tofile(ids_path + '.tmp')
+    # Readers take the shared lock to open the files, so they never see one replaced without the other
+    os.replace(vectors_path + '.tmp', vectors_path)
+    os.replace(ids_path + '.tmp', ids_path)
+    if os.path.exists(ivf_path):
+        os.remove(ivf_path)
+    logger.info("Compacted vector index for user %s: %d of %d rows kept", user_id, len(keep), rows)
+    return len(keep)
+
+
+def _build_ivf(user_id, rows):
+    """Spherical k-means over the user's vectors; writes centroids and row assignments"""
+    vectors_path, _, ivf_path = _paths(user_id)
+    vectors = np.memmap(vectors_path, dtype=np.float32, mode='r', shape=(rows, DIM))
+    nlist = max(2, int(np.sqrt(rows)))
+    rng = np.random.default_rng(0)
+    sample = np.asarray(vectors[np.sort(rng.choice(rows, size=min(rows, nlist * 40), replace=False))])
+    centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        nearest = np.argmax(sample @ centroids.T, axis=1)
+        for c in range(nlist):
+            members = sample[nearest == c]
+            if len(members):
+                centroid = members.sum(axis=0)
+                centroids[c] = centroid / max(np.linalg.norm(centroid), 1e-12)
+
+    assign = np.empty(rows, dtype=np.int32)
+    for start in range(0, rows, 65536):
+        assign[start:start + 65536] = np.argmax(np.asarray(vectors[start:start + 65536]) @ centroids.T, axis=1)
+    tmp_path = ivf_path + '.tmp.npz'
+    np.savez(tmp_path, centroids=centroids, assign=assign)
+    os.replace(tmp_path, ivf_path)
+    logger.info("Built IVF index for user %s: %d rows in %d partitions", user_id, rows, nlist)
+
+
+def _file_state(user_id):
+    """(rows, vectors file inode, IVF mtime): changes on every append, compaction and IVF build"""
+    vectors_path, ids_path, ivf_path = _paths(user_id)
+    rows = _row_count(vectors_path, ids_path)
+    if rows == 0:
+        return 0, None, None
+    try:
+        inode = os.stat(vectors_path).st_ino
+        ivf_mtime = os.path.getmtime(ivf_path) if os.path.exists(ivf_path) else None
+    except FileNotFoundError:
+        # Replaced by a compaction in the meantime
+        return rows, None, None
+    return rows, inode, ivf_mtime
+
+
+def _open(user_id):
+    """The user's index as memmaps, reopened when another worker has changed it"""
+    key = str(user_id)
+    state = _file_state(user_id)
+    with _lock:
+        index = _open_indexes.get(key)
+        if index and index['state'] == state:
+            return index
+    if state[0] == 0:
+        return None
+    vectors_path, ids_path, ivf_path = _paths(user_id)
+    with _read_lock(user_id):
+        state = _file_state(user_id)
+        rows, _, ivf_mtime = state
+        if rows == 0:
+            return None
+        index = {
+            'state': state,
+            'rows': rows,
+            'vectors': np.memmap(vectors_path, dtype=np.float32, mode='r', shape=(rows, DIM)),
+            'ids': np.memmap(ids_path, dtype=np.int64, mode='r', shape=(rows,)),
+            'centroids': None,
+            'assign': None,
+        }
+        if ivf_mtime is not None:
+            with np.load(ivf_path) as ivf:
+                index['centroids'] = ivf['centroids']
+                index['assign'] = ivf['assign']
+    with _lock:
+        _open_indexes[key] = index
+    return index
+
+
+def _candidate_rows(index, query):
+    """Rows to scan: all of them, or the closest IVF partitions plus rows added since the build"""
+    if index['centroids'] is None:
+        return None
+    probe = np.argsort(index['centroids'] @ query)[::-1][:config.VECTOR_IVF_NPROBE]
+    built = len(index['assign'])
+    return np.concatenate([
+        np.flatnonzero(np.isin(index['assign'], probe)),
+        np.arange(built, index['rows']),
+    ])
+
+
+def search(user_id, query, document_ids=None, top_k=None):
+    """Top-k chunks by cosine similarity, in the same format as retrieval.search"""
+    if not is_enabled():
+        return []
+    top_k = top_k or config.RETRIEVAL_TOP_K
+    index = _open(user_id)
+    if index is None:
+        return []
+    q = embed([query])[0]
+    if not q.any():
+        return []
+
+    rows = _candidate_rows(index, q)
+    if document_ids:
+        allowed = np.isin(index['ids'] if rows is None else index['ids'][rows], retrieval.chunk_ids_for(user_id, document_ids))
+        rows = np.flatnonzero(allowed) if rows is None else rows[allowed]
+    if rows is None:
+        scores = index['vectors'] @ q
+        rows = np.arange(index['rows'])
+    else:
+        scores = index['vectors'][rows] @ q
+    if not len(rows):
+        return []
+
+    # Over-fetch, since rows of re-indexed documents point at deleted chunks
+    fetch = min(len(rows), top_k * 4)
+    best = np.argpartition(-scores, fetch - 1)[:fetch]
+    best = best[np.argsort(-scores[best])]
+    chunk_ids = [int(index['ids'][rows[i]]) for i in best]
+    chunks = retrieval.get_chunks(chunk_ids)
+    hits = []
+    for i, chunk_id in zip(best, chunk_ids):
+        if chunk_id in chunks:
+            hits.append(dict(chunks[chunk_id], score=round(float(scores[i]), 4)))
+            if len(hits) == top_k:
+                break
+    return hits
+
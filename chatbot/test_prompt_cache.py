@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Prompt caching check.
+
+Checks that Anthropic requests send the prompt's stable prefix (instructions
+and document context) as a system block marked with cache_control, the same
+for every question about the same context, and that cached prompt tokens
+reported by a provider are recorded in api_usage and the daily rollup. Usage
+is recorded in a fresh database in a temporary directory.
+
+Usage (from chatbot/):
+    python test_prompt_cache.py
+or under pytest:
+    python -m pytest test_prompt_cache.py
+"""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+CONTEXT = "Pumps must be primed before they are started. " * 20
+
+
+def payload_problems():
+    """Problems found in the Anthropic request bodies of two questions about the same context"""
+    from services import ai_service
+
+    problems = []
+    model = ai_service.api_manager.AI_PROVIDERS['anthropic']['default_model']
+    first = ai_service._anthropic_payload(ai_service.build_prompt("How do I start a pump?", CONTEXT, 'anthropic', model)[0], model)
+    second = ai_service._anthropic_payload(ai_service.build_prompt("What is priming?", CONTEXT, 'anthropic', model)[0], model)
+    system = first.get('system') or [{}]
+    if system[0].get('cache_control') != {'type': 'ephemeral'}:
+        problems.append(f"system block not marked for caching: {system[0].get('cache_control')}")
+    if CONTEXT.strip() not in system[0].get('text', ''):
+        problems.append("document context is not in the cached system block")
+    if first.get('system') != second.get('system'):
+        problems.append("system block differs between questions about the same context")
+    question = "How do I start a pump?"
+    if question in system[0].get('text', '') or question not in first['messages'][-1]['content']:
+        problems.append("question is not sent after the cached prefix")
+    return problems
+
+
+def usage_problems():
+    """Problems found recording an Anthropic response that read 900 tokens from the prompt cache"""
+    from services import api_manager, config, provider_clients, sqlite_pool
+    original_path = config.SQLITE_DB_PATH
+    config.SQLITE_DB_PATH = os.path.join(tempfile.mkdtemp(), 'prompt_cache.db')
+    try:
+        api_manager.init_api_db()
+        usage = provider_clients.normalize_usage(
+            {'input_tokens': 100, 'cache_read_input_tokens': 900, 'output_tokens': 50}
+        )
+        api_manager.record_api_usage('u', 'anthropic', api_manager.SYSTEM_KEY_ID, 'chat', usage, 'claude')
+        conn = sqlite_pool.connection()
+        row = conn.execute("SELECT input_tokens, output_tokens, cached_tokens FROM api_usage WHERE user_id = 'u'").fetchone()
+        daily = conn.execute("SELECT input_tokens, cached_tokens FROM api_usage_daily WHERE user_id = 'u'").fetchone()
+    finally:
+        config.SQLITE_DB_PATH = original_path
+
+    problems = []
+    if tuple(row or ()) != (1000, 50, 900):
+        problems.append(f"api_usage row (input, output, cached): {tuple(row or ())}, expected (1000, 50, 900)")
+    if tuple(daily or ()) != (1000, 900):
+        problems.append(f"api_usage_daily row (input, cached): {tuple(daily or ())}, expected (1000, 900)")
+    return problems
+
+
+def test_anthropic_prefix_is_cacheable():
+    problems = payload_problems()
+    assert not problems, "\n".join(problems)
+
+
+def test_cached_tokens_are_recorded():
+    problems = usage_problems()
+    assert not problems, "\n".join(problems)
+
+
+if __name__ == '__main__':
+    problems = payload_problems() + usage_problems()
+    if problems:
+        print("Prompt caching problems:")
+        for problem in problems:
+            print("  " + problem)
+        sys.exit(1)
+    print("OK: prompt prefix is cacheable and cached tokens are recorded")
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Query plan regression check for the hot SQLite queries.
+
+Builds a fresh database in a temporary directory (creating its tables
+explicitly, so it works whether or not the services were imported already),
+applies every schema migration and runs EXPLAIN QUERY PLAN on the queries made on each request
+(the same SQL as in services/db.py, api_manager.py, retrieval.py and
+response_cache.py). Fails if any of them scans a whole table, or sorts in a
+temporary B-tree where an index should give the order. Update HOT_QUERIES
+when one of those queries changes.
+
+Usage (from chatbot/):
+    python test_query_plans.py
+or under pytest:
+    python -m pytest test_query_plans.py
+"""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+# (name, sql, params, ordered) - ordered queries must get their ORDER BY from an index
+HOT_QUERIES = [
+    ("user documents", "SELECT * FROM documents WHERE user_id = ? ORDER BY created_at DESC", ('u',), True),
+    ("document", "SELECT * FROM documents WHERE id = ? AND user_id = ?", ('d', 'u'), False),
+    ("user conversations", "SELECT * FROM conversations WHERE user_id = ? ORDER BY created_at DESC", ('u',), True),
+    ("conversation", "SELECT * FROM conversations WHERE id = ? AND user_id = ?", ('c', 'u'), False),
+    ("conversation messages", "SELECT * FROM messages WHERE conversation_id = ? ORDER BY timestamp ASC", ('c',), True),
+    ("user by email", "SELECT * FROM users WHERE email = ?", ('a@b.c',), False),
+    ("user API keys", "SELECT * FROM api_keys WHERE user_id = ? ORDER BY provider, is_default DESC", ('u',), True),
+    ("default API key", "SELECT * FROM api_keys WHERE user_id = ? AND provider = ? AND is_default = 1", ('u', 'groq'), False),
+    ("any API key", "SELECT * FROM api_keys WHERE user_id = ? AND provider = ? LIMIT 1", ('u', 'groq'), False),
+    ("usage summary",
+     "SELECT provider, api_key_id, day, requests, input_tokens, output_tokens, cached_tokens FROM api_usage_daily "
+     "WHERE user_id = ? AND day >= ? ORDER BY day DESC, provider", ('u', '2024-01-01'), False),
+    ("free tier usage",
+     "SELECT COALESCE(SUM(requests), 0) FROM api_usage_daily WHERE user_id = ? AND provider = ? AND api_key_id = ? AND day >= ?",
+     ('u', 'groq', 'system', '2024-01-01'), False),
+    ("retrieval stats",
+     "SELECT COALESCE(SUM(chunk_count), 0), COALESCE(SUM(total_length), 0) FROM doc_index_stats WHERE user_id = ?", ('u',), False),
+    ("retrieval postings",
+     "SELECT p.term, p.chunk_id, p.tf, c.length FROM chunk_postings p JOIN doc_chunks c ON c.chunk_id = p.chunk_id "
+     "WHERE p.user_id = ? AND p.term IN (?, ?)", ('u', 'pump', 'valve'), False),
+    ("document chunks", "SELECT chunk_id, text FROM doc_chunks WHERE document_id = ? ORDER BY ordinal", ('d',), True),
+    ("response cache expiry", "DELETE FROM response_cache WHERE created_at < ?", (0,), False),
+    ("idempotency expiry", "DELETE FROM idempotency_keys WHERE created_at <= ?", (0,), False),
+]
+
+
+def create_schema():
+    """Create every table the hot queries use in the SQLITE_DB_PATH database, then migrate it"""
+    from services import api_manager, db, idempotency, migrations, response_cache, retrieval
+    # The modules created their tables on import, possibly in another database
+    db.init_db()
+    api_manager.init_api_db()
+    response_cache.init_cache_db()
+    retrieval.init_retrieval_db()
+    idempotency.init_idempotency_db()
+    migrations.migrate()
+
+
+def query_plan_problems():
+    """Problems found in the hot queries' plans, as 'name: plan detail' strings"""
+    from services import config, sqlite_pool
+    original_path = config.SQLITE_DB_PATH
+    config.SQLITE_DB_PATH = os.path.join(tempfile.mkdtemp(), 'query_plans.db')
+    try:
+        create_schema()
+        problems = []
+        conn = sqlite_pool.connection()
+        for name, sql, params, ordered in HOT_QUERIES:
+            details = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+            for detail in details:
+                if detail.startswith('SCAN '):
+                    problems.append(f"{name}: {detail}")
+                elif ordered and 'TEMP B-TREE' in detail:
+                    problems.append(f"{name}: {detail}")
+        return problems
+    finally:
+        config.SQLITE_DB_PATH = original_path
+
+
+def test_hot_queries_use_indexes():
+    problems = query_plan_problems()
+    assert not problems, "Hot queries regressed:\n" + "\n".join(problems)
+
+
+if __name__ == '__main__':
+    problems = query_plan_problems()
+    if problems:
+        print("Hot queries regressed:")
+        for problem in problems:
+            print("  " + problem)
+        sys.exit(1)
+    print(f"OK: {len(HOT_QUERIES)} hot queries use indexes")
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Coalescing and idempotency check for /api/chat.
+
+Runs the app against mock_llm_server.py (as Groq) with a fresh database in a
+temporary directory, and checks that:
+
+- identical chat requests sent at the same time make one provider call and
+  save one exchange, and all get the same answer (services/single_flight.py)
+- a retry with the same Idempotency-Key is answered from the stored result,
+  with an Idempotent-Replayed header and no provider call
+- reusing an Idempotency-Key for a different request is rejected with 422
+- a stored result is no longer replayed after IDEMPOTENCY_TTL
+  (services/idempotency.py)
+
+Usage (from chatbot/):
+    python test_request_coalescing.py
+or under pytest:
+    python -m pytest test_request_coalescing.py
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+sys.path.insert(1, os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+
+CONCURRENT_REQUESTS = 5
+PROVIDER_LATENCY_MS = 400
+
+
+def create_schema():
+    """Create every table a chat request uses in the SQLITE_DB_PATH database"""
+    from services import (api_manager, db, idempotency, migrations, model_router, quota, response_cache,
+                          retrieval, token_budget, vector_index)
+    # The modules created their tables on import, possibly in another database
+    db.init_db()
+    api_manager.init_api_db()
+    idempotency.init_idempotency_db()
+    model_router.init_routing_db()
+    quota.init_quota_db()
+    response_cache.init_cache_db()
+    retrieval.init_retrieval_db()
+    token_budget.init_token_db()
+    vector_index.init_vector_db()
+    migrations.migrate()
+
+
+def coalescing_problems():
+    """Problems found in how /api/chat coalesces and replays requests, as strings"""
+    import mock_llm_server
+    import app as appmod
+    from services import api_manager, config, db
+    from utils import auth_utils
+
+    calls = []
+    handle = mock_llm_server.MockLLMHandler.do_POST
+
+    def counting_do_post(handler):
+        calls.append(handler.path)
+        return handle(handler)
+
+    server = mock_llm_server.serve(port=0, latency_ms=PROVIDER_LATENCY_MS, jitter_ms=0,
+                                   tokens_per_second=5000, response_tokens=20)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    saved = (config.SQLITE_DB_PATH, config.IDEMPOTENCY_TTL, api_manager.AI_PROVIDERS['groq']['url'])
+    mock_llm_server.MockLLMHandler.do_POST = counting_do_post
+    config.SQLITE_DB_PATH = os.path.join(tempfile.mkdtemp(), 'coalescing.db')
+    api_manager.AI_PROVIDERS['groq']['url'] = f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+    problems = []
+    try:
+        create_schema()
+        auth_utils.register_user('coalesce@example.com', 'pw', 'coalesce')
+        user_id = str(db.get_user_by_email('coalesce@example.com')['_id'])
+        api_manager.save_api_key(user_id, 'groq', 'gsk_test', True)
+        headers = {'Authorization': 'Bearer ' + auth_utils.generate_token(user_id)}
+
+        def chat(message, key=None):
+            extra = {'Idempotency-Key': key} if key else {}
+            return appmod.app.test_client().post('/api/chat', headers=dict(headers, **extra), json={'message': message})
+
+        # Identical requests in flight together
+        start = threading.Barrier(CONCURRENT_REQUESTS)
+        responses = []
+
+        def send():
+            start.wait()
+            responses.append(chat("What does the pump manual say about priming?"))
+
+        threads = [threading.Thread(target=send) for _ in range(CONCURRENT_REQUESTS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if sorted(r.status_code for r in responses) != [200] * CONCURRENT_REQUESTS:
+            problems.append(f"concurrent requests: statuses {[r.status_code for r in responses]}")
+        if len(calls) != 1:
+            problems.append(f"concurrent requests: {len(calls)} provider calls, expected 1")
+        if len({r.json.get('response') for r in responses}) != 1:
+            problems.append("concurrent requests: answers differ")
+        if len(db.get_user_conversations(user_id)) != 1:
+            problems.append(f"concurrent requests: {len(db.get_user_conversations(user_id))} exchanges saved, expected 1")
+
+        # Replay with an Idempotency-Key
+        del calls[:]
+        first = chat("How long does priming take?", key='retry-1')
+        again = chat("How long does priming take?", key='retry-1')
+        if first.status_code != 200 or first.headers.get('Idempotent-Replayed'):
+            problems.append(f"first keyed request: status {first.status_code}, replayed {first.headers.get('Idempotent-Replayed')}")
+        if again.status_code != 200 or again.headers.get('Idempotent-Replayed') != 'true':
+            problems.append(f"keyed retry: status {again.status_code}, replayed {again.headers.get('Idempotent-Replayed')}")
+        if again.json != first.json:
+            problems.append("keyed retry: response differs from the stored one")
+        if len(calls) != 1:
+            problems.append(f"keyed retry: {len(calls)} provider calls, expected 1")
+
+        # The same key for a different request
+        reused = chat("Which valves must be closed?", key='retry-1')
+        if reused.status_code != 422:
+            problems.append(f"reused key: status {reused.status_code}, expected 422")
+
+        # Stored results expire
+        config.IDEMPOTENCY_TTL = 1
+        time.sleep(1.1)
+        conversations = len(db.get_user_conversations(user_id))
+        expired = chat("How long does priming take?", key='retry-1')
+        if expired.status_code != 200 or expired.headers.get('Idempotent-Replayed'):
+            problems.append(f"expired key: status {expired.status_code}, replayed {expired.headers.get('Idempotent-Replayed')}")
+        if len(db.get_user_conversations(user_id)) != conversations + 1:
+            problems.append("expired key: the request was not run again")
+    finally:
+        config.SQLITE_DB_PATH, config.IDEMPOTENCY_TTL, api_manager.AI_PROVIDERS['groq']['url'] = saved
+        mock_llm_server.MockLLMHandler.do_POST = handle
+        server.shutdown()
+    return problems
+
+
+def test_identical_requests_are_coalesced_and_replayed():
+    problems = coalescing_problems()
+    assert not problems, "\n".join(problems)
+
+
+if __name__ == '__main__':
+    problems = coalescing_problems()
+    if problems:
+        print("Request coalescing problems:")
+        for problem in problems:
+            print("  " + problem)
+        sys.exit(1)
+    print("OK: identical requests are coalesced, replayed, rejected on key reuse and expire")
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Load test for /api/chat and /api/chat/stream.
+
+Registers a throwaway user, then sends chat requests from several threads and
+reports throughput, end-to-end latency percentiles, time to first token (in
+--stream mode) and the server's own timings for the provider call and the
+conversation DB write.
+
+Run it against a server pointed at mock_llm_server.py so no real provider
+credits are used:
+    python mock_llm_server.py --latency-ms 300 --tokens-per-second 80 &
+    GROQ_API_URL=http://127.0.0.1:8800/v1/chat/completions python chatbot/app.py &
+    python load_test_chat.py --concurrency 20 --requests 500 --stream
+
+Usage:
+    python load_test_chat.py [--base-url URL] [--concurrency N] [--requests N]
+                             [--provider NAME] [--model NAME] [--api-key KEY]
+                             [--stream] [--repeat-message] [--document-id ID]
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100.0))]
+
+
+def summarize(name, values):
+    if not values:
+        print(f"{name:<18} (no samples)")
+        return
+    print(f"{name:<18} mean={statistics.mean(values):8.1f} ms  p50={percentile(values, 50):8.1f} ms  "
+          f"p95={percentile(values, 95):8.1f} ms  p99={percentile(values, 99):8.1f} ms  max={max(values):8.1f} ms")
+
+
+def register(base_url):
+    """Create a throwaway user and return its token"""
+    email = f"loadtest-{uuid.uuid4().hex[:12]}@example.com"
+    response = requests.post(f"{base_url}/api/auth/register",
+                             json={'email': email, 'password': uuid.uuid4().hex, 'username': 'loadtest'}, timeout=30)
+    response.raise_for_status()
+    return response.json()['token']
+
+
+def chat_once(session, base_url, payload, stream):
+    """Send one chat request; returns a result dict with timings in ms"""
+    start = time.perf_counter()
+    result = {'status': None, 'latency_ms': None, 'ttft_ms': None, 'db_write_ms': None, 'provider_ms': None}
+    try:
+        if not stream:
+            response = session.post(f"{base_url}/api/chat", json=payload, timeout=120)
+            result['status'] = response.status_code
+            if response.status_code == 200:
+                timings = response.json().get('timings') or {}
+                result['db_write_ms'] = timings.get('db_write_ms')
+                result['provider_ms'] = timings.get('provider_ms')
+        else:
+            with session.post(f"{base_url}/api/chat/stream", json=payload, stream=True, timeout=120) as response:
+                result['status'] = response.status_code
+                if response.status_code == 200:
+                    for line in response.iter_lines():
+                        if not line:
+                            continue
+                        event = json.loads(line)
+                        if event['type'] == 'token' and result['ttft_ms'] is None:
+                            result['ttft_ms'] = (time.perf_counter() - start) * 1000
+                        elif event['type'] == 'done':
+                            result['db_write_ms'] = (event.get('timings') or {}).get('db_write_ms')
+                        elif event['type'] == 'error':
+                            result['status'] = 'stream-error'
+    except requests.RequestException as e:
+        result['status'] = type(e).__name__
+    result['latency_ms'] = (time.perf_counter() - start) * 1000
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the chat API')
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--requests', type=int, default=200, help='Total requests to send')
+    parser.add_argument('--provider', default='groq')
+    parser.add_argument('--model')
+    parser.add_argument('--api-key', default='mock-key', help='Sent with each request (the mock accepts any key)')
+    parser.add_argument('--stream', action='store_true', help='Use /api/chat/stream and measure time to first token')
+    parser.add_argument('--repeat-message', action='store_true',
+                        help='Send the same message every time (exercises the response cache)')
+    parser.add_argument('--document-id', help='Ask about this document')
+    args = parser.parse_args()
+
+    base_url = args.base_url.rstrip('/')
+    try:
+        token = register(base_url)
+    except requests.RequestException as e:
+        print(f"Could not register a test user at {base_url}: {e}")
+        sys.exit(1)
+
+    local = threading.local()
+
+    def session():
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+            local.session.headers['Authorization'] = f"Bearer {token}"
+        return local.session
+
+    def run(i):
+        payload = {
+            'message': 'How do I prime the pump?' if args.repeat_message else f'How do I prime pump number {i}?',
+            'provider': args.provider,
+            'model': args.model,
+            'api_key': args.api_key,
+            'document_id': args.document_id,
+        }
+        return chat_once(session(), base_url, payload, args.stream)
+
+    print(f"Sending {args.requests} {'streaming ' if args.stream else ''}requests to {base_url} "
+          f"with concurrency {args.concurrency} (provider {args.provider})")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(run, range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    ok = [r for r in results if r['status'] == 200]
+    statuses = Counter(str(r['status']) for r in results)
+    print(f"\nCompleted {len(results)} requests in {elapsed:.2f} s: {len(ok)} ok, "
+          f"{len(results) - len(ok)} failed {dict(statuses) if len(ok) < len(results) else ''}")
+    print(f"Throughput         {len(ok) / elapsed:8.1f} req/s")
+    summarize('Latency', [r['latency_ms'] for r in ok])
+    if args.stream:
+        summarize('Time to 1st token', [r['ttft_ms'] for r in ok if r['ttft_ms'] is not None])
+    else:
+        summarize('Provider call', [r['provider_ms'] for r in ok if r['provider_ms'] is not None])
+    summarize('DB write', [r['db_write_ms'] for r in ok if r['db_write_ms'] is not None])
+
+
+if __name__ == '__main__':
+    main()
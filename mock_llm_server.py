@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the LLM providers, for load tests and offline development.
+
+Speaks enough of each provider's API for the chatbot:
+    POST /v1/chat/completions   OpenAI and Groq (JSON or SSE stream)
+    POST /v1/messages           Anthropic (JSON or SSE stream)
+    POST /api/chat              Ollama (JSON or NDJSON stream)
+    GET  /health
+
+Replies are filler text of a configurable length, generated at a configurable
+token rate after a configurable time to first token. A share of requests can
+be failed with 500s or 429s. Usage and rate-limit headers are included, so
+token accounting and key scheduling behave as they would against a real
+provider.
+
+Point the app at it with:
+    GROQ_API_URL=http://127.0.0.1:8800/v1/chat/completions
+    OPENAI_API_URL=http://127.0.0.1:8800/v1/chat/completions
+    ANTHROPIC_API_URL=http://127.0.0.1:8800/v1/messages
+    OLLAMA_HOST=http://127.0.0.1:8800
+
+Usage:
+    python mock_llm_server.py [--port 8800] [--latency-ms 300] [--jitter-ms 100]
+                              [--tokens-per-second 80] [--response-tokens 120]
+                              [--error-rate 0.0] [--rate-limit-rate 0.0]
+"""
+
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = ("the pump should be primed before the valve is opened and the pressure "
+         "checked against the manual while the system warms up slowly").split()
+
+
+def estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def prompt_text(body):
+    """All text sent in a request, for the usage numbers"""
+    parts = []
+    system = body.get('system')
+    if isinstance(system, str):
+        parts.append(system)
+    elif isinstance(system, list):
+        parts.extend(block.get('text', '') for block in system)
+    for message in body.get('messages') or []:
+        content = message.get('content')
+        if isinstance(content, str):
+            parts.append(content)
+        elif isinstance(content, list):
+            parts.extend(block.get('text', '') for block in content if isinstance(block, dict))
+    return '\n'.join(parts)
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    settings = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        elif self.path == '/api/tags':
+            self._send_json(200, {'models': [{'name': 'llama3'}, {'name': 'mistral'}]})
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self._send_json(400, {'error': 'invalid JSON'})
+            return
+
+        settings = self.settings
+        roll = random.random()
+        if roll < settings.error_rate:
+            self._send_json(500, {'error': {'message': 'mock provider error', 'type': 'server_error'}})
+            return
+        if roll < settings.error_rate + settings.rate_limit_rate:
+            self._send_json(429, {'error': {'message': 'mock rate limit', 'type': 'rate_limit'}},
+                            {'retry-after': '1', 'x-ratelimit-remaining-requests': '0', 'x-ratelimit-reset-requests': '1s'})
+            return
+
+        first_token = max(0.0, settings.latency_ms + random.uniform(-settings.jitter_ms, settings.jitter_ms)) / 1000.0
+        words = [random.choice(WORDS) for _ in range(settings.response_tokens)]
+        prompt_tokens = estimate_tokens(prompt_text(body))
+
+        if self.path.startswith('/v1/chat/completions'):
+            self._openai(body, words, first_token, prompt_tokens)
+        elif self.path.startswith('/v1/messages'):
+            self._anthropic(body, words, first_token, prompt_tokens)
+        elif self.path.startswith('/api/chat'):
+            self._ollama(body, words, first_token, prompt_tokens)
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    # Responses
+
+    def _openai(self, body, words, first_token, prompt_tokens):
+        usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': len(words),
+                 'total_tokens': prompt_tokens + len(words), 'prompt_tokens_details': {'cached_tokens': 0}}
+        model = body.get('model', 'mock')
+        if not body.get('stream'):
+            self._generate_delay(first_token, words)
+            self._send_json(200, {
+                'id': 'chatcmpl-mock', 'object': 'chat.completion', 'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ' '.join(words)}, 'finish_reason': 'stop'}],
+                'usage': usage,
+            })
+            return
+        self._start_stream('text/event-stream')
+        time.sleep(first_token)
+        for i, word in enumerate(words):
+            chunk = {'choices': [{'index': 0, 'delta': {'content': (' ' if i else '') + word}}], 'model': model}
+            self._chunk('data: ' + json.dumps(chunk) + '\n\n')
+            self._token_delay()
+        if (body.get('stream_options') or {}).get('include_usage'):
+            self._chunk('data: ' + json.dumps({'choices': [], 'usage': usage}) + '\n\n')
+        self._chunk('data: [DONE]\n\n')
+        self._end_stream()
+
+    def _anthropic(self, body, words, first_token, prompt_tokens):
+        usage = {'input_tokens': prompt_tokens, 'output_tokens': len(words),
+                 'cache_read_input_tokens': 0, 'cache_creation_input_tokens': 0}
+        if not body.get('stream'):
+            self._generate_delay(first_token, words)
+            self._send_json(200, {
+                'id': 'msg_mock', 'type': 'message', 'role': 'assistant', 'model': body.get('model', 'mock'),
+                'content': [{'type': 'text', 'text': ' '.join(words)}],
+                'stop_reason': 'end_turn', 'usage': usage,
+            })
+            return
+        self._start_stream('text/event-stream')
+        time.sleep(first_token)
+        self._event('message_start', {'type': 'message_start', 'message': {'usage': dict(usage, output_tokens=1)}})
+        for i, word in enumerate(words):
+            self._event('content_block_delta', {'type': 'content_block_delta', 'index': 0,
+                                                'delta': {'type': 'text_delta', 'text': (' ' if i else '') + word}})
+            self._token_delay()
+        self._event('message_delta', {'type': 'message_delta', 'usage': {'output_tokens': len(words)}})
+        self._event('message_stop', {'type': 'message_stop'})
+        self._end_stream()
+
+    def _ollama(self, body, words, first_token, prompt_tokens):
+        model = body.get('model', 'llama3')
+        created = datetime.now(timezone.utc).isoformat()
+        if not body.get('stream', True):
+            self._generate_delay(first_token, words)
+            self._send_json(200, {
+                'model': model, 'created_at': created,
+                'message': {'role': 'assistant', 'content': ' '.join(words)},
+                'done': True, 'prompt_eval_count': prompt_tokens, 'eval_count': len(words),
+            })
+            return
+        self._start_stream('application/x-ndjson')
+        time.sleep(first_token)
+        for i, word in enumerate(words):
+            self._chunk(json.dumps({'model': model, 'created_at': created, 'done': False,
+                                    'message': {'role': 'assistant', 'content': (' ' if i else '') + word}}) + '\n')
+            self._token_delay()
+        self._chunk(json.dumps({'model': model, 'created_at': created, 'done': True,
+                                'message': {'role': 'assistant', 'content': ''},
+                                'prompt_eval_count': prompt_tokens, 'eval_count': len(words)}) + '\n')
+        self._end_stream()
+
+    # Helpers
+
+    def _generate_delay(self, first_token, words):
+        time.sleep(first_token + len(words) / self.settings.tokens_per_second)
+
+    def _token_delay(self):
+        time.sleep(1.0 / self.settings.tokens_per_second)
+
+    def _rate_limit_headers(self):
+        return {
+            'x-ratelimit-limit-requests': '10000',
+            'x-ratelimit-remaining-requests': '9999',
+            'x-ratelimit-reset-requests': '6ms',
+        }
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in dict(self._rate_limit_headers(), **(headers or {})).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _start_stream(self, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        for name, value in self._rate_limit_headers().items():
+            self.send_header(name, value)
+        self.end_headers()
+
+    def _chunk(self, text):
+        data = text.encode('utf-8')
+        self.wfile.write(b'%x\r\n' % len(data) + data + b'\r\n')
+        self.wfile.flush()
+
+    def _event(self, name, payload):
+        self._chunk(f"event: {name}\ndata: {json.dumps(payload)}\n\n")
+
+    def _end_stream(self):
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+
+def serve(host='127.0.0.1', port=8800, latency_ms=300.0, jitter_ms=100.0, tokens_per_second=80.0,
+          response_tokens=120, error_rate=0.0, rate_limit_rate=0.0):
+    """Create the mock server (not yet serving); call serve_forever() on the result"""
+    settings = argparse.Namespace(
+        latency_ms=latency_ms, jitter_ms=jitter_ms, tokens_per_second=tokens_per_second,
+        response_tokens=response_tokens, error_rate=error_rate, rate_limit_rate=rate_limit_rate,
+    )
+    handler = type('ConfiguredMockLLMHandler', (MockLLMHandler,), {'settings': settings})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mock OpenAI/Groq/Anthropic/Ollama server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8800)
+    parser.add_argument('--latency-ms', type=float, default=300.0, help='Time to first token')
+    parser.add_argument('--jitter-ms', type=float, default=100.0, help='Random +/- added to the latency')
+    parser.add_argument('--tokens-per-second', type=float, default=80.0, help='Generation speed')
+    parser.add_argument('--response-tokens', type=int, default=120, help='Tokens per reply')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered with a 500')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Share of requests answered with a 429')
+    args = parser.parse_args()
+
+    server = serve(args.host, args.port, args.latency_ms, args.jitter_ms, args.tokens_per_second,
+                   args.response_tokens, args.error_rate, args.rate_limit_rate)
+    print(f"Mock LLM server on http://{args.host}:{args.port} "
+          f"(latency {args.latency_ms:.0f}±{args.jitter_ms:.0f} ms, {args.tokens_per_second:.0f} tok/s, "
+          f"{args.response_tokens} tokens, errors {args.error_rate:.0%}, 429s {args.rate_limit_rate:.0%})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()